@@ -0,0 +1,3 @@
+from .kicad import main
+
+main()
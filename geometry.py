@@ -0,0 +1,738 @@
+'''Pluggable 2D geometry backends
+
+A backend implements the planar stages of the PCB pipeline, i.e. primitive
+construction, offset and boolean operations of planar regions, and hands the
+result over to OCC for extrusion.
+
+`OCCBackend` is the default and works on `Part.Shape` using `Path.Area`.
+`NumpyBackend` is a pure Python/NumPy reference implementation working on
+`Region` objects, which does not need FreeCAD except for the final hand-off.
+'''
+
+from math import pi, acos, ceil, sin, cos, radians
+from collections import defaultdict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_backends = {}
+
+def registerBackend(name, cls):
+    '''Register a backend class under the given name'''
+    _backends[name.lower()] = cls
+
+def getBackend(backend=None, **kwds):
+    '''Return a backend instance
+
+    Args:
+        backend: backend name, class or instance. Default to 'occ'
+
+        kwds: arguments passed to the backend constructor
+    '''
+    if backend is None:
+        backend = 'occ'
+    if isinstance(backend, Backend):
+        return backend
+    if isinstance(backend, type):
+        return backend(**kwds)
+    try:
+        cls = _backends[backend.lower()]
+    except KeyError:
+        raise ValueError('unknown geometry backend: {}'.format(backend))
+    return cls(**kwds)
+
+def backendNames():
+    return sorted(_backends)
+
+
+class Backend(object):
+    '''Interface of 2D geometry backends
+
+    Regions are opaque objects of the backend. All sizes are in mm, angles in
+    degree.
+
+    Args:
+        accuracy: maximum deviation when approximating arcs
+    '''
+
+    name = None
+
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+
+    def circle(self, diameter, center=(0,0)):
+        raise NotImplementedError
+
+    def rect(self, width, height, center=(0,0)):
+        raise NotImplementedError
+
+    def oval(self, width, height, center=(0,0)):
+        '''Stadium shape, i.e. a rectangle with rounded short sides'''
+        raise NotImplementedError
+
+    def polygon(self, points):
+        raise NotImplementedError
+
+    def stroke(self, points, width):
+        '''Region covered by an open path of the given width with round ends'''
+        raise NotImplementedError
+
+    def transform(self, region, dx=0, dy=0, angle=0):
+        '''Rotate the region around the origin, and then translate it'''
+        raise NotImplementedError
+
+    def union(self, regions):
+        raise NotImplementedError
+
+    def difference(self, region, tools):
+        raise NotImplementedError
+
+    def intersection(self, region, tools):
+        raise NotImplementedError
+
+    def offset(self, region, distance):
+        '''Grow (positive) or shrink (negative) the region with round joins'''
+        raise NotImplementedError
+
+    def area(self, region):
+        raise NotImplementedError
+
+    def fromShape(self, shape):
+        '''Convert a planar Part.Shape
+
+        Returns (region, paths), where paths are the points of the open wires
+        of the shape, as accepted by stroke().
+        '''
+        raise NotImplementedError
+
+    def toShape(self, region, z=0):
+        '''Convert the region into a Part.Shape of planar faces at z'''
+        raise NotImplementedError
+
+    def extrude(self, region, height, z=0):
+        '''Hand the region over to OCC as a solid'''
+        return self.toShape(region, z).extrude(_vector(0, 0, height))
+
+
+def _vector(x, y, z=0):
+    from FreeCAD import Vector
+    return Vector(x, y, z)
+
+
+class OCCBackend(Backend):
+    '''Default backend using OCC through Part and Path.Area'''
+
+    name = 'occ'
+
+    def _area(self, shapes, op=0, offset=0, fill=1):
+        import Path
+        import Part
+        area = Path.Area(Fill=fill, Coplanar=0, Accuracy=self.accuracy,
+                         Offset=offset)
+        area.setPlane(Part.makeCircle(1))
+        for i,shape in enumerate(shapes):
+            area.add(shape, op=op if i else 0)
+        return area.getShape()
+
+    def _face(self, wire, center):
+        import Part
+        face = Part.Face(wire)
+        face.translate(_vector(*center))
+        return face
+
+    def circle(self, diameter, center=(0,0)):
+        import Part
+        return self._face(Part.Wire(Part.makeCircle(diameter*0.5)), center)
+
+    def rect(self, width, height, center=(0,0)):
+        import Part
+        w = width*0.5
+        h = height*0.5
+        return self._face(Part.makePolygon([_vector(-w,-h), _vector(w,-h),
+                _vector(w,h), _vector(-w,h), _vector(-w,-h)]), center)
+
+    def oval(self, width, height, center=(0,0)):
+        if width == height:
+            return self.circle(width, center)
+        if width > height:
+            points = [(-(width-height)*0.5, 0), ((width-height)*0.5, 0)]
+            d = height
+        else:
+            points = [(0, -(height-width)*0.5), (0, (height-width)*0.5)]
+            d = width
+        face = self.stroke(points, d)
+        face.translate(_vector(*center))
+        return face
+
+    def polygon(self, points):
+        import Part
+        points = [_vector(*p) for p in points]
+        if points[0] != points[-1]:
+            points.append(points[0])
+        return Part.Face(Part.makePolygon(points))
+
+    def stroke(self, points, width):
+        import Part
+        return self._area([Part.makePolygon([_vector(*p) for p in points])],
+                          offset=width*0.5)
+
+    def transform(self, region, dx=0, dy=0, angle=0):
+        region = region.copy()
+        if angle:
+            region.rotate(_vector(0,0), _vector(0,0,1), angle)
+        region.translate(_vector(dx, dy))
+        return region
+
+    def union(self, regions):
+        return self._area(regions)
+
+    def difference(self, region, tools):
+        return self._area([region] + list(tools), op=1)
+
+    def intersection(self, region, tools):
+        return self._area([region] + list(tools), op=2)
+
+    def offset(self, region, distance):
+        return self._area([region], offset=distance)
+
+    def area(self, region):
+        return region.Area
+
+    def fromShape(self, shape):
+        import Part
+        paths = [[(v.x, v.y) for v in w.discretize(Deflection=self.accuracy)]
+                    for w in shape.Wires if not w.isClosed()]
+        if shape.Faces:
+            return shape, paths
+        wires = [w for w in shape.Wires if w.isClosed()]
+        if not wires:
+            return Part.Shape(), paths
+        return self._area([Part.makeCompound(wires)]), paths
+
+    def toShape(self, region, z=0):
+        region = region.copy()
+        if z:
+            region.translate(_vector(0,0,z))
+        return region
+
+registerBackend('occ', OCCBackend)
+
+
+class Region(object):
+    '''Planar region made of rings of points
+
+    Outer rings are counter clockwise, and holes clockwise. Each ring is an
+    (n,2) array of its vertices, without repeating the first one.
+    '''
+
+    def __init__(self, rings=None):
+        self.rings = list(rings or [])
+
+    def __len__(self):
+        return len(self.rings)
+
+    def __bool__(self):
+        return bool(self.rings)
+
+    __nonzero__ = __bool__
+
+    @property
+    def area(self):
+        return sum([ringArea(r) for r in self.rings])
+
+    def bounds(self):
+        if not self.rings:
+            return None
+        pts = numpy.concatenate(self.rings)
+        return tuple(pts.min(axis=0)) + tuple(pts.max(axis=0))
+
+    def outlines(self):
+        '''Return a list of (outer ring, [hole rings])'''
+        outers = []
+        holes = []
+        for r in self.rings:
+            if ringArea(r) > 0:
+                outers.append([r, [], abs(ringArea(r))])
+            else:
+                holes.append(r)
+        # smallest outer first, so that a hole goes to its nearest outer
+        outers.sort(key=lambda o: o[2])
+        for h in holes:
+            x,y = h[0]
+            for o in outers:
+                if pointInRing(o[0], x, y):
+                    o[1].append(h)
+                    break
+        return [(o[0], o[1]) for o in outers]
+
+
+def ringArea(ring):
+    '''Signed area of a ring, positive if counter clockwise'''
+    x = ring[:,0]
+    y = ring[:,1]
+    return 0.5*float(numpy.dot(x, numpy.roll(y,-1)) - numpy.dot(y, numpy.roll(x,-1)))
+
+def pointInRing(ring, x, y):
+    x0 = ring[:,0]
+    y0 = ring[:,1]
+    x1 = numpy.roll(x0,-1)
+    y1 = numpy.roll(y0,-1)
+    cond = (y0 > y) != (y1 > y)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        xs = x0 + (y - y0)*(x1 - x0)/(y1 - y0)
+    return bool(numpy.count_nonzero(cond & (x < xs)) % 2)
+
+def _ringEdges(rings):
+    edges = [numpy.hstack((r, numpy.roll(r,-1,axis=0))) for r in rings if len(r)]
+    if not edges:
+        return numpy.zeros((0,4))
+    return numpy.concatenate(edges)
+
+def windingNumbers(edges, points, chunk=4000000):
+    '''Winding number of each point with respect to the given edges
+
+    Edges are bucketed into horizontal bands by their y range, so that a
+    point is only tested against the edges of its band.
+
+    Args:
+        edges: (m,4) array of (x0,y0,x1,y1)
+        points: (k,2) array
+    '''
+    ret = numpy.zeros(len(points), dtype=int)
+    if not len(edges) or not len(points):
+        return ret
+    ylo = numpy.minimum(edges[:,1], edges[:,3])
+    yhi = numpy.maximum(edges[:,1], edges[:,3])
+    bottom = min(float(ylo.min()), float(points[:,1].min()))
+    top = max(float(yhi.max()), float(points[:,1].max()))
+    count = max(1, min(int(len(edges)**0.5), 4096))
+    height = (top - bottom)/count or 1.0
+
+    def _band(y):
+        return numpy.clip(((y - bottom)/height).astype(int), 0, count-1)
+
+    # (band, edge) pairs of every band an edge spans
+    first = _band(ylo)
+    spans = _band(yhi) - first + 1
+    edge_idx = numpy.repeat(numpy.arange(len(edges)), spans)
+    starts = numpy.cumsum(spans) - spans
+    edge_band = numpy.repeat(first, spans) + \
+            numpy.arange(len(edge_idx)) - numpy.repeat(starts, spans)
+    order = numpy.argsort(edge_band, kind='stable')
+    edge_idx = edge_idx[order]
+    edge_bounds = numpy.searchsorted(edge_band[order], numpy.arange(count+1))
+
+    point_band = _band(points[:,1])
+    point_idx = numpy.argsort(point_band, kind='stable')
+    point_bounds = numpy.searchsorted(point_band[point_idx], numpy.arange(count+1))
+
+    for band in range(count):
+        p = point_idx[point_bounds[band]:point_bounds[band+1]]
+        e = edge_idx[edge_bounds[band]:edge_bounds[band+1]]
+        if len(p) and len(e):
+            ret[p] = _windingNumbers(edges[e], points[p], chunk)
+    return ret
+
+def _windingNumbers(edges, points, chunk):
+    ret = numpy.zeros(len(points), dtype=int)
+    x0,y0,x1,y1 = [e[None,:] for e in edges.T]
+    step = max(1, chunk//len(edges))
+    for i in range(0, len(points), step):
+        px = points[i:i+step,0][:,None]
+        py = points[i:i+step,1][:,None]
+        side = (x1-x0)*(py-y0) - (px-x0)*(y1-y0)
+        up = (y0 <= py) & (y1 > py) & (side > 0)
+        down = (y1 <= py) & (y0 > py) & (side < 0)
+        ret[i:i+step] = up.sum(axis=1) - down.sum(axis=1)
+    return ret
+
+def _candidatePairs(segs):
+    # Spatial hash of segment bound boxes to find possibly intersecting pairs
+    n = len(segs)
+    if n < 2:
+        return numpy.zeros((0,2), dtype=int)
+    xmin = numpy.minimum(segs[:,0], segs[:,2])
+    xmax = numpy.maximum(segs[:,0], segs[:,2])
+    ymin = numpy.minimum(segs[:,1], segs[:,3])
+    ymax = numpy.maximum(segs[:,1], segs[:,3])
+    size = max(float(numpy.mean(numpy.maximum(xmax-xmin, ymax-ymin)))*2, 1e-6)
+    cells = defaultdict(list)
+    ix0 = numpy.floor(xmin/size).astype(int).tolist()
+    ix1 = numpy.floor(xmax/size).astype(int).tolist()
+    iy0 = numpy.floor(ymin/size).astype(int).tolist()
+    iy1 = numpy.floor(ymax/size).astype(int).tolist()
+    for i in range(n):
+        for cx in range(ix0[i], ix1[i]+1):
+            for cy in range(iy0[i], iy1[i]+1):
+                cells[cx,cy].append(i)
+    pairs = set()
+    for idx in cells.values():
+        for a in range(len(idx)):
+            for b in range(a+1, len(idx)):
+                pairs.add((idx[a], idx[b]))
+    if not pairs:
+        return numpy.zeros((0,2), dtype=int)
+    return numpy.array(sorted(pairs), dtype=int)
+
+def _splitParams(segs, tol=1e-9):
+    # Return for each segment the sorted parameters at which it is split by
+    # other segments, including 0 and 1
+    params = [[0.0, 1.0] for _ in range(len(segs))]
+    pairs = _candidatePairs(segs)
+    if not len(pairs):
+        return params
+    i = pairs[:,0]
+    j = pairs[:,1]
+    p = segs[i,:2]
+    r = segs[i,2:] - p
+    q = segs[j,:2]
+    s = segs[j,2:] - q
+    qp = q - p
+    denom = r[:,0]*s[:,1] - r[:,1]*s[:,0]
+    cross_qpr = qp[:,0]*r[:,1] - qp[:,1]*r[:,0]
+    cross_qps = qp[:,0]*s[:,1] - qp[:,1]*s[:,0]
+    rr = (r*r).sum(axis=1)
+    ss = (s*s).sum(axis=1)
+
+    # proper and touching intersections
+    nonpar = numpy.abs(denom) > tol*numpy.sqrt(rr*ss)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        t = cross_qps/denom
+        u = cross_qpr/denom
+    hit = nonpar & (t >= -tol) & (t <= 1+tol) & (u >= -tol) & (u <= 1+tol)
+    for a,b,ta,ub in zip(i[hit].tolist(), j[hit].tolist(),
+                         t[hit].tolist(), u[hit].tolist()):
+        params[a].append(min(max(ta,0.0),1.0))
+        params[b].append(min(max(ub,0.0),1.0))
+
+    # collinear overlaps, split each segment at the end points of the other
+    col = ~nonpar & (numpy.abs(cross_qpr) <= tol*numpy.sqrt(rr)*(1+numpy.sqrt(rr)))
+    if numpy.any(col):
+        ic, jc = i[col], j[col]
+        pc, rc, qc, sc = p[col], r[col], q[col], s[col]
+        rrc, ssc = rr[col], ss[col]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            t0 = ((qc-pc)*rc).sum(axis=1)/rrc
+            t1 = ((qc+sc-pc)*rc).sum(axis=1)/rrc
+            u0 = ((pc-qc)*sc).sum(axis=1)/ssc
+            u1 = ((pc+rc-qc)*sc).sum(axis=1)/ssc
+        for a,b,va,vb,wa,wb in zip(ic.tolist(), jc.tolist(), t0.tolist(),
+                                   t1.tolist(), u0.tolist(), u1.tolist()):
+            for v in (va, vb):
+                if 0 < v < 1:
+                    params[a].append(v)
+            for w in (wa, wb):
+                if 0 < w < 1:
+                    params[b].append(w)
+    return params
+
+def _chainRings(edges, points):
+    # Chain directed edges (index pairs into points) into rings, turning as
+    # far left as possible at vertices shared by several rings
+    outgoing = defaultdict(list)
+    for k,(a,b) in enumerate(edges):
+        outgoing[a].append(k)
+    used = [False]*len(edges)
+    rings = []
+    for start in range(len(edges)):
+        if used[start]:
+            continue
+        used[start] = True
+        ring = [edges[start][0]]
+        a,b = edges[start]
+        while b != ring[0]:
+            ring.append(b)
+            candidates = [k for k in outgoing[b] if not used[k]]
+            if not candidates:
+                # should not happen for a valid boundary
+                break
+            if len(candidates) == 1:
+                k = candidates[0]
+            else:
+                dx,dy = points[b] - points[a]
+                best = None
+                for c in candidates:
+                    ex,ey = points[edges[c][1]] - points[b]
+                    turn = numpy.arctan2(dx*ey - dy*ex, dx*ex + dy*ey)
+                    if turn >= pi - 1e-12:
+                        turn = -pi
+                    if best is None or turn > best[0]:
+                        best = (turn, c)
+                k = best[1]
+            used[k] = True
+            a,b = edges[k]
+        rings.append(ring)
+    return rings
+
+def _simplifyRing(ring, tol=1e-12):
+    # Remove duplicated and collinear vertices
+    changed = True
+    while changed and len(ring) >= 3:
+        changed = False
+        prev = numpy.roll(ring, 1, axis=0)
+        nxt = numpy.roll(ring, -1, axis=0)
+        cross = (ring[:,0]-prev[:,0])*(nxt[:,1]-ring[:,1]) \
+                - (ring[:,1]-prev[:,1])*(nxt[:,0]-ring[:,0])
+        keep = numpy.abs(cross) > tol
+        if not keep.all():
+            ring = ring[keep]
+            changed = True
+    return ring
+
+def booleanRings(operands, predicate, snap=1e-7):
+    '''Boolean operation of any number of ring sets by segment arrangement
+
+    All edges are split at their intersections. An edge is kept if the
+    predicate differs on its two sides, and oriented with the inside on its
+    left. The kept edges are then chained into rings.
+
+    Args:
+        operands: list of (rings, evenodd), where evenodd selects the fill
+        rule of the ring set, otherwise it is nonzero.
+
+        predicate: function taking a list of booleans, whether a point is
+        inside each operand, and returns whether it is inside the result.
+
+        snap: grid size to merge vertices
+
+    Returns a list of rings.
+    '''
+    edges = [_ringEdges(rings) for rings,_ in operands]
+    segs = numpy.concatenate(edges) if edges else numpy.zeros((0,4))
+    if not len(segs):
+        return []
+    owner = numpy.repeat(numpy.arange(len(edges)), [len(e) for e in edges])
+    # edges shorter than snap are not split, only snapped, so that the rings
+    # stay closed
+    short = numpy.hypot(segs[:,2]-segs[:,0], segs[:,3]-segs[:,1]) <= snap
+
+    keys = {}
+    points = []
+    def _index(x, y):
+        key = (int(round(x/snap)), int(round(y/snap)))
+        try:
+            return keys[key]
+        except KeyError:
+            keys[key] = len(points)
+            points.append((key[0]*snap, key[1]*snap))
+            return keys[key]
+
+    # the split edges of each operand, with their original direction
+    pieces = [[] for _ in operands]
+    undirected = set()
+    params = [[0.0, 1.0]]*len(segs)
+    long_segs = numpy.nonzero(~short)[0]
+    for k,ts in zip(long_segs.tolist(), _splitParams(segs[long_segs])):
+        params[k] = ts
+    for seg,ts,o in zip(segs.tolist(), params, owner.tolist()):
+        x0,y0,x1,y1 = seg
+        ts = sorted(set(ts))
+        idx = [_index(x0+(x1-x0)*t, y0+(y1-y0)*t) for t in ts]
+        for a,b in zip(idx, idx[1:]):
+            if a != b:
+                pieces[o].append((a,b))
+                undirected.add((a,b) if a < b else (b,a))
+    if not undirected:
+        return []
+
+    points = numpy.array(points)
+    pairs = numpy.array(sorted(undirected), dtype=int)
+    pa = points[pairs[:,0]]
+    pb = points[pairs[:,1]]
+    d = pb - pa
+    length = numpy.hypot(d[:,0], d[:,1])
+    normal = numpy.stack((-d[:,1], d[:,0]), axis=1)/length[:,None]
+    # The samples are tested against the snapped pieces rather than the
+    # input edges, so that they can be very close to the edge without being
+    # misplaced by snapping, e.g. near a shallow crossing of a short piece.
+    eps = numpy.minimum(length*1e-3, snap*10)[:,None]
+    mid = (pa + pb)*0.5
+    samples = numpy.concatenate((mid + normal*eps, mid - normal*eps))
+
+    inside = []
+    for p,(_,evenodd) in zip(pieces, operands):
+        if p:
+            p = numpy.array(p, dtype=int)
+            e = numpy.hstack((points[p[:,0]], points[p[:,1]]))
+        else:
+            e = numpy.zeros((0,4))
+        w = windingNumbers(e, samples)
+        inside.append(w % 2 == 1 if evenodd else w != 0)
+    inside = numpy.stack(inside, axis=1).tolist()
+    n = len(pairs)
+    directed = []
+    for k,(a,b) in enumerate(pairs.tolist()):
+        left = predicate(inside[k])
+        right = predicate(inside[k+n])
+        if left and not right:
+            directed.append((a,b))
+        elif right and not left:
+            directed.append((b,a))
+
+    ret = []
+    for ring in _chainRings(directed, points):
+        ring = _simplifyRing(points[ring])
+        if len(ring) >= 3 and abs(ringArea(ring)) > snap*snap:
+            ret.append(ring)
+    return ret
+
+
+class NumpyBackend(Backend):
+    '''Pure Python/NumPy reference backend working on Region objects
+
+    Booleans are done by segment arrangement, and offsets by union (or
+    difference) with the capsules swept along all edges. Simple and exact
+    enough for tests and small boards, but not tuned for speed.
+    '''
+
+    name = 'numpy'
+
+    def __init__(self, accuracy=0.01):
+        if numpy is None:
+            raise ImportError('NumpyBackend requires numpy')
+        super(NumpyBackend, self).__init__(accuracy)
+
+    def _segments(self, radius, angle=2*pi):
+        # number of segments to approximate an arc within accuracy
+        if radius <= self.accuracy:
+            n = 4
+        else:
+            n = ceil(angle/(2*acos(1 - self.accuracy/radius)))
+        return max(4 if angle >= 2*pi else 1, int(n))
+
+    def _arc(self, cx, cy, r, start, angle):
+        n = self._segments(r, abs(angle))
+        a = start + numpy.arange(n+1)*(angle/n)
+        return numpy.stack((cx + r*numpy.cos(a), cy + r*numpy.sin(a)), axis=1)
+
+    def circle(self, diameter, center=(0,0)):
+        r = diameter*0.5
+        n = self._segments(r)
+        a = numpy.arange(n)*(2*pi/n)
+        return Region([numpy.stack((center[0] + r*numpy.cos(a),
+                                    center[1] + r*numpy.sin(a)), axis=1)])
+
+    def rect(self, width, height, center=(0,0)):
+        w = width*0.5
+        h = height*0.5
+        return Region([numpy.array([(-w,-h),(w,-h),(w,h),(-w,h)])
+                        + numpy.array(center, dtype=float)])
+
+    def oval(self, width, height, center=(0,0)):
+        if width == height:
+            return self.circle(width, center)
+        if width > height:
+            points = [(-(width-height)*0.5, 0), ((width-height)*0.5, 0)]
+            d = height
+        else:
+            points = [(0, -(height-width)*0.5), (0, (height-width)*0.5)]
+            d = width
+        return self.transform(self._capsule(points[0], points[1], d*0.5),
+                              center[0], center[1])
+
+    def polygon(self, points):
+        ring = numpy.array(points, dtype=float)[:,:2]
+        if len(ring) > 1 and (ring[0] == ring[-1]).all():
+            ring = ring[:-1]
+        if ringArea(ring) < 0:
+            ring = ring[::-1]
+        return Region([ring])
+
+    def _capsule(self, p0, p1, r):
+        x0,y0 = p0
+        x1,y1 = p1
+        a = numpy.arctan2(y1-y0, x1-x0)
+        ring = numpy.concatenate((self._arc(x1, y1, r, a-pi/2, pi),
+                                  self._arc(x0, y0, r, a+pi/2, pi)))
+        return Region([ring])
+
+    def _capsules(self, edges, r):
+        return [self._capsule(e[:2], e[2:], r).rings[0] for e in edges.tolist()]
+
+    def stroke(self, points, width):
+        points = numpy.array(points, dtype=float)[:,:2]
+        r = width*0.5
+        if len(points) == 1:
+            return self.circle(width, points[0])
+        edges = numpy.hstack((points[:-1], points[1:]))
+        return Region(booleanRings([(self._capsules(edges, r), False)], any))
+
+    def transform(self, region, dx=0, dy=0, angle=0):
+        a = radians(angle)
+        m = numpy.array([[cos(a), sin(a)], [-sin(a), cos(a)]])
+        return Region([r.dot(m) + (dx, dy) for r in region.rings])
+
+    def union(self, regions):
+        rings = []
+        for r in regions:
+            rings += r.rings
+        return Region(booleanRings([(rings, False)], any))
+
+    def difference(self, region, tools):
+        return Region(booleanRings([(region.rings, False),
+                (sum([t.rings for t in tools], []), False)],
+                lambda i: i[0] and not i[1]))
+
+    def intersection(self, region, tools):
+        operands = [(region.rings, False)] + [(t.rings, False) for t in tools]
+        return Region(booleanRings(operands, all))
+
+    def offset(self, region, distance):
+        if not distance or not region:
+            return region
+        capsules = self._capsules(_ringEdges(region.rings), abs(distance))
+        if distance > 0:
+            return Region(booleanRings(
+                [(region.rings, False), (capsules, False)], any))
+        return Region(booleanRings([(region.rings, False), (capsules, False)],
+                                   lambda i: i[0] and not i[1]))
+
+    def area(self, region):
+        return region.area
+
+    def _discretize(self, wire):
+        pts = wire.discretize(Deflection=self.accuracy)
+        return numpy.array([(p.x, p.y) for p in pts])
+
+    def fromShape(self, shape):
+        rings = []
+        paths = []
+        for face in shape.Faces:
+            # normalize each face by even-odd, so that the inner wires are
+            # holes regardless of their orientation
+            rings += booleanRings([([self._discretize(w)[:-1]
+                                    for w in face.Wires], True)], any)
+        faced = set()
+        for face in shape.Faces:
+            faced.update([w.hashCode() for w in face.Wires])
+        closed = []
+        for w in shape.Wires:
+            if w.hashCode() in faced:
+                continue
+            if w.isClosed():
+                closed.append(self._discretize(w)[:-1])
+            else:
+                paths.append(self._discretize(w))
+        if closed:
+            rings += booleanRings([(closed, True)], any)
+        if shape.Faces and closed:
+            rings = booleanRings([(rings, False)], any)
+        return Region(rings), paths
+
+    def toShape(self, region, z=0):
+        import Part
+        faces = []
+        for outer,holes in region.outlines():
+            wires = []
+            for ring in [outer] + holes:
+                pts = [_vector(x, y, z) for x,y in ring.tolist()]
+                pts.append(pts[0])
+                wires.append(Part.makePolygon(pts))
+            faces.append(Part.makeFace(wires, 'Part::FaceMakerBullseye'))
+        if not faces:
+            return Part.Shape()
+        return Part.makeCompound(faces)
+
+registerBackend('numpy', NumpyBackend)
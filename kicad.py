@@ -2,21 +2,73 @@ from __future__ import (absolute_import, division,
         print_function, unicode_literals)
 #from builtins import *
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict, namedtuple, Counter
+from contextlib import contextmanager
+from functools import partial, wraps
 from math import sqrt, atan2, degrees, sin, cos, radians, pi, hypot
 import traceback
 import FreeCAD
-import FreeCADGui
 import Part
 from FreeCAD import Console,Vector,Placement,Rotation
-import DraftGeomUtils,DraftVecUtils
-import Path
 
 import sys, os
 import re
+import time
+import pickle
+import fnmatch
+import json
+import threading
+try:
+    import numpy
+except ImportError:
+    numpy = None
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 from .kicad_parser import KicadPCB,SexpList,SexpParser,parseSexp
 from .kicad_parser import unquote
+from .geometry import getBackend
+
+class LazyModule(object):
+    '''Import a module on first attribute access'''
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, key):
+        if key.startswith('__'):
+            raise AttributeError(key)
+        if self._module is None:
+            import importlib
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, key)
+
+# In headless mode (e.g. running in FreeCADCmd, or with environment variable
+# FCAD_PCB_HEADLESS=1), GUI and other heavy modules are imported on first use,
+# and GUI updates (e.g. fitView()) are skipped. Set FCAD_PCB_HEADLESS=0 to
+# force the normal mode.
+_headless = os.environ.get('FCAD_PCB_HEADLESS', '')
+if _headless:
+    _headless = _headless not in ('0', 'false', 'False')
+else:
+    _headless = not getattr(FreeCAD, 'GuiUp', False)
+
+if _headless:
+    FreeCADGui = LazyModule('FreeCADGui')
+    DraftGeomUtils = LazyModule('DraftGeomUtils')
+    DraftVecUtils = LazyModule('DraftVecUtils')
+    Path = LazyModule('Path')
+else:
+    import FreeCADGui
+    import DraftGeomUtils,DraftVecUtils
+    import Path
+
+def setHeadless(enable=True):
+    '''Enable or disable GUI updates'''
+    global _headless
+    _headless = enable
+
+def isHeadless():
+    return _headless
 
 PY3 = sys.version_info[0] == 3
 if PY3:
@@ -70,6 +122,8 @@ def setObjectLinks(obj, links, objs):
         obj.ViewObject.DiffuseColor = color
 
 def updateGui():
+    if _headless:
+        return
     try:
         FreeCADGui.updateGui()
     except Exception:
@@ -120,13 +174,20 @@ def getActiveDoc():
     return FreeCAD.ActiveDocument
 
 def fitView():
+    if _headless:
+        return
     try:
         FreeCADGui.ActiveDocument.ActiveView.fitAll()
     except Exception:
         pass
 
+def precision():
+    # Same as DraftGeomUtils.precision(), but without importing Draft
+    return FreeCAD.ParamGet('User parameter:BaseApp/Preferences/Mod/Draft')\
+                  .GetInt('precision', 6)
+
 def isZero(f):
-    return round(f,DraftGeomUtils.precision())==0
+    return round(f,precision())==0
 
 def makeColor(*color):
     if len(color)==1:
@@ -151,6 +212,47 @@ def getAt(sexp):
     v = makeVect(at)
     return (v,0) if len(at)==2 else (v,at[2])
 
+def placeShapes(template, placements):
+    '''Return instances of a shape placed in bulk
+
+    Args:
+        template: the shape to place
+
+        placements: sequence of (x, y, angle, m_x, m_y, m_angle, z), meaning
+        the shape is rotated by angle (absolute, in degree), and moved to
+        (x, y) rotated by m_angle around the origin, and then offset by (m_x,
+        m_y, z). This is how a pad is placed within its footprint.
+    '''
+    if numpy is not None:
+        x,y,angle,mx,my,ma,z = numpy.array(placements, dtype=float).T
+        ma = numpy.radians(ma)
+        c = numpy.cos(ma)
+        s = numpy.sin(ma)
+        rows = zip((x*c - y*s + mx).tolist(), (x*s + y*c + my).tolist(),
+                   z.tolist(), angle.tolist())
+    else:
+        rows = []
+        for x,y,angle,mx,my,ma,z in placements:
+            ma = radians(ma)
+            c = cos(ma)
+            s = sin(ma)
+            rows.append((x*c - y*s + mx, x*s + y*c + my, z, angle))
+
+    axis = Vector(0,0,1)
+    if hasattr(template, 'moved'):
+        return [template.moved(Placement(Vector(px,py,pz), Rotation(axis,a)))
+                    for px,py,pz,a in rows]
+
+    # older FreeCAD without Shape.moved()
+    ret = []
+    for px,py,pz,a in rows:
+        shape = template.copy()
+        if a:
+            shape.rotate(Vector(),axis,a)
+        shape.translate(Vector(px,py,pz))
+        ret.append(shape)
+    return ret
+
 def product(v1,v2):
     return Vector(v1.x*v2.x,v1.y*v2.y,v1.z*v2.z)
 
@@ -309,7 +411,14 @@ def make_roundrect(size,params):
 
     return Part.Wire(edges)
 
-def make_gr_poly(params):
+def make_gr_poly(params, fit_arcs=None):
+    '''Make a gr_poly/fp_poly wire
+
+    Args:
+        params: the poly sexp
+        fit_arcs: optional (accuracy, max_error) to refit the vertices with
+                  lines and arcs, see fitPolyline()
+    '''
     points = SexpList(params.pts.xy)
     # close the polygon
     points._append(params.pts.xy._get(0))
@@ -317,6 +426,20 @@ def make_gr_poly(params):
     # It seems kicad's polygon has inconsistent winding. Use Path.Area
     # projection to make sure we get the counter colockwise winding, otherwise
     # it will be interpreted as a hole.
+    if fit_arcs:
+        # Path.Area would discretize the fitted arcs again, so fix the
+        # winding here instead. Note that makeVect() flips the y axis.
+        pts = [(p[0], p[1]) for p in points][:-1]
+        area = 0.0
+        for i,(x,y) in enumerate(pts):
+            x2,y2 = pts[(i+1)%len(pts)]
+            area += x*y2 - x2*y
+        if area > 0:
+            pts.reverse()
+        segments = fitPolyline(pts, *fit_arcs)
+        logger.log('gr_poly arc fitting: {} edges -> {}'.format(len(pts), len(segments)))
+        return makeFittedWire(segments)
+
     poly = Part.makePolygon([makeVect(p) for p in reversed(points)])
     try:
         area = Path.Area(Fill=True, FitArcs=False, Coplanar=0, Outline=True)
@@ -364,11 +487,42 @@ def getLineWidth(param, default):
     return width
 
 
-def makePrimitve(key, param):
+def getLayers(param):
+    '''Return the (unquoted) layer names of a board item'''
+    layers = []
+    l = getattr(param, 'layers', [])
+    if unquote(l) == 'F&B.Cu':
+        layers.append('F.Cu')
+        layers.append('B.Cu')
+    else:
+        layers = [unquote(s) for s in l]
+    if hasattr(param, 'layer'):
+        layers.append(unquote(param.layer))
+    return layers
+
+
+def getNetCode(param):
+    '''Return the net code of a board item, or None if it has no net'''
+    try:
+        n = param.net
+    except Exception:
+        return None
+    if isinstance(n, list):
+        n = n[0]
+    try:
+        hash(n)
+    except TypeError:
+        n = n[0]
+    return n
+
+
+def makePrimitve(key, param, fit_arcs=None):
     try:
         width = getLineWidth(param, 0)
         if width and key == 'gr_circle':
             return make_gr_circle(param, width), 0
+        elif fit_arcs and key == 'gr_poly':
+            return make_gr_poly(param, fit_arcs), width
         else:
             make_shape = globals()['make_{}'.format(key)]
             return make_shape(param), width
@@ -402,6 +556,302 @@ def makeArc(center,start,angle):
 def makeCurve(poles):
     return Part.BSplineCurve(poles).toShape()
 
+def chainEdges(edges):
+    '''Chain edges into wires using the edge width as tolerance
+
+    Args:
+        edges: list of [width, edge, start point, end point]
+
+    Yields (closed, [(width, edge)]) for each chain of edges, with edges
+    reversed as needed to be head to tail. Two edges are connected if their
+    end points are within the average of their widths.
+
+    Starting from the last unused edge, the chain is grown at either end by
+    the first (in list order) unused edge that connects. End points are
+    stored in a spatial hash with a cell size of the maximum width, so that
+    only nearby edges are checked.
+    '''
+    if not edges:
+        return
+
+    size = max([info[0] for info in edges])
+    if size <= 0:
+        size = 1e-7
+
+    def cell(p):
+        return (int(p.x//size), int(p.y//size))
+
+    grid = defaultdict(list)
+    for i,(_,_,ps,pe) in enumerate(edges):
+        grid[cell(ps)].append(i)
+        c = cell(pe)
+        if c != cell(ps):
+            grid[c].append(i)
+
+    def nearby(p, found):
+        cx,cy = cell(p)
+        for x in (cx-1, cx, cx+1):
+            for y in (cy-1, cy, cy+1):
+                for i in grid.get((x,y), ()):
+                    if alive[i]:
+                        found.add(i)
+
+    alive = [True]*len(edges)
+    last = len(edges) - 1
+    while True:
+        while last >= 0 and not alive[last]:
+            last -= 1
+        if last < 0:
+            break
+        alive[last] = False
+        w,e,pstart,pend = edges[last]
+        wstart = wend = w
+        elist = [(w,e)]
+        closed = pstart.distanceToPoint(pend) <= w
+
+        while not closed:
+            candidates = set()
+            nearby(pstart, candidates)
+            nearby(pend, candidates)
+            for i in sorted(candidates):
+                w,e,ps,pe = edges[i]
+                if pstart.distanceToPoint(ps) <= (wstart+w)/2:
+                    e.reverse()
+                    pstart = pe
+                    wstart = w
+                    elist.insert(0,(w,e))
+                elif pstart.distanceToPoint(pe) <= (wstart+w)/2:
+                    pstart = ps
+                    wstart = w
+                    elist.insert(0,(w,e))
+                elif pend.distanceToPoint(ps) <= (wend+w)/2:
+                    e.reverse()
+                    pend = pe
+                    wend = w
+                    elist.append((w,e))
+                elif pend.distanceToPoint(pe) <= (wend+w)/2:
+                    pend = ps
+                    wend = w
+                    elist.append((w,e))
+                else:
+                    continue
+                alive[i] = False
+                break
+            else:
+                # no more connected edge
+                break
+            if pstart.distanceToPoint(pend) <= (wstart+wend)/2:
+                closed = True
+
+        yield closed, elist
+
+def extractPolygonHoles(pts):
+    '''Split a KiCad zone polygon into its outline and holes
+
+    Args:
+        pts: list of (x,y) vertices of the polygon, without repeating the
+             first vertex at the end
+
+    Returns (outline, holes), where outline is a list of vertices, and holes
+    a list of vertex lists.
+
+    This is how kicad represents holes in zone polygon
+     ---------------------------
+     |    -----      ----      |
+     |    |   |======|  |      |
+     |====|   |      |  |      |
+     |    -----      ----      |
+     |                         |
+     ---------------------------
+    It uses a single polygon with coincide edges of oppsite direction (shown
+    with '=' above) to dig a hole. And one hole can lead to another, and so
+    forth. The holes are discovered by looking up the reverse of each edge in
+    a table of edges keyed by vertex pair, and those '=' double edges are
+    cancelled out, which will surely cause problem if left alone. The
+    algorithm assumes we start with a point of the outer polygon, and that
+    those hole digging double edges are of equal length without any branch
+    in the middle.
+
+    Nested holes are tracked with an explicit stack instead of recursion, so
+    that large polygons won't hit the recursion limit.
+    '''
+    if not pts:
+        return [], []
+
+    # close the polygon
+    pts = list(pts)
+    pts.append(pts[0])
+
+    # `table` uses a pair of vertex as the key to store the index of an edge.
+    table = {}
+    for i in range(len(pts)-1):
+        table[pts[i],pts[i+1]] = i
+
+    outline = []
+    holes = []
+    # stack of [start, end, edges] of the outline and the holes being walked
+    stack = [[0, len(pts)-1, outline]]
+    while stack:
+        frame = stack[-1]
+        start, end, edges = frame
+        if start >= end:
+            stack.pop()
+            if edges and edges is not outline:
+                holes.append([pts[i] for i in edges])
+            continue
+        # We used the reverse edge as key to search for an identical edge of
+        # oppsite direction.
+        i = table.pop((pts[start+1],pts[start]), None)
+        if i is None:
+            # it's a normal edge, add the edge start
+            edges.append(start)
+            frame[0] = start + 1
+            continue
+        # We found the start of a double edge, treat all edges in between as
+        # holes. Both of the double edges are skipped.
+        frame[0] = i + 1
+        stack.append([start+1, i, []])
+
+    return [pts[i] for i in outline], holes
+
+def _fitLine(pts, start, end, accuracy):
+    # Check if the vertices between start and end are within accuracy of the
+    # line (start, end), and progress monotonically along it.
+    x0,y0 = pts[start]
+    dx = pts[end][0] - x0
+    dy = pts[end][1] - y0
+    length = hypot(dx, dy)
+    if not length:
+        return False
+    last = 0.0
+    for i in range(start+1, end):
+        px = pts[i][0] - x0
+        py = pts[i][1] - y0
+        if abs(px*dy - py*dx) > accuracy*length:
+            return False
+        t = (px*dx + py*dy)/length
+        if t < last or t > length:
+            return False
+        last = t
+    return True
+
+def _circle(p1, p2, p3):
+    # Return the center and radius of the circle through three points, or
+    # None if they are collinear.
+    (x1,y1),(x2,y2),(x3,y3) = p1, p2, p3
+    d = 2.0*(x1*(y2-y3) + x2*(y3-y1) + x3*(y1-y2))
+    if not d:
+        return None
+    s1 = x1*x1 + y1*y1
+    s2 = x2*x2 + y2*y2
+    s3 = x3*x3 + y3*y3
+    cx = (s1*(y2-y3) + s2*(y3-y1) + s3*(y1-y2))/d
+    cy = (s1*(x3-x2) + s2*(x1-x3) + s3*(x2-x1))/d
+    return cx, cy, hypot(x1-cx, y1-cy)
+
+def _fitArc(pts, start, end, accuracy, max_error):
+    # Check if the vertices between start and end are within accuracy of the
+    # circle through start, end and the middle vertex, turning in the same
+    # direction without closing the circle, and each edge is within
+    # max_error (i.e. sagitta) of the circle.
+    circle = _circle(pts[start], pts[(start+end)//2], pts[end])
+    if not circle:
+        return False
+    cx,cy,r = circle
+    x1,y1 = pts[start]
+
+    sweep = 0.0
+    vx = x1 - cx
+    vy = y1 - cy
+    for i in range(start+1, end+1):
+        ux = pts[i][0] - cx
+        uy = pts[i][1] - cy
+        if abs(hypot(ux, uy) - r) > accuracy:
+            return False
+        a = atan2(vx*uy - vy*ux, vx*ux + vy*uy)
+        if not a or (sweep and (a > 0) != (sweep > 0)):
+            return False
+        if r*(1.0-cos(a*0.5)) > max_error:
+            return False
+        sweep += a
+        vx = ux
+        vy = uy
+    return abs(sweep) < 2*pi - 1e-7
+
+def _extendRun(fit, pts, start, end, stop, *args):
+    # Extend the run (start, end), which is known to be valid, up to before
+    # 'stop' by galloping, i.e. doubling the extension while the run passes
+    # 'fit', and then bisecting between the last pass and the first failure.
+    # This takes O(log(n)) checks of the run instead of one per vertex.
+    step = 1
+    while end+1 < stop:
+        bad = min(end+step, stop-1)
+        if fit(pts, start, bad, *args):
+            end = bad
+            step *= 2
+            continue
+        while bad - end > 1:
+            mid = (end + bad)//2
+            if fit(pts, start, mid, *args):
+                end = mid
+            else:
+                bad = mid
+        break
+    return end
+
+def fitPolyline(pts, accuracy, max_error=0.005, closed=True, min_arc=4, max_run=1024):
+    '''Replace runs of collinear and co-circular vertices with lines and arcs
+
+    Args:
+        pts: list of (x,y) vertices
+        accuracy: maximum distance of a vertex to its fitted line or arc
+        max_error: maximum distance of an input edge to its fitted arc, to
+                   avoid rounding off genuine polygons
+        closed: whether the last vertex connects back to the first
+        min_arc: minimum number of vertices to fit an arc
+        max_run: maximum number of vertices in one line or arc
+
+    Returns a list of segments, (start, end) for lines, and (start, middle,
+    end) for arcs.
+    '''
+    pts = list(pts)
+    if closed and pts:
+        pts.append(pts[0])
+    count = len(pts)
+    segments = []
+    i = 0
+    while i < count-1:
+        stop = min(count, i+max_run+1)
+        j = _extendRun(_fitLine, pts, i, i+1, stop, accuracy)
+        k = i + min_arc - 1
+        if k < count and _fitArc(pts, i, k, accuracy, max_error):
+            k = _extendRun(_fitArc, pts, i, k, stop, accuracy, max_error)
+        else:
+            k = i
+        if k > j:
+            segments.append((pts[i], pts[(i+k)//2], pts[k]))
+            i = k
+        else:
+            segments.append((pts[i], pts[j]))
+            i = j
+    return segments
+
+def makeFittedWire(segments):
+    '''Make a wire from the output of fitPolyline()'''
+    edges = []
+    for seg in segments:
+        if len(seg) == 2:
+            edges.append(Part.makeLine(makeVect(seg[0]), makeVect(seg[1])))
+        else:
+            edges.append(Part.ArcOfCircle(*[makeVect(p) for p in seg]).toShape())
+    return Part.Wire(edges)
+
+def makePolygon(pts):
+    '''Make a closed polygon wire from a list of (x,y) kicad coordinates'''
+    pts = [makeVect(p) for p in pts]
+    pts.append(pts[0])
+    return Part.makePolygon(pts)
+
 def findWires(edges):
     try:
         return [Part.Wire(e) for e in Part.sortEdges(edges)]
@@ -451,7 +901,872 @@ def unpack(obj):
     return obj
 
 
+def shapeInstance(shape):
+    '''Return a new shape that shares the underlying geometry of the given one
+
+    Moving the returned shape (e.g. translate, rotate) does not affect the
+    original.
+    '''
+    try:
+        return shape.moved(Placement())
+    except AttributeError:
+        # older FreeCAD without Shape.moved()
+        return shape.copy()
+
+class ShapeCache(object):
+    '''Least recently used cache of shapes with hit/miss statistics
+
+    Args:
+        max_size: maximum number of entries, 0 for unlimited
+
+        max_weight: maximum total weight of the entries, 0 for unlimited
+
+        weigh: function returning the weight of a value, e.g. its memory
+        size, default to 1. A value stored under more than one key is only
+        weighed once.
+
+    The cache can be shared among threads.
+    '''
+
+    def __init__(self, max_size=1024, max_weight=0, weigh=None):
+        self.max_size = max_size
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()
+        # value identity -> [weight, reference count]
+        self._weights = {}
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _identity(self, value):
+        return id(value)
+
+    def _acquire(self, value):
+        ident = self._identity(value)
+        try:
+            self._weights[ident][1] += 1
+        except KeyError:
+            weight = self.weigh(value) if self.weigh else 1
+            self._weights[ident] = [weight, 1]
+            self.weight += weight
+
+    def _release(self, value):
+        ident = self._identity(value)
+        entry = self._weights[ident]
+        entry[1] -= 1
+        if not entry[1]:
+            del self._weights[ident]
+            self.weight -= entry[0]
+
+    def peek(self, key, default=None):
+        '''Return a value without counting a hit or miss, or updating its
+        recency'''
+        with self._lock:
+            return self._cache.get(key, default)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._cache.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._cache[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            try:
+                self._release(self._cache.pop(key))
+            except KeyError:
+                pass
+            self._cache[key] = value
+            self._acquire(value)
+            while self._cache and \
+                    ((self.max_size and len(self._cache) > self.max_size) or \
+                     (self.max_weight and self.weight > self.max_weight)):
+                _,value = self._cache.popitem(last=False)
+                self._release(value)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._cache.pop(key)
+            except KeyError:
+                return default
+            self._release(value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._weights.clear()
+            self.weight = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'size' : len(self._cache),
+                    'weight' : self.weight,
+                    'max_weight' : self.max_weight,
+                    'hits' : self.hits,
+                    'misses' : self.misses,
+                    'evictions' : self.evictions,
+                    'hit_rate' : float(self.hits)/total if total else 0.0}
+
+# options that do not change any 2D result, and are passed explicitly to the
+# nodes depending on them
+_optionKeyExcludes = ('filename', 'copper_thickness', 'board_thickness',
+                      'layer_thickness')
+
+class BuildGraph(object):
+    '''Memoised intermediate build results of a board
+
+    Nodes are keyed by a tuple of (kind, layer, ...), with layer being None
+    for board wide nodes, e.g. ('board_face', None, ...), ('pads', 0, ...).
+    Shape results are returned as instances sharing the cached geometry, so
+    that callers are free to place them.
+
+    The graph can be shared among threads. The nodes are looked up and
+    inserted under a lock, but built outside of it. So two threads asking for
+    the same missing node may both build it, and the first one inserted is
+    kept and returned to both.
+    '''
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.nodes = {}
+        # kind -> [hits, misses, build time, saved time]
+        self.stats = defaultdict(lambda: [0, 0, 0.0, 0.0])
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __reduce__(self):
+        # only an empty graph is passed to worker processes
+        return (BuildGraph, ())
+
+    def get(self, key, make, stamp=None):
+        '''Return the cached value of a node, or make and cache it
+
+        Args:
+            key: node key
+
+            make: function to build the value
+
+            stamp: optional function returning a key of the inputs the value
+            depends on besides those in `key`, e.g. the holes within its
+            bound box. It is called with the value when built, and again
+            on each hit. The value is rebuilt if the result changed.
+        '''
+        with self._lock:
+            node = self.nodes.get(key, None)
+        # The stamp is computed outside of the lock, as it may take the locks
+        # of the caller
+        if node is not None and stamp is not None and stamp(node[0]) != node[2]:
+            with self._lock:
+                if self.nodes.get(key, None) is node:
+                    del self.nodes[key]
+            node = None
+        if node is None:
+            t = time.time()
+            value = make()
+            elapsed = time.time() - t
+            node = (value, elapsed, stamp(value) if stamp is not None else None)
+            with self._lock:
+                stat = self.stats[key[0]]
+                stat[1] += 1
+                stat[2] += elapsed
+                # keep the node of another thread that built it meanwhile
+                node = self.nodes.setdefault(key, node)
+        else:
+            with self._lock:
+                stat = self.stats[key[0]]
+                stat[0] += 1
+                stat[3] += node[1]
+        return self._instance(node[0])
+
+    def _instance(self, value):
+        if isinstance(value, Part.Shape):
+            return shapeInstance(value)
+        if isinstance(value, (list, tuple)):
+            return [shapeInstance(v) if isinstance(v, Part.Shape) else v
+                        for v in value]
+        return value
+
+    def cost(self):
+        '''Total build time of the cached nodes'''
+        with self._lock:
+            return sum([node[1] for node in self.nodes.values()])
+
+    def invalidate(self, kind=None, layer=None):
+        '''Remove nodes of the given kind and/or layer, or all nodes'''
+        count = 0
+        with self._lock:
+            for key in list(self.nodes):
+                if (kind is None or key[0] == kind) \
+                        and (layer is None or key[1] == layer):
+                    del self.nodes[key]
+                    count += 1
+        return count
+
+    def clear(self):
+        with self._lock:
+            self.nodes.clear()
+            self.stats.clear()
+
+    def report(self):
+        '''Return the reuse statistics of each node kind as text'''
+        lines = ['{:<12}{:>6}{:>8}{:>10}{:>10}'.format(
+                    'node', 'hits', 'misses', 'build(s)', 'saved(s)')]
+        with self._lock:
+            stats = sorted([(kind, list(stat)) for kind,stat in self.stats.items()])
+        for kind,(hits,misses,build,saved) in stats:
+            lines.append('{:<12}{:>6}{:>8}{:>10.3f}{:>10.3f}'.format(
+                kind, hits, misses, build, saved))
+        return '\n'.join(lines)
+
+def _keyValue(value):
+    if isinstance(value, string_types + (int, float)):
+        return value
+    try:
+        return tuple([_keyValue(v) for v in value])
+    except TypeError:
+        return str(value)
+
+def padTemplateKey(shape, params):
+    '''Return a key identifying the (unplaced) geometry of a pad shape'''
+    key = [shape, _keyValue(params.size)]
+    for name in 'roundrect_rratio', 'chamfer_ratio', 'chamfer', 'rect_delta':
+        key.append(_keyValue(getattr(params, name)) if name in params else None)
+    return tuple(key)
+
+def shapeToBrep(shape):
+    '''Serialize a shape for passing between processes'''
+    if shape is None or shape.isNull():
+        return None
+    return shape.exportBrepToString()
+
+def shapeFromBrep(data):
+    shape = Part.Shape()
+    if data:
+        shape.importBrepFromString(data)
+    return shape
+
+_worker_fcad = None
+
+def _initWorker(fcad=None):
+    # Worker processes never update the GUI
+    setHeadless(True)
+    if fcad is not None:
+        global _worker_fcad
+        _worker_fcad = fcad
+        # no nested worker pool inside a worker
+        fcad._pool = None
+        fcad.tile_workers = 1
+
+def _freecadPython():
+    # Return the Python interpreter to spawn workers with, or None for
+    # sys.executable. Inside FreeCAD, sys.executable is FreeCAD itself.
+    for name in ('python.exe',) if sys.platform == 'win32' \
+            else ('python3', 'python'):
+        python = os.path.join(FreeCAD.getHomePath(), 'bin', name)
+        if os.path.isfile(python):
+            return python
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return None
+    import shutil
+    return shutil.which('python{}.{}'.format(*sys.version_info[:2]))
+
+def processPool(workers=None, fcad=None, spawn=None):
+    '''Return a process pool whose workers can run FreeCAD geometry code
+
+    Workers are forked on Linux, unless running in the FreeCAD GUI, whose
+    process is not safe to fork. Otherwise they are spawned with the Python
+    interpreter bundled with FreeCAD, if found, or else the one matching the
+    running Python version.
+
+    Args:
+        workers: number of worker processes, default to CPU count
+
+        fcad: optional KicadFcad object made available to the workers. It is
+        inherited by forked workers, and pickled for spawned ones.
+
+        spawn: True to always spawn the workers, e.g. for work touching
+        FreeCADGui, False to fork them on Linux even in the GUI. Default to
+        spawn if FreeCAD.GuiUp is set.
+    '''
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    if spawn is None:
+        spawn = getattr(FreeCAD, 'GuiUp', False)
+    if not spawn and sys.platform.startswith('linux'):
+        ctx = multiprocessing.get_context('fork')
+    else:
+        ctx = multiprocessing.get_context('spawn')
+        python = _freecadPython()
+        if python:
+            ctx.set_executable(python)
+    return ProcessPoolExecutor(workers or os.cpu_count(), mp_context=ctx,
+                               initializer=_initWorker, initargs=(fcad,))
+
+def _copperLayerWorker(holes, kwds):
+    # Make one copper layer at z=0 using the KicadFcad passed to the pool
+    t = time.time()
+    if holes is not None:
+        holes = shapeFromBrep(holes)
+    shape = _worker_fcad.makeCopper(holes=holes, z=0, prefix=None, **kwds)
+    return shapeToBrep(shape), time.time() - t
+
+def _areaTileWorker(brep, tile, z, params):
+    # Union the input faces and clip to the tile in one Path.Area pass
+    t = time.time()
+    x0,y0,x1,y1 = tile
+    area = Path.Area(**params)
+    area.setPlane(Part.makeCircle(1, Vector(0,0,z)))
+    area.add(shapeFromBrep(brep), op=0)
+    area.add(Part.makePolygon([Vector(x0,y0,z), Vector(x1,y0,z),
+                               Vector(x1,y1,z), Vector(x0,y1,z),
+                               Vector(x0,y0,z)]), op=2)
+    return shapeToBrep(area.getShape()), time.time() - t
+
+def spatialGroups(shapes, leaf_size=16):
+    '''Split shapes into groups of at most `leaf_size` nearby shapes
+
+    Shapes are recursively split at the median of their bound box centers
+    along the longer axis, so that consecutive groups are close to each other
+    as well.
+    '''
+    groups = []
+    def _split(items):
+        if len(items) <= leaf_size:
+            groups.append([item[2] for item in items])
+            return
+        xs = [item[0] for item in items]
+        ys = [item[1] for item in items]
+        axis = 0 if max(xs)-min(xs) >= max(ys)-min(ys) else 1
+        items.sort(key=lambda item: item[axis])
+        mid = len(items)//2
+        _split(items[:mid])
+        _split(items[mid:])
+
+    items = []
+    for shape in shapes:
+        b = shape.BoundBox
+        items.append(((b.XMin+b.XMax)*0.5, (b.YMin+b.YMax)*0.5, shape))
+    if items:
+        _split(items)
+    return groups
+
+def _combineShapes(kind, shapes, params=None):
+    if kind == 'fuse':
+        if len(shapes) == 1:
+            return shapes[0]
+        return shapes[0].multiFuse(shapes[1:])
+    # planar union, params is (Path.Area parameters, z)
+    params, z = params
+    area = Path.Area(**params)
+    area.setPlane(Part.makeCircle(1, Vector(0,0,z)))
+    for shape in shapes:
+        area.add(shape, op=0)
+    return area.getShape()
+
+def _combineWorker(kind, breps, params):
+    return shapeToBrep(_combineShapes(kind, [shapeFromBrep(b) for b in breps], params))
+
+def _facesOnly(shape):
+    # Check if the shape has faces and no free wires or edges
+    faces = shape.Faces
+    return bool(faces) and len(shape.Edges) == len(Part.makeCompound(faces).Edges)
+
+def treeFuse(shapes, kind='fuse', params=None, leaf_size=16, fanout=2, pool=None):
+    '''Fuse shapes in a balanced tree of spatially clustered groups
+
+    Args:
+        shapes: list of shapes
+
+        kind: 'fuse' for solids, or 'area' for planar faces
+
+        params: for 'area', a tuple of (Path.Area parameters, z)
+
+        leaf_size: maximum number of shapes fused at the leaves
+
+        fanout: number of results fused at each upper level
+
+        pool: optional process pool to fuse the groups of each level in
+    '''
+    level = spatialGroups(shapes, leaf_size)
+    while True:
+        if pool is not None and len(level) > 1:
+            futures = [pool.submit(_combineWorker, kind,
+                            [shapeToBrep(s) for s in group], params)
+                        for group in level]
+            results = [shapeFromBrep(f.result()) for f in futures]
+        else:
+            results = [_combineShapes(kind, group, params) for group in level]
+        if len(results) <= 1:
+            return results[0] if results else None
+        level = [results[i:i+fanout] for i in range(0, len(results), fanout)]
+
+def residentMemory():
+    '''Return the current resident memory of this process in MB, or the peak
+    memory if not available on this platform'''
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+        return pages*os.sysconf('SC_PAGE_SIZE')/(1024.0*1024.0)
+    except Exception:
+        return peakMemory()
+
+def peakMemory():
+    '''Return the peak resident memory of this process in MB, or None if not
+    available on this platform'''
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return rss/(1024.0*1024.0)
+    return rss/1024.0
+
+# Top level sections of kicad_pcb that are only parsed on first access when
+# loading lazily. 'footprint' is the KiCad 6+ name of 'module'.
+LazySections = ('segment', 'arc', 'via', 'zone', 'module', 'footprint')
+LazySectionAlias = {'footprint' : 'module'}
+
+_sexp_token = re.compile(rb'"(?:[^"\\]|\\.)*"|[()]')
+_sexp_key = re.compile(rb'\(\s*([^\s()"]+)')
+
+def indexSexp(data):
+    '''Index the top level children of a s-expression
+
+    Returns a list of (key, start, end) byte offsets of each child.
+    '''
+    sections = []
+    depth = 0
+    start = 0
+    for m in _sexp_token.finditer(data):
+        c = m.group()
+        if c == b'(':
+            depth += 1
+            if depth == 2:
+                start = m.start()
+        elif c == b')':
+            if depth == 2:
+                key = _sexp_key.match(data, start).group(1).decode('ascii')
+                sections.append((key, start, m.end()))
+            depth -= 1
+    return sections
+
+# Top level board items tracked by incremental update. Changes in the sections
+# of RevisionFullRebuild, or of the board thickness, require a full rebuild.
+RevisionItems = ('module', 'segment', 'arc', 'via', 'zone')
+RevisionFullRebuild = ('layers', 'setup')
+
+def boardRevision(data):
+    '''Return {key: [digest of each top level item in file order]}'''
+    import hashlib
+    revision = defaultdict(list)
+    for key,start,end in indexSexp(data):
+        revision[LazySectionAlias.get(key, key)].append(
+                hashlib.sha1(data[start:end]).digest())
+    return revision
+
+def diffRevisions(old, new):
+    '''Return {key: (removed, added)} of the changed top level items
+
+    removed are the item indices in the old revision, and added the indices
+    in the new one. A modified item is both removed and added.
+    '''
+    changes = {}
+    for key in set(old) | set(new):
+        o = old.get(key, [])
+        n = new.get(key, [])
+        if o == n:
+            continue
+        ret = []
+        for a,b in ((o,n), (n,o)):
+            count = Counter(b)
+            idx = []
+            for i,d in enumerate(a):
+                if count[d] > 0:
+                    count[d] -= 1
+                else:
+                    idx.append(i)
+            ret.append(idx)
+        changes[key] = tuple(ret)
+    return changes
+
+class LazyKicadPCB(object):
+    '''A KicadPCB proxy that parses the bulky sections on demand
+
+    The file is first indexed by the byte offset of its top level sections.
+    Everything other than the sections in `LazySections` is parsed right
+    away. The rest are parsed on first attribute access, e.g. `pcb.zone`.
+    Parse time and size of each section are recorded in `stats`.
+    '''
+
+    def __init__(self, filename, quote_no_parse=None, encoding='utf-8'):
+        self._filename = filename
+        self._quote_no_parse = quote_no_parse
+        self._encoding = encoding
+        self._loaded = {}
+        self._spans = defaultdict(list)
+        self.stats = {}
+
+        t = time.time()
+        with open(filename, 'rb') as f:
+            data = f.read()
+        sections = indexSexp(data)
+        self.stats['index'] = time.time() - t
+
+        t = time.time()
+        head = []
+        pos = 0
+        for key,start,end in sections:
+            if key not in LazySections:
+                continue
+            self._spans[LazySectionAlias.get(key, key)].append((start, end))
+            head.append(data[pos:start])
+            pos = end
+        head.append(data[pos:])
+        del data
+        self._head = KicadPCB(parseSexp(b''.join(head).decode(encoding),
+                                        quote_no_parse))
+        self.stats['head'] = time.time() - t
+
+    @staticmethod
+    def load(filename, quote_no_parse=None, encoding='utf-8'):
+        pcb = LazyKicadPCB(filename, quote_no_parse, encoding)
+        if pcb._key != 'kicad_pcb':
+            # not a board file, e.g. kicad_mod, nothing to be lazy about
+            return KicadPCB.load(filename, quote_no_parse, encoding)
+        return pcb
+
+    @property
+    def _key(self):
+        return self._head._key
+
+    def _loadSection(self, key):
+        t = time.time()
+        spans = self._spans.pop(key)
+        size = 0
+        content = ['(kicad_pcb ']
+        with open(self._filename, 'rb') as f:
+            for start,end in spans:
+                f.seek(start)
+                content.append(f.read(end-start).decode(self._encoding))
+                size += end - start
+        content.append(')')
+        pcb = KicadPCB(parseSexp('\n'.join(content), self._quote_no_parse))
+        value = getattr(pcb, key)
+        self._loaded[key] = value
+        elapsed = time.time() - t
+        self.stats[key] = (elapsed, size, len(spans))
+        memory = peakMemory()
+        logger.info('parsed {} {}(s), {} bytes in {:.3f}s{}'.format(
+            len(spans), key, size, elapsed,
+            ', peak memory {:.1f}MB'.format(memory) if memory else ''))
+        return value
+
+    def __getattr__(self, key):
+        if key.startswith('_') or key == 'stats':
+            raise AttributeError(key)
+        try:
+            return self._loaded[key]
+        except KeyError:
+            pass
+        if key in self._spans:
+            return self._loadSection(key)
+        return getattr(self._head, key)
+
+    def __contains__(self, key):
+        return key in self._loaded or key in self._spans or key in self._head
+
+    def __getitem__(self, key):
+        return self._head[key]
+
+    def loadAll(self):
+        '''Parse all pending sections'''
+        for key in list(self._spans):
+            self._loadSection(key)
+
+class ParseCache(object):
+    '''On disk cache of parsed boards keyed by file content hash
+
+    Each entry stores the parsed s-expression, stackup and net table of a
+    board, so that a warm `KicadFcad` construction only needs to unpickle.
+    The cache directory is bounded by `max_size` bytes, with the least
+    recently used entries evicted first. Use `ParseCache.get()` to share one
+    instance (and its hit/miss counter) per directory.
+    '''
+
+    _instances = {}
+    ext = '.pickle'
+
+    def __init__(self, path, max_size=512*1024*1024):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._hashes = {}
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    @classmethod
+    def get(cls, path):
+        if isinstance(path, cls):
+            return path
+        path = os.path.abspath(os.path.expanduser(path))
+        try:
+            return cls._instances[path]
+        except KeyError:
+            cache = cls._instances[path] = cls(path)
+            return cache
+
+    def fileHash(self, filename):
+        # Only re-hash the file content if its time stamp or size changed
+        st = os.stat(filename)
+        stamp = (st.st_mtime, st.st_size)
+        filename = os.path.abspath(filename)
+        try:
+            h = self._hashes[filename]
+            if h[0] == stamp:
+                return h[1]
+        except KeyError:
+            pass
+        import hashlib
+        sha = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1<<20), b''):
+                sha.update(chunk)
+        h = sha.hexdigest()
+        self._hashes[filename] = (stamp, h)
+        return h
+
+    def key(self, filename, *params):
+        import hashlib
+        sha = hashlib.sha1(self.fileHash(filename).encode('ascii'))
+        sha.update(repr(params).encode('utf-8'))
+        return sha.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + self.ext)
+
+    def load(self, key):
+        entry = self._entry(key)
+        try:
+            with open(entry, 'rb') as f:
+                obj = pickle.load(f)
+        except Exception:
+            self.misses += 1
+            return None
+        # touch for LRU eviction
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return obj
+
+    def store(self, key, obj):
+        entry = self._entry(key)
+        tmp = '{}.{}.tmp'.format(entry, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, entry)
+        except Exception as e:
+            logger.warning('failed to store parse cache: {}'.format(e))
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(self.ext):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for _,size,path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name.endswith(self.ext):
+                os.remove(os.path.join(self.path, name))
+        self.hits = self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+class ModelDiskCache(ParseCache):
+    '''On disk cache of imported 3D models
+
+    Each model is stored as BREP named by the content hash of its STEP file,
+    so that identical files found under different paths share one entry. An
+    index file remembers the time stamp, size and hash of each model path,
+    and the colors of each entry, so that a warm load neither hashes nor
+    parses the STEP file.
+    '''
+
+    _instances = {}
+    ext = '.brep'
+
+    def __init__(self, path, max_size=2048*1024*1024):
+        super(ModelDiskCache, self).__init__(path, max_size)
+        self._index = os.path.join(self.path, 'index.json')
+        self._colors = {}
+        self._dirty = False
+        try:
+            with open(self._index, 'r') as f:
+                index = json.load(f)
+            self._colors = index['colors']
+            self._hashes = dict((path, (tuple(stamp), h))
+                                for path,(stamp,h) in index['files'].items())
+        except Exception:
+            pass
+
+    def fileHash(self, filename):
+        path = os.path.abspath(filename)
+        old = self._hashes.get(path, None)
+        h = super(ModelDiskCache, self).fileHash(filename)
+        if self._hashes[path] != old:
+            self._dirty = True
+        return h
+
+    def fileStamp(self, filename):
+        '''Return (stamp, hash) of a file hashed by fileHash()'''
+        return self._hashes.get(os.path.abspath(filename), None)
+
+    def setFileStamp(self, filename, stamp):
+        '''Record (stamp, hash) of a file hashed elsewhere, e.g. in a worker'''
+        path = os.path.abspath(filename)
+        stamp = (tuple(stamp[0]), stamp[1])
+        if self._hashes.get(path, None) != stamp:
+            self._hashes[path] = stamp
+            self._dirty = True
+
+    def load(self, key):
+        '''Return (shape, colors) of a model content hash, or None'''
+        entry = self._entry(key)
+        if not os.path.isfile(entry):
+            self.misses += 1
+            return None
+        shape = Part.Shape()
+        try:
+            shape.importBrep(entry)
+        except Exception as e:
+            logger.warning('failed to load model cache: {}'.format(e))
+            self.misses += 1
+            return None
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return shape, [tuple(c) for c in self._colors.get(key, [])]
+
+    def store(self, key, obj):
+        shape, colors = obj
+        entry = self._entry(key)
+        tmp = '{}.{}.tmp'.format(entry, os.getpid())
+        try:
+            shape.exportBrep(tmp)
+            os.replace(tmp, entry)
+        except Exception as e:
+            logger.warning('failed to store model cache: {}'.format(e))
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self._colors[key] = [list(c) for c in colors]
+        self._dirty = True
+        self.flush()
+        self.evict()
+
+    def flush(self):
+        '''Write the index if changed'''
+        if not self._dirty:
+            return
+        tmp = '{}.{}.tmp'.format(self._index, os.getpid())
+        index = {'files': dict((path, [list(stamp), h])
+                                for path,(stamp,h) in self._hashes.items()),
+                 'colors': self._colors}
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp, self._index)
+            self._dirty = False
+        except Exception as e:
+            logger.warning('failed to write model cache index: {}'.format(e))
+
+    def clear(self):
+        super(ModelDiskCache, self).clear()
+        self._hashes.clear()
+        self._colors.clear()
+        self._dirty = True
+        self.flush()
+
+_kicad_paths = {}
+
 def getKicadPath(env=''):
+    '''Return the KiCad 3D model library directory found in kicad_common
+
+    The result is remembered per `env`, call `clearKicadPath()` to look it up
+    again.
+    '''
+    try:
+        return _kicad_paths[env]
+    except KeyError:
+        path = _kicad_paths[env] = _getKicadPath(env)
+        return path
+
+def clearKicadPath():
+    _kicad_paths.clear()
+
+def _getKicadPath(env=''):
     confpath = ''
     if env:
         confpath = os.path.expanduser(os.environ.get(env,''))
@@ -493,41 +1808,238 @@ def getKicadPath(env=''):
             logger.info("Found kicad_common at {}".format(kicad_common))
     with open(kicad_common,'r') as f:
         content = f.read()
-    match = re.search(r'^\s*"*KISYS3DMOD"*\s*[:=]\s*([^\r\n]+)',content,re.MULTILINE)
+    match = re.search(r'^\s*"*(?:KISYS3DMOD|KICAD\d*_3DMODEL_DIR)"*\s*[:=]\s*([^\r\n]+)',
+                      content,re.MULTILINE)
     if not match:
         logger.warning('no KISYS3DMOD found')
         return None
 
-    return match.group(1).rstrip(' "')
+    return match.group(1).strip(' ",')
+
+# library path variables of footprint models
+_model_path_vars = re.compile(r'^\$\{(?:KISYS3DMOD|KICAD\d*_3DMODEL_DIR)\}[\\/]*')
+
+class ModelIndex(object):
+    '''Index of the STEP files under a 3D model library directory
+
+    Files are indexed by their lower case path relative to the library
+    directory without extension, so that resolving a footprint model is a
+    dictionary lookup instead of a few stat calls per model. If `cache_dir`
+    is given, the index is persisted there, and reused as long as the
+    modification time of none of the library directories changed. Use
+    `ModelIndex.get()` to share one instance per directory.
+    '''
+
+    _instances = {}
+    # in the order of preference
+    extensions = ('.stp','.STP','.step','.STEP')
+
+    def __init__(self, root, cache_dir=None):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        # lower case relative path without extension -> [file]
+        self.files = {}
+        # directory -> modification time
+        self.dirs = {}
+        self._path = None
+        if cache_dir:
+            import hashlib
+            self._path = os.path.join(os.path.abspath(os.path.expanduser(cache_dir)),
+                    'package3d-{}.json'.format(
+                        hashlib.sha1(self.root.encode('utf-8')).hexdigest()[:16]))
+        if not self._loadIndex():
+            self.build()
+            self._saveIndex()
+
+    @classmethod
+    def get(cls, root, cache_dir=None):
+        key = (os.path.abspath(os.path.expanduser(root)), cache_dir)
+        try:
+            index = cls._instances[key]
+        except KeyError:
+            index = cls._instances[key] = cls(root, cache_dir)
+            return index
+        if not index.valid():
+            index.build()
+            index._saveIndex()
+        return index
+
+    def valid(self):
+        for path,mtime in self.dirs.items():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return False
+            except OSError:
+                return False
+        return bool(self.dirs)
+
+    def build(self):
+        t = time.time()
+        self.files = {}
+        self.dirs = {}
+        order = dict((e,i) for i,e in enumerate(self.extensions))
+        for path,_,names in os.walk(self.root, followlinks=True):
+            try:
+                self.dirs[path] = os.path.getmtime(path)
+            except OSError:
+                continue
+            for name in names:
+                stem,ext = os.path.splitext(name)
+                if ext.lower() not in ('.stp', '.step'):
+                    continue
+                key = os.path.relpath(os.path.join(path, stem), self.root)
+                key = key.replace(os.sep, '/').lower()
+                self.files.setdefault(key, []).append(os.path.join(path, name))
+        for files in self.files.values():
+            files.sort(key=lambda f : order.get(os.path.splitext(f)[1], len(order)))
+        logger.info('indexed {} models in {} directories in {:.3f}s'.format(
+            len(self.files), len(self.dirs), time.time()-t))
+
+    def _loadIndex(self):
+        if not self._path:
+            return False
+        try:
+            with open(self._path, 'r') as f:
+                index = json.load(f)
+            if index['root'] != self.root:
+                return False
+            self.dirs = index['dirs']
+            self.files = index['files']
+        except Exception:
+            return False
+        return self.valid()
+
+    def _saveIndex(self):
+        if not self._path:
+            return
+        tmp = '{}.{}.tmp'.format(self._path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(self._path)):
+                os.makedirs(os.path.dirname(self._path))
+            with open(tmp, 'w') as f:
+                json.dump({'root': self.root, 'dirs': self.dirs,
+                           'files': self.files}, f)
+            os.replace(tmp, self._path)
+        except Exception as e:
+            logger.warning('failed to save model index: {}'.format(e))
 
-_model_cache = {}
+    def find(self, path):
+        '''Return the STEP files of a model path relative to the library
+        directory, in the order of preference'''
+        key = os.path.splitext(path)[0].replace('\\', '/').strip('/').lower()
+        return self.files.get(key, [])
+
+# estimated memory size of a model face, used if the shape has no MemSize
+_model_face_bytes = 8192
+
+def modelWeight(obj):
+    '''Return the estimated memory size in bytes of a model (shape, colors,
+    mtime)'''
+    shape = obj[0]
+    try:
+        size = shape.MemSize
+    except Exception:
+        size = 0
+    if not size:
+        size = len(shape.Faces)*_model_face_bytes
+    return size + 32*len(obj[1])
+
+class ModelCache(ShapeCache):
+    '''Memory bounded least recently used cache of imported models
+
+    Entries are keyed by model file path, and by content hash if a
+    ModelDiskCache is used. Models sharing a shape are only accounted once.
+
+    Args:
+        max_bytes: memory budget in bytes, 0 for unlimited
+    '''
+
+    def __init__(self, max_bytes=1024*1024*1024):
+        super(ModelCache, self).__init__(0, max_bytes, modelWeight)
+
+    def _identity(self, value):
+        return id(value[0])
+
+# process wide cache of imported models, with its memory budget in MB set by
+# environment variable FCAD_PCB_MODEL_CACHE_MB
+_model_cache = ModelCache(
+        int(float(os.environ.get('FCAD_PCB_MODEL_CACHE_MB', 1024))*1024*1024))
+
+def modelCache():
+    '''Return the in memory cache of imported models, e.g. to change its
+    budget by setting `max_weight`, or to get its stats()'''
+    return _model_cache
 
 def clearModelCache():
-    _model_cache = {}
+    _model_cache.clear()
 
 def recomputeObj(obj):
     obj.recompute()
     obj.purgeTouched()
 
-def loadModel(filename):
+def loadModel(filename, disk_cache=None):
+    '''Return (shape, colors, mtime) of a STEP model
+
+    Args:
+        filename: model file path
+
+        disk_cache: optional directory (or ModelDiskCache) to persist the
+        imported models across sessions
+    '''
     mtime = None
     try:
         mtime = os.path.getmtime(filename)
-        obj = _model_cache[filename]
-        if obj[2] == mtime:
-            logger.info('model cache hit');
-            return obj
-        else:
+        obj = _model_cache.get(filename)
+        if obj is not None:
+            if obj[2] == mtime:
+                logger.info('model cache hit');
+                return obj
             logger.info('model reload due to time stamp change');
-    except KeyError:
-        pass
     except OSError:
         return
 
-    import ImportGui
-    doc = getActiveDoc()
+    cache = None
+    if disk_cache:
+        cache = ModelDiskCache.get(disk_cache)
+        key = cache.fileHash(filename)
+        # identical file under another path
+        cached = _model_cache.get(key, None)
+        if cached is None:
+            cached = cache.load(key)
+            cache.flush()
+        if cached:
+            logger.info('model disk cache hit')
+            obj = (cached[0], cached[1], mtime)
+            _model_cache.put(key, obj)
+            _model_cache.put(filename, obj)
+            return obj
+
     if not os.path.isfile(filename):
         return
+    try:
+        shape, colors = importModel(filename)
+    except Exception as ex:
+        logger.error('failed to load model: {}'.format(ex))
+        return
+    return cacheModel(filename, shape, colors, mtime, cache)
+
+def cacheModel(filename, shape, colors, mtime, disk_cache=None):
+    '''Add an imported model to the model cache, and return (shape, colors,
+    mtime)'''
+    obj = (shape, colors, mtime)
+    _model_cache.put(filename, obj)
+    if disk_cache:
+        cache = ModelDiskCache.get(disk_cache)
+        key = cache.fileHash(filename)
+        _model_cache.put(key, obj)
+        cache.store(key, obj[:2])
+    return obj
+
+def importModel(filename, doc=None):
+    '''Import a STEP model into a document, and return (shape, colors)
+    without leaving any object behind'''
+    import ImportGui
+    if doc is None:
+        doc = getActiveDoc()
     count = len(doc.Objects)
     dobjs = []
     try:
@@ -537,18 +2049,595 @@ def loadModel(filename):
         setObjectLinks(obj, 'Links', dobjs)
         recomputeObj(obj)
         dobjs = [obj]+dobjs
-        obj = (obj.Shape.copy(),obj.ViewObject.DiffuseColor,mtime)
-        _model_cache[filename] = obj
-        return obj
-    except Exception as ex:
-        logger.error('failed to load model: {}'.format(ex))
+        try:
+            colors = obj.ViewObject.DiffuseColor
+        except Exception:
+            # no view object without GUI
+            colors = []
+        return obj.Shape.copy(), colors
     finally:
         for o in dobjs:
             doc.removeObject(o.Name)
 
+def _importModelWorker(filename, disk_cache=None):
+    # Import a STEP model in a (spawned) worker process, and return its BREP,
+    # colors, file time stamp, and the (stamp, hash) of the file if a disk
+    # cache is given. The BREP is None if the model is in the disk cache.
+    t = time.time()
+    mtime = os.path.getmtime(filename)
+    stamp = None
+    if disk_cache:
+        cache = ModelDiskCache.get(disk_cache)
+        key = cache.fileHash(filename)
+        stamp = cache.fileStamp(filename)
+        if os.path.isfile(cache._entry(key)):
+            return None, [], mtime, stamp, time.time() - t
+    import FreeCADGui
+    try:
+        # view objects (for colors) without a main window
+        FreeCADGui.setupWithoutGUI()
+    except Exception:
+        pass
+    doc = FreeCAD.newDocument('kicad_fcad_model')
+    try:
+        shape, colors = importModel(filename, doc)
+    finally:
+        FreeCAD.closeDocument(doc.Name)
+    return shapeToBrep(shape), [tuple(c) for c in colors], mtime, stamp, \
+           time.time() - t
+
+class BoardIndex(object):
+    '''Index of board items by copper layer
+
+    Built once per board so that generating a copper layer only visits the
+    items on that layer. Pads, zones and graphics are assigned using a bit
+    mask of copper layers, with wildcard layers (e.g. '*.Cu', 'F&B.Cu')
+    expanded at build time.
+    '''
+
+    def __init__(self, pcb, coppers, findLayer):
+        self.bits = dict((name, 1<<layer) for layer,name in coppers)
+        self.copper_mask = 0
+        for bit in self.bits.values():
+            self.copper_mask |= bit
+        self.pad_count = 0
+
+        # layer -> {footprint index -> [(pad index, pad)]}. Footprints with
+        # only graphics on the layer are recorded with an empty pad list.
+        self.footprints = defaultdict(dict)
+        # layer -> [(track type, track)]
+        self.tracks = defaultdict(list)
+        # layer -> [(via index, via)]
+        self.vias = defaultdict(list)
+        # layer -> [zone]
+        self.zones = defaultdict(list)
+        # layer -> [gr_poly]
+        self.polys = defaultdict(list)
+
+        # net code -> {item type -> [item]}, where item type is one of 'pad',
+        # 'track', 'via' and 'zone'. Pad items are (footprint index, pad
+        # index, pad), track items are (track type, track), via items are
+        # (via index, via).
+        self.nets = defaultdict(lambda: defaultdict(list))
+
+        # Same as the layer maps above, but keyed by (layer, net code)
+        self.net_footprints = defaultdict(dict)
+        self.net_tracks = defaultdict(list)
+        self.net_vias = defaultdict(list)
+        self.net_zones = defaultdict(list)
+
+        for i,m in enumerate(pcb.module):
+            self.pad_count += len(m.pad)
+            for j,p in enumerate(m.pad):
+                net = getNetCode(p)
+                if net is not None:
+                    self.nets[net]['pad'].append((i,j,p))
+                for layer in self.layers(self.mask(getLayers(p))):
+                    self.footprints[layer].setdefault(i, []).append((j,p))
+                    if net is not None:
+                        self.net_footprints[layer,net].setdefault(i, []).append((j,p))
+            mask = 0
+            for tp in 'line','arc','circle','curve','poly','rect':
+                primitives = getattr(m, 'fp_' + tp, None)
+                if not primitives:
+                    continue
+                for l in SexpList(primitives):
+                    mask |= self.mask(getLayers(l))
+            for layer in self.layers(mask):
+                self.footprints[layer].setdefault(i, [])
+
+        for tp,ss in (('segment',pcb.segment), ('arc',getattr(pcb, 'arc', []))):
+            for s in ss:
+                net = getNetCode(s)
+                if net is not None:
+                    self.nets[net]['track'].append((tp,s))
+                bit = self.bits.get(unquote(s.layer), 0)
+                if bit:
+                    layer = bit.bit_length()-1
+                    self.tracks[layer].append((tp,s))
+                    if net is not None:
+                        self.net_tracks[layer,net].append((tp,s))
+
+        for i,v in enumerate(pcb.via):
+            net = getNetCode(v)
+            if net is not None:
+                self.nets[net]['via'].append((i,v))
+            layers = [findLayer(s)[0] for s in v.layers]
+            for layer in self.layers(self.copper_mask):
+                if min(layers) <= layer <= max(layers):
+                    self.vias[layer].append((i,v))
+                    if net is not None:
+                        self.net_vias[layer,net].append((i,v))
+
+        for z in pcb.zone:
+            net = getNetCode(z)
+            if net is not None:
+                self.nets[net]['zone'].append(z)
+            for layer in self.layers(self.mask(getLayers(z))):
+                self.zones[layer].append(z)
+                if net is not None:
+                    self.net_zones[layer,net].append(z)
+
+        for p in SexpList(getattr(pcb, 'gr_poly', [])):
+            if hasattr(p, 'layer') or hasattr(p, 'layers'):
+                mask = self.mask(getLayers(p))
+            else:
+                mask = self.copper_mask
+            for layer in self.layers(mask):
+                self.polys[layer].append(p)
+
+    def layerFootprints(self, layer, nets=None):
+        '''Return {footprint index: [(pad index, pad)]} on a layer, optionally
+        restricted to pads of the given net codes'''
+        if not nets:
+            return self.footprints[layer]
+        if len(nets) == 1:
+            for net in nets:
+                return self.net_footprints.get((layer,net), {})
+        footprints = defaultdict(list)
+        for net in nets:
+            for i,pads in self.net_footprints.get((layer,net), {}).items():
+                footprints[i] += pads
+        for pads in footprints.values():
+            pads.sort(key=lambda p : p[0])
+        return footprints
+
+    def layerItems(self, items, net_items, layer, nets=None):
+        if not nets:
+            return items[layer]
+        ret = []
+        for net in sorted(nets):
+            ret += net_items.get((layer,net), [])
+        return ret
+
+    def layerTracks(self, layer, nets=None):
+        return self.layerItems(self.tracks, self.net_tracks, layer, nets)
+
+    def layerVias(self, layer, nets=None):
+        return self.layerItems(self.vias, self.net_vias, layer, nets)
+
+    def layerZones(self, layer, nets=None):
+        return self.layerItems(self.zones, self.net_zones, layer, nets)
+
+    def netItems(self, item_type, nets):
+        ret = []
+        for net in sorted(nets):
+            try:
+                ret += self.nets[net][item_type]
+            except KeyError:
+                pass
+        return ret
+
+    def mask(self, layers):
+        mask = 0
+        for name in layers:
+            if name in ('*', '*.Cu'):
+                mask |= self.copper_mask
+            else:
+                mask |= self.bits.get(name, 0)
+        return mask
+
+    def layers(self, mask):
+        layer = 0
+        while mask:
+            if mask & 1:
+                yield layer
+            mask >>= 1
+            layer += 1
+
+
+class UnionFind(object):
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, key):
+        parent = self.parent.setdefault(key, key)
+        if parent == key:
+            return key
+        root = parent
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # path compression
+        while key != root:
+            key, self.parent[key] = self.parent[key], root
+        return root
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a != b:
+            self.parent[b] = a
+
+def _pieceGroup(sub, points, cell, tol=1e-4):
+    # Return the group with the most (x, y, group) points inside a solid,
+    # face or wire, looked up in a grid of cell size, or None if no point
+    b = sub.BoundBox
+    if sub.ShapeType == 'Solid':
+        # test at the level of each horizontal face, as the middle of a
+        # multilayer solid may fall in between the copper layers
+        levels = set()
+        for face in sub.Faces:
+            if face.BoundBox.ZLength < tol:
+                levels.add(round(face.BoundBox.ZMin, 6))
+        target = sub
+    else:
+        levels = [b.ZMin]
+        target = sub
+        if sub.ShapeType == 'Wire':
+            try:
+                target = Part.Face(sub)
+            except Exception:
+                target = None
+    votes = Counter()
+    for i in range(int(b.XMin//cell), int(b.XMax//cell)+1):
+        for j in range(int(b.YMin//cell), int(b.YMax//cell)+1):
+            for x,y,group in points.get((i,j), []):
+                if not (b.XMin-tol <= x <= b.XMax+tol and b.YMin-tol <= y <= b.YMax+tol):
+                    continue
+                if target is None:
+                    votes[group] += 1
+                    continue
+                for z in levels:
+                    if target.isInside(Vector(x,y,z), tol, True):
+                        votes[group] += 1
+                        break
+    if not votes:
+        return None
+    return votes.most_common(1)[0][0]
+
+def _pointInPolygon(pts, x, y):
+    inside = False
+    x0,y0 = pts[-1]
+    for x1,y1 in pts:
+        if (y0 > y) != (y1 > y) and x < x0 + (y-y0)*(x1-x0)/(y1-y0):
+            inside = not inside
+        x0,y0 = x1,y1
+    return inside
+
+def _pointNearPath(pts, r, x, y):
+    r2 = r*r
+    for (x0,y0),(x1,y1) in zip(pts, pts[1:]):
+        dx = x1-x0
+        dy = y1-y0
+        d2 = dx*dx + dy*dy
+        t = 0.0 if not d2 else max(0.0, min(1.0, ((x-x0)*dx + (y-y0)*dy)/d2))
+        ex = x0 + t*dx - x
+        ey = y0 + t*dy - y
+        if ex*ex + ey*ey <= r2:
+            return True
+    return False
+
+def _segmentsNear(a, b, c, d, r):
+    # Check if segment (a, b) is within r of segment (c, d)
+    (ax,ay),(bx,by),(cx,cy),(dx,dy) = a, b, c, d
+    d1 = (dx-cx)*(ay-cy) - (dy-cy)*(ax-cx)
+    d2 = (dx-cx)*(by-cy) - (dy-cy)*(bx-cx)
+    d3 = (bx-ax)*(cy-ay) - (by-ay)*(cx-ax)
+    d4 = (bx-ax)*(dy-ay) - (by-ay)*(dx-ax)
+    if (d1 > 0) != (d2 > 0) and (d3 > 0) != (d4 > 0):
+        return True
+    return _pointNearPath((a, b), r, cx, cy) or _pointNearPath((a, b), r, dx, dy) \
+            or _pointNearPath((c, d), r, ax, ay) or _pointNearPath((c, d), r, bx, by)
+
+def _padOutline(x, y, angle, size, shape):
+    # Return the outline points of a pad, with circle and oval pads made
+    # of arc segments, and the other shapes approximated by their rectangle
+    w,h = size
+    if shape in ('circle', 'oval'):
+        r = min(w, h)
+        if shape == 'circle':
+            w = h = r
+        pts = []
+        for cx,cy,start in ((w-r, h-r, -0.5*pi), (r-w, r-h, 0.5*pi)):
+            for i in range(9):
+                a = start + i*pi/8
+                if w >= h:
+                    pts.append((cx + r*cos(a), r*sin(a)))
+                else:
+                    pts.append((r*sin(a), cy + r*cos(a)))
+    else:
+        pts = [(-w,-h), (w,-h), (w,h), (-w,h)]
+    c = cos(angle)
+    s = sin(angle)
+    return [(x + px*c - py*s, y + px*s + py*c) for px,py in pts]
+
+class Connectivity(object):
+    '''Physical connectivity of the copper items of each net
+
+    Items are pads, tracks (segments and arcs), vias and zone filled
+    polygons. Two pads, tracks or vias of the same net are connected if an
+    anchor point of one (track ends, via and pad centers) lies within the
+    other on a common copper layer. A zone filled polygon is connected to an
+    item of the same net if their outlines overlap, e.g. through the spokes
+    of a thermal relief pad, or a track crossing the zone, and to another
+    filled polygon the same way. Connected items are merged with a
+    union-find, and each resulting set is an island.
+
+    Attributes:
+        islands: {net code: [island]}, with each island being a list of
+        (item type, item) sorted by decreasing island size. Item type is
+        one of 'pad', 'track', 'via' and 'zone', where a zone item is a
+        filled polygon.
+
+        anchors: {item id: [(x, y)]}, points known to be inside the copper
+        of each item, i.e. pad and via centers, track ends and the first
+        vertex of a zone filled polygon.
+    '''
+
+    def __init__(self, fcad, tolerance=1e-3):
+        t = time.time()
+        self.tolerance = tolerance
+        self.islands = {}
+        # id of zone filled polygon -> zone
+        self.zones = {}
+        self.anchors = {}
+        pcb = fcad.pcb
+        coppers = [l for l,_ in fcad._copperLayers()]
+        index = fcad.boardIndex()
+        for net,items in index.nets.items():
+            if not net:
+                continue
+            shapes = defaultdict(list)
+            anchors = defaultdict(list)
+            kinds = {}
+
+            for i,_,p in items.get('pad', []):
+                # pad position is relative to the footprint, while its angle
+                # is absolute
+                m_at,m_angle = getAt(pcb.module[i])
+                at,angle = getAt(p)
+                c = cos(radians(m_angle))
+                s = sin(radians(m_angle))
+                at = Vector(m_at.x + at.x*c - at.y*s, m_at.y + at.x*s + at.y*c, 0)
+                try:
+                    size = (p.size[0]*0.5, p.size[1]*0.5)
+                except Exception:
+                    size = (0, 0)
+                kinds[id(p)] = ('pad', p)
+                self.anchors[id(p)] = [(at.x, at.y)]
+                outline = _padOutline(at.x, at.y, radians(angle), size, p[2])
+                for layer in fcad._layerTypes(getLayers(p)):
+                    shapes[layer].append((id(p), 'rect',
+                                          (at.x, at.y, radians(angle), size, outline)))
+                    anchors[layer].append((id(p), at.x, at.y))
+
+            for tp,s in items.get('track', []):
+                pts = [makeVect(s.start)]
+                if tp == 'arc':
+                    pts.append(makeVect(s.mid))
+                pts.append(makeVect(s.end))
+                pts = [(v.x, v.y) for v in pts]
+                kinds[id(s)] = ('track', s)
+                self.anchors[id(s)] = [pts[0], pts[-1]]
+                for layer in fcad._layerTypes([unquote(s.layer)]):
+                    shapes[layer].append((id(s), 'path', (pts, s.width*0.5)))
+                    anchors[layer] += [(id(s),) + pts[0], (id(s),) + pts[-1]]
+
+            for _,v in items.get('via', []):
+                at = makeVect(v.at)
+                kinds[id(v)] = ('via', v)
+                self.anchors[id(v)] = [(at.x, at.y)]
+                ends = [coppers.index(l) for l in fcad._layerTypes(getLayers(v))
+                            if l in coppers]
+                for layer in coppers[min(ends):max(ends)+1] if ends else []:
+                    shapes[layer].append((id(v), 'path', ([(at.x, at.y)]*2, v.size*0.5)))
+                    anchors[layer].append((id(v), at.x, at.y))
+
+            for z in items.get('zone', []):
+                for p in SexpList(getattr(z, 'filled_polygon', [])):
+                    pts = [makeVect(xy) for xy in SexpList(p.pts.xy)]
+                    pts = [(v.x, v.y) for v in pts]
+                    kinds[id(p)] = ('zone', p)
+                    self.zones[id(p)] = z
+                    self.anchors[id(p)] = pts[:1]
+                    layer_of = p if hasattr(p, 'layer') else z
+                    for layer in fcad._layerTypes(getLayers(layer_of)):
+                        shapes[layer].append((id(p), 'poly', pts))
+
+            uf = UnionFind()
+            for key in kinds:
+                uf.find(key)
+            for layer,layer_shapes in shapes.items():
+                self._connect(uf, layer_shapes, anchors[layer])
+
+            groups = defaultdict(list)
+            for key,item in kinds.items():
+                groups[uf.find(key)].append(item)
+            self.islands[net] = sorted(groups.values(), key=len, reverse=True)
+        self.elapsed = time.time() - t
+
+    def _connect(self, uf, shapes, anchors):
+        tol = self.tolerance
+        cell = 2.0
+        grid = defaultdict(list)
+        # zone polygons are usually much larger, so they are put in a
+        # coarser grid by bound box, and their edges in a finer grid
+        poly_cell = 10.0
+        poly_grid = defaultdict(list)
+        edge_grid = defaultdict(list)
+        polys = []
+        items = []
+        for key,kind,data in shapes:
+            if kind == 'poly':
+                xs = [pt[0] for pt in data]
+                ys = [pt[1] for pt in data]
+                poly = (key, data, min(xs), min(ys), max(xs), max(ys))
+                polys.append(poly)
+                for i in range(int(poly[2]//poly_cell), int(poly[4]//poly_cell)+1):
+                    for j in range(int(poly[3]//poly_cell), int(poly[5]//poly_cell)+1):
+                        poly_grid[i,j].append(poly)
+                for a,b in zip(data, data[1:] + data[:1]):
+                    for i in range(int(min(a[0],b[0])//cell), int(max(a[0],b[0])//cell)+1):
+                        for j in range(int(min(a[1],b[1])//cell), int(max(a[1],b[1])//cell)+1):
+                            edge_grid[i,j].append((key, a, b))
+                continue
+            if kind == 'rect':
+                outline = data[4]
+                pts = outline
+                segs = list(zip(outline, outline[1:] + outline[:1]))
+                r = tol
+            else:
+                pts,r = data
+                outline = None
+                segs = list(zip(pts, pts[1:]))
+                r += tol
+            xs = [pt[0] for pt in pts]
+            ys = [pt[1] for pt in pts]
+            xs = (min(xs)-r, max(xs)+r)
+            ys = (min(ys)-r, max(ys)+r)
+            items.append((key, pts, segs, r, outline, xs, ys))
+            for i in range(int(xs[0]//cell), int(xs[1]//cell)+1):
+                for j in range(int(ys[0]//cell), int(ys[1]//cell)+1):
+                    grid[i,j].append((key,kind,data))
+
+        for owner,x,y in anchors:
+            for key,kind,data in grid.get((int(x//cell), int(y//cell)), []):
+                if key == owner:
+                    continue
+                if kind == 'rect':
+                    cx,cy,angle,(w,h),_ = data
+                    dx = x-cx
+                    dy = y-cy
+                    c = cos(angle)
+                    s = sin(angle)
+                    if abs(dx*c + dy*s) > w+tol or abs(-dx*s + dy*c) > h+tol:
+                        continue
+                elif not _pointNearPath(data[0], data[1]+tol, x, y):
+                    continue
+                uf.union(owner, key)
+
+        if not polys:
+            return
+
+        def overlap(key, pts, segs, r, outline, xs, ys):
+            # crossing or touching edges
+            for c,d in segs:
+                for i in range(int((min(c[0],d[0])-r)//cell), int((max(c[0],d[0])+r)//cell)+1):
+                    for j in range(int((min(c[1],d[1])-r)//cell), int((max(c[1],d[1])+r)//cell)+1):
+                        for pkey,a,b in edge_grid.get((i,j), []):
+                            if pkey != key and uf.find(pkey) != uf.find(key) \
+                                    and _segmentsNear(a, b, c, d, r):
+                                uf.union(key, pkey)
+            # Otherwise, one is either completely inside the other or apart,
+            # so it is enough to test one point.
+            for i in range(int(xs[0]//poly_cell), int(xs[1]//poly_cell)+1):
+                for j in range(int(ys[0]//poly_cell), int(ys[1]//poly_cell)+1):
+                    for pkey,ppts,x0,y0,x1,y1 in poly_grid.get((i,j), []):
+                        if pkey == key or uf.find(pkey) == uf.find(key):
+                            continue
+                        x,y = pts[0]
+                        if x0 <= x <= x1 and y0 <= y <= y1 and _pointInPolygon(ppts, x, y):
+                            uf.union(key, pkey)
+                        elif outline and _pointInPolygon(outline, *ppts[0]):
+                            uf.union(key, pkey)
+
+        for item in items:
+            overlap(*item)
+        for key,pts,x0,y0,x1,y1 in polys:
+            overlap(key, pts, list(zip(pts, pts[1:] + pts[:1])), tol, pts,
+                    (x0-tol, x1+tol), (y0-tol, y1+tol))
+
+    def islandCount(self):
+        return sum([len(islands) for islands in self.islands.values()])
+
+    def itemIds(self, items):
+        '''Return the ids of an island or a sequence of items to be used in a
+        LayerContext'''
+        ids = set()
+        for item in items:
+            if isinstance(item, tuple):
+                item = item[1]
+            ids.add(id(item))
+            zone = self.zones.get(id(item), None)
+            if zone is not None:
+                ids.add(id(zone))
+        return frozenset(ids)
+
+LayerContext = namedtuple('LayerContext',
+        ('layer_type', 'layer_name', 'layer', 'layer_match', 'nets', 'items'))
+LayerContext.__doc__ = '''Immutable layer and net filter used by the make methods
+
+`items`, if not None, further restricts the board items to a set of item
+ids, e.g. those of a connected island, see `KicadFcad.connectivity()`.
+
+Obtain one by `KicadFcad.layerContext()`, and pass it to a make method as
+keyword argument `context`, or activate it for the current thread with
+`KicadFcad.useContext()`.
+'''
+
+def contextual(func):
+    '''Decorator to accept an optional `context` keyword argument'''
+    @wraps(func)
+    def wrapper(self, *args, **kwds):
+        context = kwds.pop('context', None)
+        if context is None:
+            return func(self, *args, **kwds)
+        with self.useContext(context):
+            return func(self, *args, **kwds)
+    return wrapper
+
+def _contextProperty(field):
+    def fget(self):
+        return getattr(self.context(), field)
+    def fset(self, value):
+        self._setContext(self.context()._replace(**{field:value}))
+    return property(fget, fset)
+
 class KicadFcad:
+    # Layer states are stored in a LayerContext, which can be overridden per
+    # thread
+    layer_type = _contextProperty('layer_type')
+    # stores layer name as read from the file, may contain quotes depending
+    # on kicad version
+    layer_name = _contextProperty('layer_name')
+    # stores layer name without quote
+    layer = _contextProperty('layer')
+    layer_match = _contextProperty('layer_match')
+    _items = _contextProperty('items')
+
+    @property
+    def _nets(self):
+        return self.context().nets
+
+    @_nets.setter
+    def _nets(self, nets):
+        self._setContext(self.context()._replace(nets=frozenset(nets)))
+
+    @property
+    def prefix(self):
+        # log prefix is per thread
+        return getattr(self._local, 'prefix', '')
+
+    @prefix.setter
+    def prefix(self, prefix):
+        self._local.prefix = prefix
+
     def __init__(self,filename=None,debug=False,**kwds):
 
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._context = LayerContext(0, '', '', None, frozenset(), None)
+
         #############################################################
         # Beginning of user customizable parameters during construction
         self.prefix = ''
@@ -569,12 +2658,42 @@ class KicadFcad:
         self.castellated = False
         self.refine = False
         self.arc_fit_accuracy = 0.0005
+
+        # Refit the dense vertices of zone fills and gr_poly with lines and
+        # arcs within arc_fit_accuracy before making any shape. Edges further
+        # than poly_arc_error from the fitted arc are kept as is.
+        self.poly_fit_arcs = False
+        self.poly_arc_error = 0.005
         self.layer_thickness = 0.01
         self.copper_thickness = 0.05
         self.board_thickness = None
         self.stackup = None
         self.quote_no_parse = None
 
+        # parse bulky sections (tracks, vias, zones, footprints) on first use
+        self.lazy_load = False
+
+        # directory (or ParseCache) to persist parsed boards across sessions
+        self.parse_cache = None
+
+        # directory (or ModelDiskCache) to persist imported 3D models across
+        # sessions
+        self.model_cache = None
+
+        # place footprint models as instances sharing the geometry (and as
+        # App::Link of one feature per model when add_feature is True),
+        # instead of one copy per footprint
+        self.model_instances = True
+
+        # number of worker processes to import 3D models in the background
+        # while make(load_parts=True) is making the board and coppers, 0 to
+        # import them one at a time in loadParts()
+        self.model_workers = 0
+
+        # remember the items of the loaded board, so that update() can find
+        # out what has changed in a new revision
+        self.incremental = False
+
         # set -1 to disable via in pads, 0 to enable as normal, >0 to use as
         # a ratio to via radius for creating a square to simplify via
         self.via_bound = 0
@@ -583,10 +2702,44 @@ class KicadFcad:
         self.via_skip_hole = None
 
         self.add_feature = True
+
+        # Split large area unions (e.g. a whole copper layer) into square tiles
+        # of this size (mm), and process the tiles in parallel. 0 to disable.
+        # Only applies when add_feature is False.
+        self.tile_size = 0
+        # number of worker processes for tiles, default to CPU count, 1 to
+        # process tiles in this process
+        self.tile_workers = None
+
+        # 'flat' to fuse solids (and union large areas when add_feature is
+        # False) in one operation, or 'tree' to fuse groups of nearby shapes
+        # in a balanced tree.
+        self.fuse_strategy = 'flat'
+        # maximum number of shapes fused together at the tree leaves
+        self.fuse_leaf_size = 16
+        # number of worker processes for fusing each tree level, None for CPU
+        # count, 1 to fuse in this process. The workers are spawned in the
+        # FreeCAD GUI, which takes a few seconds on first use.
+        self.fuse_workers = 1
+
+        # 2D geometry backend for area operations when add_feature is False,
+        # 'occ' or 'numpy', see geometry.py. Other than 'occ', curved edges
+        # are discretized within arc_fit_accuracy, and only refitted into
+        # arcs (by fitPolyline) where the operation asks for fit_arcs.
+        self.geometry_backend = 'occ'
+
         self.part_path = None
         self.path_env = 'KICAD_CONFIG_HOME'
         self.hole_size_offset = 0.0001
         self.pad_inflate = 0
+
+        # maximum number of cached pad shape templates, 0 to disable
+        self.pad_cache_size = 1024
+
+        # memoise intermediate 2D shapes (board face, per layer pads, tracks,
+        # zones, etc.) across make calls. Only applies when add_feature is
+        # False.
+        self.build_graph = True
         self.zone_inflate = 0
         self.nets = []
         if filename is None:
@@ -615,7 +2768,61 @@ class KicadFcad:
 
         if not self.part_path:
             self.part_path = getKicadPath(self.path_env)
-        self.pcb = KicadPCB.load(self.filename, self.quote_no_parse, self.encoding)
+        self._layer_cache = {}
+        self._board_index = None
+        self._connectivity = None
+        self._pool = None
+        self._pool_workers = None
+        # time of the last fuse of all copper layers in makeCoppers(fuse=True)
+        self._fuse_time = 0.0
+        # hashCode of the holes shape -> sorted bound boxes of each hole
+        self._hole_boxes = {}
+        # model file -> future of a prefetched model import
+        self._model_futures = {}
+        self._model_index = None
+        # model file -> source feature of model links in the active document
+        self._model_features = {}
+        self.pad_cache = ShapeCache(self.pad_cache_size) if self.pad_cache_size else None
+        self.graph = BuildGraph()
+        self._backend = None
+
+        # user supplied values, to be restored on reload by update()
+        self._user_board_thickness = self.board_thickness
+        self._user_stackup = self.stackup
+        self._revision = None
+        self._load()
+
+        self.board_face = None
+        self.board_uid = None
+
+    def _load(self):
+        cache = None
+        cached = None
+        if self.parse_cache:
+            if self.lazy_load:
+                logger.warning('parse cache is ignored when loading lazily')
+            else:
+                cache = ParseCache.get(self.parse_cache)
+                cache_key = cache.key(self.filename, self.quote_no_parse,
+                        self.encoding, self.stackup, self.board_thickness,
+                        self.copper_thickness, self.layer_thickness)
+                cached = cache.load(cache_key)
+                logger.info('parse cache {}, hits: {}, misses: {}'.format(
+                    'hit' if cached else 'miss', cache.hits, cache.misses))
+
+        sexp = None
+        if cached:
+            self.pcb = KicadPCB(pickle.loads(cached['sexp']))
+        elif self.lazy_load:
+            self.pcb = LazyKicadPCB.load(self.filename, self.quote_no_parse, self.encoding)
+        elif cache:
+            with open(self.filename, 'r', encoding=self.encoding) as f:
+                sexp = parseSexp(f.read(), self.quote_no_parse)
+            # serialize before KicadPCB takes over the parsed list
+            sexp = pickle.dumps(sexp, pickle.HIGHEST_PROTOCOL)
+            self.pcb = KicadPCB(pickle.loads(sexp))
+        else:
+            self.pcb = KicadPCB.load(self.filename, self.quote_no_parse, self.encoding)
 
         if self.pcb._key == 'footprint':
             self.pcb._key = 'module'
@@ -661,41 +2868,139 @@ class KicadFcad:
         else:
             self.module = None
 
-        if not self.board_thickness:
-            try:
-                self.board_thickness = self.pcb.general.thickness
-            except Exception:
-                pass
+        if cached:
+            self.board_thickness = cached['board_thickness']
+            self.stackup = cached['stackup']
+            self._stackup_map = cached['stackup_map']
+            self._dielectric_layers = cached['dielectric_layers']
+        else:
             if not self.board_thickness:
-                self.board_thickness = 2.0
-
-        self._dielectric_layers = []
-        self._stackup_map = {}
-        self._initStackUp()
-
-        # stores layer name as read from the file, may contain quotes depending
-        # on kicad version
-        self.layer_name = ''
+                try:
+                    self.board_thickness = self.pcb.general.thickness
+                except Exception:
+                    pass
+                if not self.board_thickness:
+                    self.board_thickness = 2.0
 
-        # stores layer name without quote
-        self.layer = ''
+            self._dielectric_layers = []
+            self._stackup_map = {}
+            self._initStackUp()
 
         self.setLayer(self.layer_type)
 
         if self.via_skip_hole is None and self.via_bound:
             self.via_skip_hole = True
 
-        self._nets = set()
-        self.net_names = dict()
+        self._net_codes = None
+        if cached:
+            self.net_names = cached['net_names']
+        else:
+            self.net_names = dict()
+            if 'net' in self.pcb:
+                for n in self.pcb.net:
+                    self.net_names[n[0]] = n[1]
         if 'net' in self.pcb:
-            for n in self.pcb.net:
-                self.net_names[n[0]] = n[1]
             self.setNetFilter(*self.nets)
 
-        self.board_face = None
-        self.board_uid = None
+        if sexp is not None and not self.module:
+            cache.store(cache_key, {'sexp' : sexp,
+                                    'board_thickness' : self.board_thickness,
+                                    'stackup' : self.stackup,
+                                    'stackup_map' : self._stackup_map,
+                                    'dielectric_layers' : self._dielectric_layers,
+                                    'net_names' : self.net_names})
+
+        if self.incremental and not self.module:
+            if isinstance(self.pcb, LazyKicadPCB):
+                # the file may be overwritten before the next update(), so
+                # the pending sections can't be parsed lazily
+                self.pcb.loadAll()
+            with open(self.filename, 'rb') as f:
+                self._revision = boardRevision(f.read())
+
+    def __getstate__(self):
+        # Drop the caches, document objects, worker pool and thread states,
+        # so that the board model can be cheaply passed to worker processes.
+        state = self.__dict__.copy()
+        for key in ('_local', '_lock', '_pool', '_pool_workers', '_board_index',
+                    '_connectivity', '_model_index', 'board_face', '_backend'):
+            state[key] = None
+        state['_model_futures'] = {}
+        state['_model_features'] = {}
+        # item ids are not valid in another process
+        state['_context'] = self.context()._replace(items=None)
+        state['board_uid'] = None
+        state['active_doc_uuid'] = None
+        state['workplane'] = {}
+        if isinstance(self.holes_cache, dict):
+            state['holes_cache'] = {}
+        if self.pad_cache is not None:
+            state['pad_cache'] = ShapeCache(self.pad_cache.max_size)
+        state['graph'] = BuildGraph()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._lock = threading.RLock()
+
+    def context(self):
+        '''Return the active LayerContext of the current thread'''
+        return getattr(self._local, 'context', None) or self._context
+
+    def _setContext(self, context):
+        if getattr(self._local, 'context', None):
+            self._local.context = context
+        else:
+            self._context = context
+
+    @contextmanager
+    def useContext(self, context):
+        '''Activate a LayerContext for the current thread'''
+        saved = getattr(self._local, 'context', None)
+        self._local.context = context
+        try:
+            yield context
+        finally:
+            self._local.context = saved
+
+    def layerContext(self, layer=None, nets=None, items=None):
+        '''Return a LayerContext without changing any state
+
+        Args:
+            layer: layer name or index, default to the active layer
+
+            nets: sequence of nets as accepted by setNetFilter(), default to
+            the active net filter
+
+            items: sequence of board items to restrict to, e.g. an island
+            returned by netIslands(). A zone filled polygon also selects its
+            zone.
+        '''
+        context = self.context()
+        if layer is not None:
+            context = context._replace(**self._layerFields(layer))
+        if nets is not None:
+            context = context._replace(nets=self._resolveNets(nets))
+        if items is not None:
+            context = context._replace(items=self.connectivity().itemIds(items))
+        return context
 
     def findLayer(self,layer, deftype=None):
+        try:
+            return self._layer_cache[layer]
+        except (KeyError, TypeError):
+            pass
+        with self._lock:
+            ret = self._findLayer(layer, deftype)
+            if ret[0] != deftype:
+                try:
+                    self._layer_cache[layer] = ret
+                except TypeError:
+                    pass
+        return ret
+
+    def _findLayer(self,layer, deftype=None):
         try:
             layer = int(layer)
         except:
@@ -713,13 +3018,112 @@ class KicadFcad:
                 raise KeyError('layer {} not found'.format(layer))
             return (layer, self.pcb.layers[str(layer)][0])
 
-    def setLayer(self,layer):
-        self.layer_type, self.layer_name = self.findLayer(layer)
-        self.layer = unquote(self.layer_name)
-        if self.layer_type <= 31:
-            self.layer_match = '*.Cu'
+    def boardIndex(self):
+        '''Return the per copper layer index of board items'''
+        index = self._board_index
+        if index is None:
+            with self._lock:
+                if self._board_index is None:
+                    self._board_index = BoardIndex(self.pcb,
+                            self._copperLayers(), self.findLayer)
+                index = self._board_index
+        return index
+
+    def connectivity(self):
+        '''Return the connected copper islands of each net, see Connectivity'''
+        connectivity = self._connectivity
+        if connectivity is None:
+            with self._lock:
+                if self._connectivity is None:
+                    self._pushLog('building connectivity...')
+                    self._connectivity = Connectivity(self)
+                    self._popLog('connectivity done, {} nets, {} islands, {:.3f}s',
+                            len(self._connectivity.islands),
+                            self._connectivity.islandCount(),
+                            self._connectivity.elapsed)
+                connectivity = self._connectivity
+        return connectivity
+
+    def netIslands(self, net=None):
+        '''Return {net name: [island]} of the filtered nets, or [island] of
+        the given net
+
+        Each island is a list of physically connected (item type, item), with
+        the largest island first. More than one island in a net usually means
+        the net is not fully routed.
+        '''
+        islands = self.connectivity().islands
+        if net is not None:
+            ret = []
+            for code in self._resolveNets([net]):
+                ret += islands.get(code, [])
+            return ret
+        nets = self._nets
+        return dict((unquote(self.net_names.get(code, 'net?')), islands[code])
+                        for code in sorted(islands) if not nets or code in nets)
+
+    def _layerIndex(self):
+        # Only copper layers are indexed
+        if not self.layer or self.layer_type > 31:
+            return None
+        return self.boardIndex()
+
+    def _layerFootprints(self):
+        '''Iterate footprints that have something on the current layer
+
+        Yields (footprint index, footprint, pads), where pads is a list of
+        (pad index, pad) on the current layer.
+        '''
+        index = self._layerIndex()
+        if index:
+            footprints = index.layerFootprints(self.layer_type, self._nets)
+            for i in sorted(footprints):
+                yield i, self.pcb.module[i], footprints[i]
+            return
+        for i,m in enumerate(self.pcb.module):
+            yield i, m, [(j,p) for j,p in enumerate(m.pad) if not self.filterLayer(p)]
+
+    def _netFootprints(self):
+        '''Iterate (footprint index, footprint, [(pad index, pad)]) of all
+        layers, restricted to the filtered nets if any'''
+        if not self._nets:
+            for i,m in enumerate(self.pcb.module):
+                yield i, m, enumerate(m.pad)
+            return
+        footprints = defaultdict(list)
+        for i,j,p in self.boardIndex().netItems('pad', self._nets):
+            footprints[i].append((j,p))
+        for i in sorted(footprints):
+            yield i, self.pcb.module[i], sorted(footprints[i], key=lambda p : p[0])
+
+    def _netVias(self):
+        if not self._nets:
+            return self.pcb.via
+        return [v for _,v in self.boardIndex().netItems('via', self._nets)]
+
+    def _layerTracks(self):
+        index = self._layerIndex()
+        if index:
+            return index.layerTracks(self.layer_type, self._nets)
+        tracks = []
+        for tp,ss in (('segment',self.pcb.segment), ('arc',getattr(self.pcb, 'arc', []))):
+            for s in ss:
+                if unquote(s.layer) == self.layer:
+                    tracks.append((tp,s))
+        return tracks
+
+    def _layerFields(self,layer):
+        layer_type, layer_name = self.findLayer(layer)
+        name = unquote(layer_name)
+        if layer_type <= 31:
+            layer_match = '*.Cu'
         else:
-            self.layer_match = '*.{}'.format(self.layer.split('.')[-1])
+            layer_match = '*.{}'.format(name.split('.')[-1])
+        return dict(layer_type=layer_type, layer_name=layer_name,
+                    layer=name, layer_match=layer_match)
+
+    def setLayer(self,layer):
+        self._setContext(self.context()._replace(**self._layerFields(layer)))
 
     def _copperLayers(self):
         coppers = [ (int(t),unquote(self.pcb.layers[t][0])) \
@@ -837,47 +3241,76 @@ class KicadFcad:
         return offsets
 
     def setNetFilter(self,*nets):
-        self._nets.clear()
-        ndict = dict()
-        nset = set()
-        for n in self.pcb.net:
-            ndict[n[1]] = n[0]
-            nset.add(n[0])
+        '''Only make board items of the given nets
+
+        Nets can be given by name, code, glob pattern (e.g. '/PWR_*'), or
+        regular expression with a 're:' prefix. Call without argument to
+        clear the filter.
+        '''
+        self._nets = self._resolveNets(nets)
 
+    def _resolveNets(self,nets):
+        codes = set()
+        if self._net_codes is None:
+            self._net_codes = dict()
+            for code,name in self.net_names.items():
+                self._net_codes[name] = code
+                self._net_codes.setdefault(unquote(name), code)
+
+        patterns = []
         for n in nets:
+            name = str(n)
+            if name.startswith('re:'):
+                try:
+                    re.compile(name[3:])
+                except re.error as e:
+                    raise ValueError('invalid net pattern {!r}: {}'.format(name, e))
+                patterns.append(name[3:])
+                continue
             try:
-                self._nets.add(ndict[str(n)])
+                codes.add(self._net_codes[name])
                 continue
-            except Exception:
+            except KeyError:
                 pass
+            if any(c in name for c in '*?['):
+                patterns.append(fnmatch.translate(name))
+                continue
             try:
-                if int(n) in nset:
-                    self._nets.add(int(n))
+                if int(n) in self.net_names:
+                    codes.add(int(n))
                     continue
             except Exception:
                 pass
             logger.error('net {} not found'.format(n))
 
+        if patterns:
+            # resolve all patterns in one pass over the net names
+            match = re.compile('|'.join(['(?:{})'.format(p) for p in patterns])).match
+            count = len(codes)
+            for code,name in self.net_names.items():
+                if match(unquote(name)):
+                    codes.add(code)
+            if len(codes) == count:
+                logger.error('no net matches {}'.format(patterns))
+        return frozenset(codes)
+
     def getNet(self,p):
         n = p.net
         return n if not isinstance(n,list) else n[0]
 
     def filterNets(self,p):
+        items = self._items
+        if items is not None and id(p) not in items:
+            return True
+        if not self._nets:
+            return False
         try:
-            return self._nets and self.getNet(p) not in self._nets
+            return self.getNet(p) not in self._nets
         except Exception:
-            return bool(self._nets)
+            return True
 
     def filterLayer(self,p):
-        layers = []
-        l = getattr(p, 'layers', [])
-        if unquote(l) == 'F&B.Cu':
-            layers.append('F.Cu')
-            layers.append('B.Cu')
-        else:
-            layers = [unquote(s) for s in l]
-        if hasattr(p, 'layer'):
-            layers.append(unquote(p.layer))
+        layers = getLayers(p)
         if not layers:
             self._log('no layers specified', level='warning')
             return True
@@ -1087,6 +3520,33 @@ class KicadFcad:
             shape = Part.getShape(obj[0])
         workplane = self.getWorkPlane(shape)
 
+        if not self.add_feature and self.geometry_backend != 'occ':
+            ret = self._makeAreaBackend(obj, shape.BoundBox.ZMin, offset=offset,
+                                        op=op, fill=fill, outline=outline,
+                                        fit_arcs=fit_arcs)
+            if ret is not None:
+                return ret
+
+        if self.tile_size and not self.add_feature \
+                and op == 0 and not offset and not outline:
+            ret = self._makeAreaTiled(obj, shape.Vertex1.Point.z, fill=fill,
+                                      fit_arcs=fit_arcs, reorient=reorient)
+            if ret is not None:
+                return ret
+
+        if self.fuse_strategy == 'tree' and not self.add_feature \
+                and op == 0 and not offset and not outline \
+                and all([isinstance(o, Part.Shape) and _facesOnly(o) for o in obj]):
+            faces = []
+            for o in obj:
+                faces += o.Faces
+            if len(faces) > self.fuse_leaf_size:
+                self._log('making area of {} faces in tree', len(faces))
+                params = {'Fill':fill, 'FitArcs':fit_arcs, 'Coplanar':0,
+                          'Reorient':reorient, 'Accuracy':self.arc_fit_accuracy}
+                return treeFuse(faces, 'area', (params, shape.Vertex1.Point.z),
+                                leaf_size=self.fuse_leaf_size, pool=self._fusePool())
+
         if self.add_feature and name:
             if not force and obj[0].TypeId == 'Path::FeatureArea' and (
                 obj[0].Operation == op or len(obj[0].Sources)==1) and \
@@ -1126,6 +3586,170 @@ class KicadFcad:
             ret = ret.getShape()
         return ret
 
+    def _getPool(self, workers=None):
+        # The pool of the tile and tree fuse workers, which are spawned
+        # rather than forked in the GUI, as processPool() does. The check is
+        # made here too, so that a pool forked before the GUI is up is not
+        # reused after.
+        workers = workers or os.cpu_count()
+        spawn = bool(getattr(FreeCAD, 'GuiUp', False))
+        if self._pool is not None and self._pool_workers != (workers, spawn):
+            self._pool.shutdown()
+            self._pool = None
+        if self._pool is None:
+            self._pool = processPool(workers, spawn=spawn)
+            self._pool_workers = (workers, spawn)
+        return self._pool
+
+    def _fusePool(self):
+        if self.fuse_workers == 1:
+            return None
+        return self._getPool(self.fuse_workers)
+
+    def shutdownPool(self):
+        '''Shutdown the worker processes, if any'''
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def geometryBackend(self):
+        '''Return the 2D geometry backend instance'''
+        if self._backend is None or \
+                self._backend.accuracy != self.arc_fit_accuracy:
+            self._backend = getBackend(self.geometry_backend,
+                                       accuracy=self.arc_fit_accuracy)
+        return self._backend
+
+    def _makeAreaBackend(self, objs, z, offset, op, fill, outline, fit_arcs=False):
+        '''Path.Area equivalent using the 2D geometry backend
+
+        The inputs are discretized within arc_fit_accuracy. With fit_arcs, the
+        output rings are refitted with lines and arcs by fitPolyline(),
+        otherwise they are plain polygons. The output faces are always
+        oriented, so there is no need to reorient.
+
+        Returns None for operations not supported by the backend.
+        '''
+        if op not in (0, 1, 2):
+            return None
+        backend = self.geometryBackend()
+        regions = []
+        paths = []
+        for o in objs:
+            if not isinstance(o, Part.Shape):
+                o = Part.getShape(o)
+            region, p = backend.fromShape(o)
+            regions.append(region)
+            paths += p
+        if op == 0:
+            region = backend.union(regions)
+        elif op == 1:
+            region = backend.difference(regions[0], regions[1:])
+        else:
+            region = backend.intersection(regions[0], regions[1:])
+        if offset:
+            region = backend.offset(region, offset)
+            if paths and offset > 0:
+                region = backend.union([region] +
+                        [backend.stroke(p, offset*2) for p in paths])
+        if fit_arcs:
+            shape = self._fitRegion(region, z)
+        else:
+            shape = backend.toShape(region, z)
+        if outline:
+            shape = Part.makeCompound([Part.Face(f.OuterWire) for f in shape.Faces])
+        if not fill:
+            return Part.makeCompound(shape.Wires)
+        return shape
+
+    def _fitRegion(self, region, z):
+        '''Make faces of a backend region with its rings fitted into arcs'''
+        accuracy, max_error = self._polyFitArcs() or \
+                (self.arc_fit_accuracy, self.poly_arc_error)
+        faces = []
+        for outer,holes in region.outlines():
+            wires = []
+            for ring in [outer] + holes:
+                # fitPolyline() and makeFittedWire() work in kicad coordinates
+                pts = [(x,-y) for x,y in ring.tolist()]
+                wires.append(makeFittedWire(fitPolyline(pts, accuracy, max_error)))
+            faces.append(Part.makeFace(wires, 'Part::FaceMakerBullseye'))
+        if not faces:
+            return Part.Shape()
+        shape = Part.makeCompound(faces)
+        if z:
+            shape.translate(Vector(0,0,z))
+        return shape
+
+    def _makeAreaTiled(self, objs, z, fill, fit_arcs, reorient):
+        '''Union planar faces tile by tile
+
+        Each input face is assigned to the tiles its bound box overlaps. The
+        faces of each tile are unioned and clipped to the tile, in parallel,
+        and the tile results are finally unioned (i.e. stitched) together.
+
+        Returns None if the inputs are not all faces or fit in one tile.
+        '''
+        faces = []
+        for o in objs:
+            if not isinstance(o, Part.Shape) or not o.Faces:
+                return None
+            faces += o.Faces
+        bbox = Part.makeCompound(faces).BoundBox
+        size = float(self.tile_size)
+        nx = int(bbox.XLength // size) + 1
+        ny = int(bbox.YLength // size) + 1
+        if nx*ny <= 1:
+            return None
+
+        # slightly enlarge the tiles to avoid clipping exactly at the board
+        # boundary
+        x0 = bbox.XMin - 1e-3
+        y0 = bbox.YMin - 1e-3
+        tiles = defaultdict(list)
+        for f in faces:
+            b = f.BoundBox
+            for i in range(int((b.XMin-x0)//size), int((b.XMax-x0)//size)+1):
+                for j in range(int((b.YMin-y0)//size), int((b.YMax-y0)//size)+1):
+                    tiles[i,j].append(f)
+
+        params = {'Fill':fill, 'FitArcs':fit_arcs, 'Coplanar':0,
+                  'Reorient':reorient, 'Accuracy':self.arc_fit_accuracy}
+
+        self._pushLog('making area of {} faces in {} tiles...', len(faces), len(tiles))
+        t = time.time()
+        jobs = []
+        for (i,j),fs in sorted(tiles.items()):
+            tile = (x0+i*size, y0+j*size, x0+(i+1)*size, y0+(j+1)*size)
+            jobs.append(((i,j), len(fs),
+                (shapeToBrep(Part.makeCompound(fs)), tile, z, params)))
+
+        if self.tile_workers == 1:
+            results = [_areaTileWorker(*args) for _,_,args in jobs]
+        else:
+            pool = self._getPool(self.tile_workers)
+            results = [pool.submit(_areaTileWorker, *args) for _,_,args in jobs]
+            results = [r.result() for r in results]
+
+        shapes = []
+        for (tile,count,_),(brep,elapsed) in zip(jobs, results):
+            self._log('tile {}: {} faces, {:.3f}s', tile, count, elapsed)
+            if brep:
+                shapes.append(shapeFromBrep(brep))
+        self._log('tiles done in {:.3f}s', time.time()-t)
+
+        if not shapes:
+            self._popLog()
+            return Part.Shape()
+
+        # stitch the tiles
+        area = Path.Area(**params)
+        area.setPlane(self.getWorkPlane(shapes[0]))
+        area.add(Part.makeCompound(shapes), op=0)
+        ret = area.getShape()
+        self._popLog('stitched in {:.3f}s', time.time()-t)
+        return ret
+
     def getWorkPlane(self, shape):
         z = shape.Vertex1.Point.z
         workplane = self.workplane.get(z, None)
@@ -1201,7 +3825,11 @@ class KicadFcad:
 
         if solids:
             self._log('making fuse {}...',name)
-            obj = solids[0].multiFuse(solids[1:])
+            if self.fuse_strategy == 'tree' and len(solids) > self.fuse_leaf_size:
+                obj = treeFuse(solids, leaf_size=self.fuse_leaf_size,
+                               pool=self._fusePool())
+            else:
+                obj = solids[0].multiFuse(solids[1:])
             if self.refine:
                 obj = obj.removeSplitter()
             self._log('fuse done')
@@ -1267,6 +3895,8 @@ class KicadFcad:
             primitives = SexpList(primitives)
             self._log('making {} {}s',len(primitives), tp)
             make_shape = globals()['make_gr_{}'.format(tp)]
+            if tp == 'poly' and self.poly_fit_arcs:
+                make_shape = partial(make_gr_poly, fit_arcs=self._polyFitArcs())
             for l in primitives:
                 if not layer:
                     if self.filterNets(l) or self.filterLayer(l):
@@ -1282,58 +3912,21 @@ class KicadFcad:
                 edges += [[width, e] for e in shape.Edges]
 
         # The line width in edge cuts are important. When milling, the line
-        # width can represent the diameter of the drill bits to use. The user
-        # can use lines thick enough for hole cutting. In addition, the
-        # endpoints of thick lines do not have to coincide to complete a loop.
-        #
-        # Therefore, we shall use the line width as tolerance to detect closed
-        # wires. And for non-closed wires, if the shape_type is not wire, we
-        # shall thicken the wire using Path.Area for hole cutting.
-
-        for info in edges:
-            w,e = info
-            if w > 1e-7:
-                e.fixTolerance(w)
-            info += [e.firstVertex().Point,e.lastVertex().Point]
-
-        while edges:
-            w,e,pstart,pend = edges.pop(-1)
-            wstart = wend = w
-            elist = [(w,e)]
-            if pstart.distanceToPoint(pend) <= (wstart+w)/2:
-                closed = True
-            else:
-                closed = False
-            i = 0
-            while not closed and i < len(edges):
-                w,e,ps,pe = edges[i]
-                if pstart.distanceToPoint(ps) <= (wstart+w)/2:
-                    e.reverse()
-                    pstart = pe
-                    wstart = w
-                    elist.insert(0,(w,e))
-                elif pstart.distanceToPoint(pe) <= (wstart+w)/2:
-                    pstart = ps
-                    wstart = w
-                    elist.insert(0,(w,e))
-                elif pend.distanceToPoint(ps) <= (wend+w)/2:
-                    e.reverse()
-                    pend = pe
-                    wend = w
-                    elist.append((w,e))
-                elif pend.distanceToPoint(pe) <= (wend+w)/2:
-                    pend = ps
-                    wend = w
-                    elist.append((w,e))
-                else:
-                    i += 1
-                    continue
-                edges.pop(i)
-                i = 0
-                if pstart.distanceToPoint(pend) <= (wstart+wend)/2:
-                    closed = True
-                    break
+        # width can represent the diameter of the drill bits to use. The user
+        # can use lines thick enough for hole cutting. In addition, the
+        # endpoints of thick lines do not have to coincide to complete a loop.
+        #
+        # Therefore, we shall use the line width as tolerance to detect closed
+        # wires. And for non-closed wires, if the shape_type is not wire, we
+        # shall thicken the wire using Path.Area for hole cutting.
+
+        for info in edges:
+            w,e = info
+            if w > 1e-7:
+                e.fixTolerance(w)
+            info += [e.firstVertex().Point,e.lastVertex().Point]
 
+        for closed,elist in chainEdges(edges):
             wire = None
             try:
                 #  tol = max([o[0] for o in elist])
@@ -1363,18 +3956,20 @@ class KicadFcad:
     def intersectBoard(self, objs, name, fit_arcs=True):
         if not objs:
             return objs
-        if self.add_feature and self.board_uid != getActiveDoc().Uid:
-            self.board_face = None
-        if not self.board_face:
-            self.board_face = self.makeBoard(shape_type='face', holes=False, single_layer=True)
-            if self.add_feature:
-                self.board_face.Visibility = False
-                self.board_uid = self.board_face.Document.Uid
+        with self._lock:
+            if self.add_feature and self.board_uid != getActiveDoc().Uid:
+                self.board_face = None
+            if not self.board_face:
+                self.board_face = self.makeBoard(shape_type='face', holes=False, single_layer=True)
+                if self.add_feature:
+                    self.board_face.Visibility = False
+                    self.board_uid = self.board_face.Document.Uid
 
         objs = (self._makeCompound(objs,name,label='castellated'),self.board_face)
         # op=2 for intersection
         return self._makeArea(objs,name,op=2,label='castellated',fit_arcs=fit_arcs)
 
+    @contextual
     def makeBoard(self,shape_type='solid',thickness=None,fit_arcs=True,
             holes=True, minHoleSize=0, ovalHole=True, prefix='', single_layer=False):
 
@@ -1423,6 +4018,10 @@ class KicadFcad:
             return self._makeCompound(_addHoles(objs),'board')
 
         def _face():
+            return self._buildNode(('board_face', None, fit_arcs,
+                    self._holesKey(holes), minHoleSize, ovalHole), _makeFace)
+
+        def _makeFace():
             if not wires:
                 raise RuntimeError('no closed wire')
 
@@ -1456,9 +4055,7 @@ class KicadFcad:
                 thickness = self.board_thickness
             layers = [(self.copper_thickness, thickness)]
 
-        try:
-            layer_save = self.layer
-            self.layer = None
+        with self.useContext(self.context()._replace(layer=None)):
             try:
                 func = locals()['_{}'.format(shape_type)]
             except KeyError:
@@ -1484,14 +4081,12 @@ class KicadFcad:
                     objs.append(obj)
                 obj = self._makeCompound(objs, 'board')
                 self.setColor(obj, 'board')
-        finally:
-            if layer_save:
-                self.setLayer(layer_save)
 
         self._popLog('board done')
         fitView();
         return obj
 
+    @contextual
     def makeHoles(self,shape_type='wire',minSize=0,maxSize=0,
             oval=False,prefix='',offset=0.0,npth=0,skip_via=False,
             board_thickness=None,extra_thickness=0.0,castellated=False):
@@ -1528,9 +4123,14 @@ class KicadFcad:
         layer_offsets = self.layerOffsets(thickness)
         z_offset = min(layer_offsets.values())
 
-        for m in self.pcb.module:
+        # Holes are collected as placements of template wires, keyed by (group
+        # name, group key, template function, template size), and placed in
+        # bulk afterwards.
+        placements = defaultdict(list)
+
+        for _,m,pads in self._netFootprints():
             m_at,m_angle = getAt(m)
-            for p in m.pad:
+            for _,p in pads:
                 if 'drill' not in p:
                     continue
                 if self.filterNets(p):
@@ -1549,28 +4149,20 @@ class KicadFcad:
                 if p.drill.oval:
                     if not oval:
                         continue
-                    size = Vector(p.drill[0],p.drill[1])
-                    w = make_oval(size+Vector(ofs,ofs))
-                    ovals[min(size.x,size.y)].append(w)
+                    size = (p.drill[0],p.drill[1])
+                    key = ('ovals', min(size), make_oval, (size[0]+ofs, size[1]+ofs))
                     oval_count += 1
                 elif 0 in p.drill and \
                         p.drill[0]>=minSize and \
                         (not maxSize or p.drill[0]<=maxSize):
-                    w = make_circle(Vector(p.drill[0]+ofs))
-                    holes[p.drill[0]].append(w)
+                    key = ('holes', p.drill[0], make_circle, (p.drill[0]+ofs,)*2)
                     count += 1
                 else:
                     skip_count += 1
                     continue
                 at,angle = getAt(p)
-                angle -= m_angle;
-                if not isZero(angle):
-                    w.rotate(Vector(),Vector(0,0,1),angle)
-                w.translate(at)
-                if m_angle:
-                    w.rotate(Vector(),Vector(0,0,1),m_angle)
-                m_at.z = z_offset
-                w.translate(m_at)
+                placements[key].append(
+                        (at.x, at.y, angle, m_at.x, m_at.y, m_angle, z_offset))
         self._log('pad holes: {}, skipped: {}',count+skip_count,skip_count)
         if oval:
             self._log('oval holes: {}',oval_count)
@@ -1582,7 +4174,9 @@ class KicadFcad:
                 via_skip = len(self.pcb.via)
             else:
                 ofs = -abs(offset)
-                for v in self.pcb.via:
+                vias = self._netVias()
+                via_skip = len(self.pcb.via) - len(vias)
+                for v in vias:
                     if self.filterNets(v):
                         via_skip += 1
                         continue
@@ -1597,19 +4191,31 @@ class KicadFcad:
                         s = v.drill+ofs
                         if self.via_bound:
                             s *= self.via_bound
-                            w = make_rect(Vector(s,s))
+                            make = make_rect
                         else:
-                            w = make_circle(Vector(s))
-                        w.translate(pos)
+                            make = make_circle
                         if dist < thickness-0.001:
-                            blind_holes[(pos.z,dist)].append(w)
+                            key = ('blind_holes', (pos.z,dist), make, (s,s))
                         else:
-                            holes[v.drill].append(w)
+                            key = ('holes', v.drill, make, (s,s))
+                        placements[key].append((0, 0, 0, pos.x, pos.y, 0, pos.z))
                     else:
                         via_skip += 1
             skip_count += via_skip
             self._log('via holes: {}, skipped: {}',len(self.pcb.via),via_skip)
 
+        groups = {'holes':holes, 'ovals':ovals, 'blind_holes':blind_holes}
+        templates = {}
+        for (group,key,make,size),placement in placements.items():
+            try:
+                template = templates[make,size]
+            except KeyError:
+                template = make(Vector(*size))
+                templates[make,size] = template
+            groups[group][key] += placeShapes(template, placement)
+        self._log('hole templates: {}', len(templates))
+
+        if npth<=0:
             if blind_holes and shape_type != 'solid':
                 self._log('skip blind via holes: {}',len(blind_holes))
                 blind_holes = None
@@ -1676,42 +4282,111 @@ class KicadFcad:
         return objs
 
 
+    def _optionKey(self):
+        # Snapshot of all simple valued options, so that changing any of them
+        # misses the build graph
+        return tuple([(k,v) for k,v in sorted(vars(self).items())
+                        if not k.startswith('_') and k not in _optionKeyExcludes
+                            and isinstance(v,
+                            string_types + (int, float, type(None)))])
+
+    def _holesKey(self, holes, bound=None):
+        '''Return a key of the hole geometry, optionally of only the holes
+        intersecting a bound box (x0, y0, x1, y1)
+
+        Holes are compared by geometry rather than by shape identity, so that
+        re-made holes of an unchanged board give the same key.
+        '''
+        if not isinstance(holes, Part.Shape):
+            return bool(holes)
+        code = holes.hashCode()
+        boxes = self._hole_boxes.get(code, None)
+        if boxes is None:
+            boxes = []
+            for w in holes.Wires or [holes]:
+                b = w.BoundBox
+                boxes.append((round(b.XMin,6), round(b.YMin,6),
+                              round(b.XMax,6), round(b.YMax,6), len(w.Edges)))
+            boxes.sort()
+            # only remember the holes in use
+            self._hole_boxes = {code: boxes}
+        if bound is not None:
+            x0,y0,x1,y1 = bound
+            boxes = [b for b in boxes
+                        if b[2] >= x0 and b[0] <= x1 and b[3] >= y0 and b[1] <= y1]
+        return 'holes', len(boxes), hash(tuple(boxes))
+
+    def _holesStamp(self, holes, value):
+        # key of the holes within the bound box of a built node
+        if not isinstance(holes, Part.Shape):
+            return None
+        if not isinstance(value, Part.Shape) or value.isNull():
+            return self._holesKey(holes)
+        b = value.BoundBox
+        tol = 1e-6
+        return self._holesKey(holes,
+                (b.XMin-tol, b.YMin-tol, b.XMax+tol, b.YMax+tol))
+
+    def _buildNode(self, key, make, stamp=None):
+        '''Return the memoised result of make() keyed by (kind, layer, ...)'''
+        if self.add_feature or not self.build_graph:
+            return make()
+        return self.graph.get(key + (self._items, self._optionKey()), make, stamp)
+
+    def buildReport(self):
+        '''Log and return the reuse statistics of the build graph'''
+        report = self.graph.report()
+        for line in report.split('\n'):
+            self._log('{}', line)
+        return report
+
+    def _cachedHoles(self,minSize,maxSize,oval,npth,offset):
+        stat = self.graph.stats['holes']
+        hit = False
+        if self.holes_cache is not None:
+            key = '{}.{}.{}.{}.{}.{}.{}.{}.{}'.format(self.add_feature,minSize,
+                    maxSize,oval,npth,offset,self.via_bound,sorted(self._nets),
+                    hash(self._items))
+            doc = getActiveDoc();
+            if self.add_feature and self.active_doc_uuid!=doc.Uid:
+                self.holes_cache.clear()
+                self.active_doc_uuid = doc.Uid
+
+            try:
+                holes = self.holes_cache[key]
+                if self.add_feature:
+                    # access the object's Name to make sure it is not
+                    # deleted
+                    self._log("fetch holes '{}' "
+                        "from cache".format(holes.Name))
+                else:
+                    self._log("fetch holes from cache")
+                hit = True
+                stat[0] += 1
+            except Exception:
+                pass
+
+        if not hit:
+            t = time.time()
+            self._pushLog()
+            holes = self.makeHoles(shape_type='wire',prefix=None,npth=npth,
+                minSize=minSize,maxSize=maxSize,oval=oval,offset=offset)
+            self._popLog()
+            stat[1] += 1
+            stat[2] += time.time() - t
+
+            if isinstance(self.holes_cache,dict):
+                self.holes_cache[key] = holes
+        return holes
+
     def _cutHoles(self,objs,holes,name,label=None,fit_arcs=False,
                     minSize=0,maxSize=0,oval=True,npth=0,offset=0.0):
         if not holes:
             return objs
 
         if not isinstance(holes,(Part.Feature,Part.Shape)):
-            hit = False
-            if self.holes_cache is not None:
-                key = '{}.{}.{}.{}.{}.{}.{}'.format(
-                        self.add_feature,minSize,maxSize,oval,npth,offset,self.via_bound)
-                doc = getActiveDoc();
-                if self.add_feature and self.active_doc_uuid!=doc.Uid:
-                    self.holes_cache.clear()
-                    self.active_doc_uuid = doc.Uid
-
-                try:
-                    holes = self.holes_cache[key]
-                    if self.add_feature:
-                        # access the object's Name to make sure it is not
-                        # deleted
-                        self._log("fetch holes '{}' "
-                            "from cache".format(holes.Name))
-                    else:
-                        self._log("fetch holes from cache")
-                    hit = True
-                except Exception:
-                    pass
-
-            if not hit:
-                self._pushLog()
-                holes = self.makeHoles(shape_type='wire',prefix=None,npth=npth,
-                    minSize=minSize,maxSize=maxSize,oval=oval,offset=offset)
-                self._popLog()
-
-                if isinstance(self.holes_cache,dict):
-                    self.holes_cache[key] = holes
+            with self._lock:
+                holes = self._cachedHoles(minSize,maxSize,oval,npth,offset)
 
         if not holes:
             return objs
@@ -1733,7 +4408,7 @@ class KicadFcad:
             primitives = SexpList(getattr(params.primitives, key))
             self._log(f'making {len(primitives)} {key}s')
             for param in primitives:
-                wire,width = makePrimitve(key, param)
+                wire,width = makePrimitve(key, param, self._polyFitArcs())
                 if not width:
                     if isinstance(wire, Part.Edge):
                         wire = Part.Wire(wire)
@@ -1747,17 +4422,94 @@ class KicadFcad:
             return wires[0]
         return Part.makeCompound(wires)
 
+    def _hasShape(self, sexp, ctx, layer=None):
+        '''Check if _makeShape() would make anything with the same arguments'''
+        for tp in 'line','arc','circle','curve','poly','rect':
+            primitives = getattr(sexp, ctx + '_' + tp, None)
+            if not primitives:
+                continue
+            for l in SexpList(primitives):
+                if not layer:
+                    if not self.filterNets(l) and not self.filterLayer(l):
+                        return True
+                elif l.layer == layer:
+                    return True
+        return False
+
+    def _footprintKey(self, m, pads, m_angle):
+        '''Return a key of the footprint geometry on the current layer
+
+        Footprints with the same key produce the same shape before placement.
+        Returns None if the footprint is not suitable for instancing, i.e.
+        it has custom pads, copper graphics or edge cuts.
+        '''
+        key = []
+        for _,p in pads:
+            shape = p[2]
+            if shape == 'custom':
+                return None
+            at,angle = getAt(p)
+            if 'drill' in p and 'offset' in p.drill:
+                offset = _keyValue(p.drill.offset)
+            else:
+                offset = None
+            key.append((padTemplateKey(shape, p), round(at.x, 6), round(at.y, 6),
+                        round(angle-m_angle, 6), offset))
+        if self._hasShape(m, 'fp'):
+            return None
+        try:
+            _,layer = self.findLayer(44)
+            if self._hasShape(m, 'fp', layer):
+                return None
+        except Exception:
+            pass
+        return tuple(key)
+
+    def _makeInstance(self, obj, name, label=None):
+        '''Make a separately placeable object sharing the geometry of obj'''
+        if not self.add_feature:
+            return shapeInstance(obj)
+        try:
+            link = self._makeObject('App::Link', '{}_link'.format(name), label)
+            link.LinkedObject = obj
+            return link
+        except Exception:
+            # older FreeCAD without App::Link
+            nobj = self._makeObject('Part::Feature', '{}_copy'.format(name), label)
+            nobj.Shape = obj.Shape
+            try:
+                nobj.ViewObject.DiffuseColor = obj.ViewObject.DiffuseColor
+            except Exception:
+                # no view object without GUI
+                pass
+            return nobj
+
+    def _makePadShape(self, shape, params):
+        try:
+            make_shape = globals()['make_{}'.format(shape)]
+        except KeyError:
+            raise NotImplementedError(
+                    'pad shape {} not implemented\n'.format(shape))
+        if self.pad_cache is None:
+            return make_shape(Vector(*params.size),params)
+
+        key = padTemplateKey(shape, params)
+        w = self.pad_cache.get(key)
+        if w is None:
+            w = make_shape(Vector(*params.size),params)
+            self.pad_cache.put(key, w)
+        return shapeInstance(w)
+
     def getTrackPoints(self):
         points = set()
-        for tp,ss in (('segment',self.pcb.segment), ('arc',getattr(self.pcb, 'arc', []))):
-            for s in ss:
-                if self.filterNets(s):
-                    continue
-                if unquote(s.layer) == self.layer:
-                    points.add((s.start[0], s.start[1]))
-                    points.add((s.end[0], s.end[1]))
+        for _,s in self._layerTracks():
+            if self.filterNets(s):
+                continue
+            points.add((s.start[0], s.start[1]))
+            points.add((s.end[0], s.end[1]))
         return points
 
+    @contextual
     def makePads(self,shape_type='face',thickness=0.05,holes=False,
             fit_arcs=True,prefix=''):
 
@@ -1811,9 +4563,19 @@ class KicadFcad:
                 if not at in track_points:
                     return True
 
-        count = 0
-        skip_count = 0
-        for i,m in enumerate(self.pcb.module):
+        index = self._layerIndex()
+        if index:
+            count = index.pad_count
+        else:
+            count = sum([len(m.pad) for m in self.pcb.module])
+        pad_count = 0
+
+        # Geometrically identical footprints are built once and instanced,
+        # keyed by _footprintKey()
+        instances = {}
+        instance_count = 0
+
+        for i,m,layer_pads in self._layerFootprints():
             ref = ''
             for t in m.fp_text:
                 if t[0] == 'reference':
@@ -1821,31 +4583,39 @@ class KicadFcad:
                     break;
             m_at,m_angle = getAt(m)
             pads = []
-            count += len(m.pad)
+
+            layer_pads = [(j,p) for j,p in layer_pads if not self.filterNets(p)]
+            pad_count += len(layer_pads)
+
+            key = None
+            if self.merge_pads:
+                key = self._footprintKey(m, layer_pads, m_angle)
+                if key is not None:
+                    if not layer_pads:
+                        continue
+                    base = instances.get(key)
+                    if base is not None:
+                        obj = self._makeInstance(base,'pads','{}#{}'.format(i,ref))
+                        self._place(obj,m_at,m_angle)
+                        objs.append(obj)
+                        instance_count += 1
+                        continue
 
             cut_wires = []
             cut_non_closed = defaultdict(list)
 
-            self._pushLog('checking edge cuts')
-            self._makeEdgeCuts(m, 'fp', cut_wires, cut_non_closed)
-            self._popLog()
-
-            for j,p in enumerate(m.pad):
-                if self.filterNets(p) or self.filterLayer(p):
-                    skip_count+=1
-                    continue
+            if key is None:
+                self._pushLog('checking edge cuts')
+                self._makeEdgeCuts(m, 'fp', cut_wires, cut_non_closed)
+                self._popLog()
 
+            for j,p in layer_pads:
                 shape = p[2]
 
                 if shape == 'custom':
                     w = self._makeCustomPad(p)
                 else:
-                    try:
-                        make_shape = globals()['make_{}'.format(shape)]
-                    except KeyError:
-                        raise NotImplementedError(
-                                'pad shape {} not implemented\n'.format(shape))
-                    w = make_shape(Vector(*p.size),p)
+                    w = self._makePadShape(shape, p)
 
                 if not w:
                     continue
@@ -1866,7 +4636,8 @@ class KicadFcad:
                 else:
                     pads.append(w)
 
-            self._makeShape(m, 'fp', pads)
+            if key is None:
+                self._makeShape(m, 'fp', pads)
 
             if not pads:
                 continue
@@ -1875,6 +4646,11 @@ class KicadFcad:
                 obj = self._makeCompound(pads,'pads','{}#{}'.format(i,ref))
             else:
                 obj = func(pads,'pads','{}#{}'.format(i,ref))
+            if key is not None:
+                instances[key] = obj
+                if not self.add_feature:
+                    # keep the template unplaced
+                    obj = shapeInstance(obj)
             self._place(obj,m_at,m_angle)
             objs.append(obj)
 
@@ -1887,11 +4663,17 @@ class KicadFcad:
         if self.via_bound < 0:
             via_skip = len(self.pcb.via)
         else:
-            for i,v in enumerate(self.pcb.via):
-                layers = [self.findLayer(s)[0] for s in v.layers]
-                if self.layer_type < min(layers)\
-                        or self.layer_type > max(layers)\
-                        or self.filterNets(v):
+            if index:
+                layer_vias = index.layerVias(self.layer_type, self._nets)
+            else:
+                layer_vias = []
+                for i,v in enumerate(self.pcb.via):
+                    layers = [self.findLayer(s)[0] for s in v.layers]
+                    if min(layers) <= self.layer_type <= max(layers):
+                        layer_vias.append((i,v))
+            via_skip = len(self.pcb.via) - len(layer_vias)
+            for i,v in layer_vias:
+                if self.filterNets(v):
                     via_skip += 1
                     continue
 
@@ -1915,11 +4697,13 @@ class KicadFcad:
             else:
                 objs.append(self._makeCompound(vias,'vias'))
 
-        self._log('footprints: {}',len(self.pcb.module))
-        self._log('pads: {}, skipped: {}',count,skip_count)
+        self._log('footprints: {}, instanced: {}',len(self.pcb.module),instance_count)
+        self._log('pads: {}, skipped: {}',count,count-pad_count)
         self._log('vias: {}, skipped: {}, unconnected: {}',len(self.pcb.via),via_skip,via_unconnected)
         self._log('total pads added: {}',
-                count-skip_count+len(self.pcb.via)-via_skip-via_unconnected)
+                pad_count+len(self.pcb.via)-via_skip-via_unconnected)
+        if self.pad_cache is not None:
+            self._log('pad template cache: {}', self.pad_cache.stats(), level='log')
 
         if objs:
             if self.castellated:
@@ -1950,6 +4734,7 @@ class KicadFcad:
         obj.ViewObject.ShapeColor = color
 
 
+    @contextual
     def makeTracks(self,shape_type='face',fit_arcs=True,
                     thickness=0.05,holes=False,prefix=''):
 
@@ -1976,16 +4761,14 @@ class KicadFcad:
 
         tracks = defaultdict(lambda: defaultdict(list))
         count = 0
-        for tp,ss in (('segment',self.pcb.segment), ('arc',getattr(self.pcb, 'arc', []))):
-            for s in ss:
-                if self.filterNets(s):
-                    continue
-                if unquote(s.layer) == self.layer:
-                    if self.merge_tracks:
-                        tracks[''][s.width].append((tp,s))
-                    else:
-                        tracks[self.netName(s)][s.width].append((tp,s))
-                    count += 1
+        for tp,s in self._layerTracks():
+            if self.filterNets(s):
+                continue
+            if self.merge_tracks:
+                tracks[''][s.width].append((tp,s))
+            else:
+                tracks[self.netName(s)][s.width].append((tp,s))
+            count += 1
 
         objs = []
         i = 0
@@ -2040,6 +4823,10 @@ class KicadFcad:
         fitView();
         return objs
 
+    def _polyFitArcs(self):
+        if self.poly_fit_arcs:
+            return self.arc_fit_accuracy, self.poly_arc_error
+
     def _makePolygons(self, fields, name, poly_holes,
             shape_type='face', thickness=0.05, prefix=''):
 
@@ -2059,9 +4846,11 @@ class KicadFcad:
             elif poly_holes:
                 obj = (self._makeWires(obj,f'{name}_outline'),
                        self._makeWires(poly_holes,f'{name}_hole'))
-                return self._makeArea(obj,name,offset=offset, op=1, fill=fill)
+                return self._makeArea(obj,name,offset=offset, op=1, fill=fill,
+                                      fit_arcs=bool(fit_arcs))
 
-            return self._makeWires(obj,name,fill=fill, offset=offset)
+            return self._makeWires(obj,name,fill=fill, offset=offset,
+                                   fit_arcs=bool(fit_arcs))
 
 
         def _face(obj):
@@ -2075,80 +4864,47 @@ class KicadFcad:
             raise ValueError('invalid shape type: {}'.format(shape_type))
 
         objs = []
+        fit_arcs = self._polyFitArcs()
+        edge_count = 0
+        fitted_count = 0
         for idx,p in enumerate(fields):
             if (hasattr(p, 'layer') or hasattr(p, 'layers')) and self.filterLayer(p):
                 continue
-            poly_holes = []
-            table = {}
-            pts = SexpList(p.pts.xy)
-
-            # close the polygon
-            pts._append(p.pts.xy._get(0))
-
-            # `table` uses a pair of vertex as the key to store the index of
-            # an edge.
-            for i in range(len(pts)-1):
-                table[str((pts[i],pts[i+1]))] = i
-
-            # This is how kicad represents holes in zone polygon
-            #  ---------------------------
-            #  |    -----      ----      |
-            #  |    |   |======|  |      |
-            #  |====|   |      |  |      |
-            #  |    -----      ----      |
-            #  |                         |
-            #  ---------------------------
-            # It uses a single polygon with coincide edges of oppsite
-            # direction (shown with '=' above) to dig a hole. And one hole
-            # can lead to another, and so forth. The following `build()`
-            # function is used to recursively discover those holes, and
-            # cancel out those '=' double edges, which will surely cause
-            # problem if left alone. The algorithm assumes we start with a
-            # point of the outer polygon.
-            def build(start,end):
-                results = []
-                while start<end:
-                    # We used the reverse edge as key to search for an
-                    # identical edge of oppsite direction. NOTE: the
-                    # algorithm only works if the following assumption is
-                    # true, that those hole digging double edges are of
-                    # equal length without any branch in the middle
-                    key = str((pts[start+1],pts[start]))
-                    try:
-                        i = table[key]
-                        del table[key]
-                    except KeyError:
-                        # `KeyError` means its a normal edge, add the line.
-                        results.append(Part.makeLine(
-                            makeVect(pts[start]),makeVect(pts[start+1])))
-                        start += 1
-                        continue
-
-                    # We found the start of a double edge, treat all edges
-                    # in between as holes and recurse. Both of the double
-                    # edges are skipped.
-                    h = build(start+1,i)
-                    if h:
-                        poly_holes.append(Part.Wire(h))
-                    start = i+1
-                return results
-
-            edges = build(0,len(pts)-1)
+            pts = [(xy[0], xy[1]) for xy in SexpList(p.pts.xy)]
+            outline, holes = extractPolygonHoles(pts)
+            if fit_arcs:
+                segments = [fitPolyline(outline, *fit_arcs)]
+                segments += [fitPolyline(h, *fit_arcs) for h in holes]
+                edge_count += len(outline) + sum([len(h) for h in holes])
+                fitted_count += sum([len(seg) for seg in segments])
+                wire = makeFittedWire(segments[0])
+                poly_holes = [makeFittedWire(seg) for seg in segments[1:]]
+            else:
+                wire = makePolygon(outline)
+                poly_holes = [makePolygon(h) for h in holes]
 
             self._log('region {}/{}, holes: {}',idx+1,count,len(poly_holes))
 
-            objs.append(func(Part.Wire(edges)))
+            objs.append(func(wire))
 
             self._popLog()
 
+        if fit_arcs:
+            self._log('arc fitting: {} edges -> {}', edge_count, fitted_count)
         self._popLog(f'polygons done')
         return objs
 
+    @contextual
     def makePolys(self,shape_type='face',thickness=0.05, fit_arcs=True, holes=False, prefix=''):
         '''For making outlier gr_poly as if it was zone, e.g. export from Gerber viewer
         '''
         poly_holes = []
-        objs = self._makePolygons(getattr(self.pcb, 'gr_poly', None), 'poly',
+        index = self._layerIndex()
+        if index:
+            polys = index.polys[self.layer_type]
+        else:
+            polys = getattr(self.pcb, 'gr_poly', None)
+        objs = self._makePolygons(polys, 'poly',
                                     poly_holes, shape_type, thickness, prefix)
         if not objs:
             return
@@ -2163,6 +4919,7 @@ class KicadFcad:
         fitView();
         return objs
 
+    @contextual
     def makeZones(self,shape_type='face',thickness=0.05, fit_arcs=True,
                     holes=False, prefix=''):
 
@@ -2171,10 +4928,18 @@ class KicadFcad:
         z = None
         zone_holes = []
         objs = []
-        for z in self.pcb.zone:
-            if self.filterNets(z) or self.filterLayer(z):
+        index = self._layerIndex()
+        if index:
+            zones = index.layerZones(self.layer_type, self._nets)
+        else:
+            zones = [z for z in self.pcb.zone if not self.filterLayer(z)]
+        for z in zones:
+            if self.filterNets(z):
                 continue
-            objs += self._makePolygons(z.filled_polygon, 'zone', zone_holes,
+            polygons = z.filled_polygon
+            if self._items is not None:
+                polygons = [p for p in SexpList(polygons) if id(p) in self._items]
+            objs += self._makePolygons(polygons, 'zone', zone_holes,
                                        shape_type, thickness, prefix)
 
         if objs:
@@ -2197,12 +4962,17 @@ class KicadFcad:
         return self.layer_type == 31
 
 
+    @contextual
     def makeCopper(self,shape_type='face',thickness=0.05,fit_arcs=True,
                     holes=False, z=0, prefix='',fuse=False):
 
         self._pushLog('making copper layer {}...',self.layer,prefix=prefix)
 
         holes = self._cutHoles(None,holes,None)
+        # Nodes are stamped with the holes within their bound box, so that a
+        # changed drill only rebuilds the nodes it touches
+        holes_key = bool(holes)
+        stamp = partial(self._holesStamp, holes)
 
         objs = []
 
@@ -2215,17 +4985,28 @@ class KicadFcad:
             solid = False
             sub_fit_arcs = False
 
-        for (name,offset) in (('Pads',thickness),
-                              ('Tracks',0.5*thickness),
-                              ('Zones',0),
-                              ('Polys',thickness)):
-
-            obj = getattr(self,'make{}'.format(name))(fit_arcs=sub_fit_arcs,
-                        holes=holes,shape_type=shape_type,prefix=None,
-                        thickness=thickness)
+        # Layer items are always made (and memoised) as faces, and extruded
+        # afterwards, so that changing the thickness only redoes the 3D work.
+        # Zones and polys are inflated by half of the thickness, so their key
+        # includes it.
+        face_type = 'face' if shape_type == 'solid' else shape_type
+        for (name,offset,color,inflated) in (('Pads',thickness,'pad',False),
+                                             ('Tracks',0.5*thickness,'track',False),
+                                             ('Zones',0,'zone',True),
+                                             ('Polys',thickness,'zone',True)):
+
+            make = partial(getattr(self,'make{}'.format(name)),
+                        fit_arcs=sub_fit_arcs,holes=holes,shape_type=face_type,
+                        prefix=None,thickness=thickness)
+            obj = self._buildNode((name.lower(), self.layer_type, self._nets,
+                        face_type, sub_fit_arcs, holes_key,
+                        thickness if inflated else None), make, stamp)
             if not obj:
                 continue
             if shape_type=='solid':
+                obj = self._makeSolid(obj,name.lower(),thickness,
+                                      fit_arcs=sub_fit_arcs)
+                self.setColor(obj,color)
                 ofs = offset if self.layer_type < 16 else -offset
                 self._place(obj,Vector(0,0,ofs))
             objs.append(obj)
@@ -2238,7 +5019,10 @@ class KicadFcad:
             obj = self._makeCompound(objs,'copper')
             self._log("done solid")
         else:
-            obj = self._makeArea(objs,'copper',fit_arcs=fit_arcs)
+            obj = self._buildNode(('copper', self.layer_type, self._nets,
+                        shape_type, fit_arcs, sub_fit_arcs, holes_key, thickness),
+                        partial(self._makeArea,objs,'copper',fit_arcs=fit_arcs),
+                        stamp)
             self.setColor(obj,'copper')
             if solid:
                 self._log("making solid")
@@ -2254,11 +5038,109 @@ class KicadFcad:
 
 
     def makeCoppers(self,shape_type='face',fit_arcs=True,prefix='',
-            holes=False,board_thickness=None,thickness=None,fuse=False):
+            holes=False,board_thickness=None,thickness=None,fuse=False,
+            workers=None,split=None):
+        '''Make all copper layers
+
+        Args:
+            workers: if greater than 1 and add_feature is False, make each
+            layer in one of this number of worker processes.
+
+            split: 'net' to split the copper by (filtered) net, or 'island' to
+            split it by connected island of each net, see netIslands(). The
+            layers are made once, and each resulting piece is assigned to
+            the island with most of its anchor points inside. Returns a dict
+            keyed by net name, or by (net name, island index), with pieces
+            not assigned to any island keyed by None.
+        '''
+        if split:
+            return self._makeCoppersSplit(split, shape_type, fit_arcs, prefix,
+                    holes, board_thickness, thickness, fuse)
+        if hasattr(thickness, 'items'):
+            thickness_key = _keyValue(sorted(thickness.items(), key=str))
+        else:
+            thickness_key = thickness
+        return self._buildNode(('coppers', None, shape_type, fit_arcs,
+                    self._holesKey(holes), board_thickness, thickness_key,
+                    fuse, self._nets, self.board_thickness, self.copper_thickness,
+                    self.layer_thickness),
+                partial(self._makeCoppers, shape_type, fit_arcs, prefix, holes,
+                        board_thickness, thickness, fuse, workers))
+
+    def _makeCoppersSplit(self,split,shape_type,fit_arcs,prefix,holes,
+                          board_thickness,thickness,fuse):
+        # All layers are made (and holes cut) once. The resulting pieces, i.e.
+        # solids, faces or wires, are then assigned to the island (or net)
+        # with the most item anchor points inside.
+        if split not in ('net', 'island'):
+            raise ValueError('invalid split: {}'.format(split))
+        connectivity = self.connectivity()
+        nets = self._nets
+        cell = 2.0
+        keys = []
+        points = defaultdict(list)
+        for code in sorted(connectivity.islands):
+            if nets and code not in nets:
+                continue
+            name = unquote(self.net_names.get(code, 'net?'))
+            for i,island in enumerate(connectivity.islands[code]):
+                if split == 'net':
+                    if i == 0:
+                        keys.append(name)
+                else:
+                    keys.append((name, i))
+                group = len(keys)-1
+                for _,item in island:
+                    for x,y in connectivity.anchors.get(id(item), []):
+                        points[int(x//cell), int(y//cell)].append((x, y, group))
+
+        coppers = self.makeCoppers(shape_type, fit_arcs, prefix, holes,
+                                   board_thickness, thickness, fuse)
+        ret = OrderedDict()
+        if not coppers:
+            return ret
+        if not isinstance(coppers, (list, tuple)):
+            coppers = [coppers]
+
+        self._pushLog('splitting coppers by {}...', split)
+        pieces = defaultdict(list)
+        for obj in coppers:
+            if self.add_feature:
+                shape = obj.Shape
+                obj.ViewObject.Visibility = False
+            else:
+                shape = obj
+            if shape_type == 'solid':
+                subs = shape.Solids
+            elif shape_type == 'face':
+                subs = shape.Faces
+            else:
+                subs = shape.Wires
+            for sub in subs:
+                pieces[_pieceGroup(sub, points, cell)].append(sub)
+
+        for group,key in list(enumerate(keys)) + [(None, None)]:
+            subs = pieces.get(group, None)
+            if not subs:
+                continue
+            shape = Part.makeCompound(subs)
+            if self.add_feature:
+                obj = self._makeObject('Part::Feature', 'copper',
+                                       label=str(key) if key else 'unassigned')
+                obj.Shape = shape
+                self.setColor(obj, 'copper')
+                ret[key] = obj
+            else:
+                ret[key] = shape
+        self._popLog('split into {} groups, {} unassigned pieces', len(ret),
+                     len(pieces.get(None, [])))
+        return ret
+
+    def _makeCoppers(self,shape_type,fit_arcs,prefix,holes,board_thickness,
+                     thickness,fuse,workers):
 
         self._pushLog('making all copper layers...',prefix=prefix)
 
-        layer_save = self.layer
         objs = []
         layers = []
         thicknesses = []
@@ -2304,22 +5186,24 @@ class KicadFcad:
         else:
             hole_shapes = self._cutHoles(None,holes,None)
 
-        try:
+        if workers and workers > 1 and len(layers) > 1 and not self.add_feature:
+            objs = self._makeCoppersParallel(workers, layers, thicknesses,
+                    offsets, hole_shapes, shape_type=shape_type,
+                    fit_arcs=fit_arcs, fuse=fuse)
+        else:
             for layer,t,z in zip(layers, thicknesses, offsets):
-                self.setLayer(layer)
                 copper = self.makeCopper(shape_type,t,fit_arcs=fit_arcs,
-                                    holes=hole_shapes,z=z,prefix=None,fuse=fuse)
+                                    holes=hole_shapes,z=z,prefix=None,fuse=fuse,
+                                    context=self.layerContext(layer))
                 if copper:
                     objs.append(copper)
-        finally:
-            if layer_save:
-                self.setLayer(layer_save)
 
         if not objs:
             self._popLog('no copper found')
             return
 
         if shape_type=='solid' and fuse:
+            t = time.time()
             # make copper for plated through holes
             hole_coppers = self.makeHoles(shape_type='solid',prefix=None,
                 oval=True,npth=-2,board_thickness=board_thickness,
@@ -2343,12 +5227,45 @@ class KicadFcad:
                     self._place(drills,FreeCAD.Vector(0,0,-0.05*thickness))
                     objs = self._makeCut(objs,drills,'coppers')
                     self.setColor(objs,'copper')
+            self._fuse_time = time.time() - t
 
         self._popLog('done making all copper layers')
         fitView();
         return objs
 
 
+    def _makeCoppersParallel(self, workers, layers, thicknesses, offsets,
+                             holes, **kwds):
+        '''Make copper layers in worker processes, and place them in z'''
+        if isinstance(holes, Part.Shape):
+            holes = shapeToBrep(holes)
+        else:
+            holes = None
+        self._pushLog('making {} copper layers with {} workers...',
+                      len(layers), workers)
+        t = time.time()
+        pool = processPool(min(workers, len(layers)), fcad=self)
+        try:
+            futures = []
+            for layer,thickness in zip(layers, thicknesses):
+                args = dict(kwds, thickness=thickness,
+                            context=self.layerContext(layer))
+                futures.append(pool.submit(_copperLayerWorker, holes, args))
+            objs = []
+            for layer,z,future in zip(layers, offsets, futures):
+                brep, elapsed = future.result()
+                self._log('layer {}: {:.3f}s', layer, elapsed)
+                if not brep:
+                    continue
+                shape = shapeFromBrep(brep)
+                self._place(shape, Vector(0,0,z))
+                objs.append(shape)
+        finally:
+            pool.shutdown()
+        self._popLog('done in {:.3f}s', time.time()-t)
+        return objs
+
+    @contextual
     def loadParts(self,z=0,combo=False,prefix=''):
         if not os.path.isdir(self.part_path):
             raise Exception('cannot find kicad package3d directory')
@@ -2383,30 +5300,37 @@ class KicadFcad:
             m_at += Vector(0,0,z)
             objs = []
             for (model_idx,model) in enumerate(m.model):
-                path = os.path.splitext(model[0])[0]
                 self._log('loading model {}/{} {} {} {}...',
                         model_idx,len(m.model), ref,value,model[0])
-                for e in ('.stp','.STP','.step','.STEP'):
-                    filename = os.path.join(self.part_path,path+e)
-                    mobj = loadModel(filename)
+                for filename in self._modelCandidates(model[0]):
+                    mobj = self._loadModel(filename)
                     if not mobj:
                         continue
                     at = product(Vector(*model.at.xyz),Vector(25.4,25.4,25.4))
                     rot = [-float(v) for v in reversed(model.rotate.xyz)]
                     pln = Placement(at,Rotation(*rot))
                     if not self.add_feature:
+                        if self.model_instances:
+                            shape = shapeInstance(mobj[0])
+                        else:
+                            shape = mobj[0].copy()
+                        shape.Placement = pln
                         if combo:
-                            obj = mobj[0].copy()
-                            obj.Placement = pln
+                            obj = shape
                         else:
-                            obj = {'shape':mobj[0].copy(),'color':mobj[1]}
-                            obj['shape'].Placement = pln
+                            obj = {'shape':shape,'color':mobj[1]}
                         objs.append(obj)
                     else:
-                        obj = self._makeObject('Part::Feature','model',
-                            label='{}#{}#{}'.format(module_idx,model_idx,ref),
-                            links='Shape',shape=mobj[0])
-                        obj.ViewObject.DiffuseColor = mobj[1]
+                        label = '{}#{}#{}'.format(module_idx,model_idx,ref)
+                        source = self._modelFeature(filename)
+                        if source is not None:
+                            obj = self._makeInstance(source,'model',label)
+                        else:
+                            obj = self._makeObject('Part::Feature','model',
+                                label=label,links='Shape',shape=mobj[0])
+                            obj.ViewObject.DiffuseColor = mobj[1]
+                            if self.model_instances:
+                                self._model_features[filename] = obj
                         obj.Placement = pln
                         objs.append(obj)
                     self._log('loaded')
@@ -2442,26 +5366,372 @@ class KicadFcad:
         return parts
 
 
+    def modelIndex(self):
+        '''Return the ModelIndex of the package3d directory'''
+        if self._model_index is None or self._model_index.root != \
+                os.path.abspath(os.path.expanduser(self.part_path)):
+            cache_dir = None
+            if self.model_cache:
+                cache_dir = ModelDiskCache.get(self.model_cache).path
+            self._model_index = ModelIndex.get(self.part_path, cache_dir)
+        return self._model_index
+
+    def _modelCandidates(self, model):
+        # STEP files that may be used for a footprint model
+        path = _model_path_vars.sub('', unquote(model))
+        if self.filename:
+            path = path.replace('${KIPRJMOD}', os.path.dirname(self.filename))
+        path = os.path.expandvars(path)
+        if not os.path.isabs(path):
+            return self.modelIndex().find(path)
+        path = os.path.splitext(path)[0]
+        return [path+e for e in ModelIndex.extensions if os.path.isfile(path+e)]
+
+    def modelFiles(self):
+        '''Return the set of STEP files used by the footprint models'''
+        files = set()
+        if not self.part_path or not os.path.isdir(self.part_path):
+            return files
+        for m in self.pcb.module:
+            for model in SexpList(getattr(m, 'model', [])):
+                for filename in self._modelCandidates(model[0]):
+                    files.add(filename)
+                    break
+        return files
+
+    def prefetchModels(self, workers=None):
+        '''Start importing the footprint models in background worker processes
+
+        Models already in memory are skipped. The workers hash the model
+        files and skip importing those found in the model disk cache. The
+        results are collected by loadParts().
+
+        Args:
+            workers: number of worker processes, default to CPU count
+
+        Returns the number of models being imported.
+        '''
+        cache_dir = None
+        if self.model_cache:
+            cache_dir = ModelDiskCache.get(self.model_cache).path
+        files = []
+        for filename in sorted(self.modelFiles()):
+            if filename in self._model_futures:
+                continue
+            obj = _model_cache.peek(filename)
+            try:
+                if obj and obj[2] == os.path.getmtime(filename):
+                    continue
+            except OSError:
+                continue
+            files.append(filename)
+        if not files:
+            return 0
+        self._log('prefetching {} models', len(files))
+        # Spawned, because importing with colors needs FreeCADGui, which
+        # must not run in a fork of the GUI process
+        pool = processPool(min(workers or os.cpu_count(), len(files)), spawn=True)
+        for filename in files:
+            self._model_futures[filename] = pool.submit(
+                    _importModelWorker, filename, cache_dir)
+        # pending imports still run, and the workers exit once done
+        pool.shutdown(wait=False)
+        return len(files)
+
+    def _loadModel(self, filename):
+        future = self._model_futures.pop(filename, None)
+        if future is not None:
+            try:
+                brep, colors, mtime, stamp, elapsed = future.result()
+                self._log('prefetched model in {:.3f}s', elapsed)
+                if stamp and self.model_cache:
+                    # saves hashing the file again
+                    ModelDiskCache.get(self.model_cache).setFileStamp(
+                            filename, stamp)
+                if brep is not None:
+                    cacheModel(filename, shapeFromBrep(brep), colors, mtime,
+                               self.model_cache)
+            except Exception as e:
+                self._log('failed to prefetch model {}: {}', filename, e,
+                          level='warning')
+        return loadModel(filename, self.model_cache)
+
+    def _modelFeature(self, filename):
+        # Return the feature of a model already made in the active document
+        if not self.model_instances:
+            return None
+        obj = self._model_features.get(filename, None)
+        if obj is None:
+            return None
+        try:
+            if obj.Document.Uid == getActiveDoc().Uid:
+                return obj
+        except Exception:
+            # deleted object
+            pass
+        del self._model_features[filename]
+        return None
+
     def loadAllParts(self,combo=False):
         logger.info("Loading parts...")
-        layer = self.layer
         objs = []
-        try:
-            self.setLayer(0)
-            objs.append(self.loadParts(combo=combo))
-        except Exception as e:
-            self._log('{}',e,level='error')
-        try:
-            self.setLayer(31)
-            objs.append(self.loadParts(combo=combo))
-        except Exception as e:
-            self._log('{}',e,level='error')
-        finally:
-            self.setLayer(layer)
+        for layer in (0, 31):
+            try:
+                objs.append(self.loadParts(combo=combo,
+                                           context=self.layerContext(layer)))
+            except Exception as e:
+                self._log('{}',e,level='error')
+        self._log('model cache: {}', _model_cache.stats(), level='log')
         fitView();
         return objs
 
 
+    def _layerTypes(self, names):
+        # copper layer indices of the given layer names
+        ret = set()
+        for name in names:
+            if name == '*.Cu':
+                ret.update([l for l,_ in self._copperLayers()])
+                continue
+            try:
+                layer,_ = self.findLayer(name)
+            except Exception:
+                continue
+            if layer <= 31:
+                ret.add(layer)
+        return ret
+
+    def _itemChanges(self, key, item, changes):
+        # Record the layers, drills and bound of a changed board item
+        layers = set()
+        points = []
+        if key == 'module':
+            m_at,_ = getAt(item)
+            points.append(m_at)
+            for p in SexpList(getattr(item, 'pad', [])):
+                layers.update(self._layerTypes(getLayers(p)))
+                if 'drill' in p:
+                    changes['holes'] = True
+            for k in ('fp_line', 'fp_arc', 'fp_circle', 'fp_poly', 'fp_rect'):
+                for g in SexpList(getattr(item, k, [])):
+                    names = getLayers(g)
+                    if 'Edge.Cuts' in names:
+                        changes['board'] = True
+                    layers.update(self._layerTypes(names))
+        elif key == 'via':
+            changes['holes'] = True
+            coppers = [l for l,_ in self._copperLayers()]
+            ends = [coppers.index(l) for l in self._layerTypes(getLayers(item))
+                        if l in coppers]
+            if ends:
+                layers.update(coppers[min(ends):max(ends)+1])
+        else:
+            names = getLayers(item)
+            if 'Edge.Cuts' in names:
+                changes['board'] = True
+            layers.update(self._layerTypes(names))
+
+        for k in ('at', 'start', 'end', 'center', 'mid'):
+            if k in item:
+                points.append(makeVect(getattr(item, k)))
+        for poly in list(SexpList(getattr(item, 'polygon', []))) + \
+                    ([item] if key == 'gr_poly' else []):
+            try:
+                points += [makeVect(xy) for xy in SexpList(poly.pts.xy)]
+            except Exception:
+                pass
+        for pt in points:
+            b = changes['bounds']
+            changes['bounds'] = (pt.x, pt.y, pt.x, pt.y) if b is None else \
+                (min(b[0],pt.x), min(b[1],pt.y), max(b[2],pt.x), max(b[3],pt.y))
+        changes['layers'].update(layers)
+
+    def update(self, filename=None):
+        '''Reload the board from a new revision of the file
+
+        Items of the previous and new revision are compared by content, and
+        only the cached results affected by the changed items are dropped, so
+        that the next make() call only rebuilds the affected copper layers.
+        This requires option `incremental`, otherwise everything is rebuilt.
+
+        The final fuse of all copper layers, i.e. make(fuseCoppers=True), is
+        always redone from scratch on any change, because a boolean result
+        cannot be partially replaced. Only the layers feeding it are reused.
+
+        Returns a dictionary of the change set, with keys 'full' (full
+        rebuild), 'items' ({key: (removed, added)} counts), 'layers'
+        (affected copper layer names), 'holes' (drills changed), 'board'
+        (outline changed), 'bounds' (bound box of the changes, None if
+        unknown, for information only), 'reused' (build time in seconds of
+        the kept results), and 'fuse' (time in seconds the dropped fuse of all
+        layers took last time, 0 if none).
+        '''
+        t = time.time()
+        if filename:
+            self.filename = filename
+        old_pcb = self.pcb
+        old_revision = self._revision
+        nets = [self.net_names[n] for n in self._nets if n in self.net_names]
+
+        self._pushLog('updating from {}...', self.filename)
+        self.board_thickness = self._user_board_thickness
+        self.stackup = self._user_stackup
+        self._layer_cache = {}
+        self._board_index = None
+        self._connectivity = None
+        self._net_codes = None
+        self._load()
+        if nets:
+            self.setNetFilter(*nets)
+
+        changes = {'full':True, 'items':{}, 'layers':set(), 'holes':False,
+                   'board':False, 'bounds':None, 'reused':0.0, 'fuse':0.0}
+        if old_revision is not None and self._revision is not None:
+            diff = diffRevisions(old_revision, self._revision)
+            changes['full'] = any([key in diff for key in RevisionFullRebuild])
+            if 'general' in diff:
+                # older versions keep item counts here, only the thickness
+                # matters
+                thickness = [getattr(getattr(pcb, 'general', None), 'thickness', None)
+                                for pcb in (old_pcb, self.pcb)]
+                if thickness[0] != thickness[1]:
+                    changes['full'] = True
+            for key,(removed,added) in diff.items():
+                if key not in RevisionItems and not key.startswith('gr_'):
+                    continue
+                changes['items'][key] = (len(removed), len(added))
+                for pcb,idx in ((old_pcb, removed), (self.pcb, added)):
+                    items = SexpList(getattr(pcb, key, []))
+                    for i in idx:
+                        self._itemChanges(key, items[i], changes)
+
+        if changes['full']:
+            self.graph.invalidate()
+            if isinstance(self.holes_cache, dict):
+                self.holes_cache.clear()
+            self.board_face = None
+        else:
+            if changes['holes']:
+                # Holes are cut from every copper layer, but the layer nodes
+                # are stamped with the holes within their bound box, and only
+                # rebuilt if those changed
+                if isinstance(self.holes_cache, dict):
+                    self.holes_cache.clear()
+            if changes['board']:
+                self.graph.invalidate('board_face')
+                self.board_face = None
+            for layer in changes['layers']:
+                self.graph.invalidate(layer=layer)
+            if changes['layers'] or changes['holes'] or changes['board']:
+                if self.graph.invalidate('coppers'):
+                    changes['fuse'] = self._fuse_time
+        changes['layers'] = sorted([unquote(self.findLayer(l)[1])
+                                        for l in changes['layers']])
+        changes['reused'] = self.graph.cost()
+
+        if changes['full']:
+            self._log('full rebuild')
+        else:
+            for key,(removed,added) in sorted(changes['items'].items()):
+                self._log('{}: {} removed, {} added', key, removed, added)
+            self._log('affected layers: {}{}{}', changes['layers'],
+                    ', holes' if changes['holes'] else '',
+                    ', board outline' if changes['board'] else '')
+            if changes['bounds']:
+                self._log('changed region: ({:.3f}, {:.3f}) - ({:.3f}, {:.3f})',
+                          *changes['bounds'])
+            if changes['fuse']:
+                self._log('fuse of all layers dropped, which took {:.3f}s',
+                          changes['fuse'])
+        self._popLog('updated in {:.3f}s, reusing {:.3f}s of cached build time',
+                     time.time()-t, changes['reused'])
+        return changes
+
+    def watch(self, output=None, interval=0.5, debounce=1.0, count=None,
+              callback=None, **kwds):
+        '''Rebuild whenever the board file is saved
+
+        The board is built once at start. The file is then polled for changes.
+        Once it has stayed unchanged for `debounce` seconds, the board is
+        reloaded with update(), reusing the parsed model and the cached
+        geometry of unaffected layers, and rebuilt with make().
+
+        Args:
+            output: optional file to write the result to, see exportShape().
+            With add_feature, the objects of the previous build are replaced
+            in the active document, whether or not there is an output.
+
+            interval: polling interval in seconds
+
+            debounce: seconds the file must stay unchanged before rebuilding
+
+            count: stop after this number of rebuilds, default to run until
+            interrupted
+
+            callback: optional function called as callback(result, changes)
+            after each rebuild
+
+            kwds: arguments passed to make()
+
+        Returns the number of rebuilds.
+        '''
+        if self._revision is None:
+            self.incremental = True
+            if isinstance(self.pcb, LazyKicadPCB):
+                self.pcb.loadAll()
+            with open(self.filename, 'rb') as f:
+                self._revision = boardRevision(f.read())
+
+        objects = []
+        def _build(changes=None):
+            if self.add_feature:
+                doc = getActiveDoc()
+                for name in objects:
+                    if doc.getObject(name):
+                        doc.removeObject(name)
+                names = set([o.Name for o in doc.Objects])
+            result = self.make(**kwds)
+            if self.add_feature:
+                objects[:] = [o.Name for o in doc.Objects if o.Name not in names]
+                doc.recompute()
+            if output:
+                exportShape(result, output)
+            if callback:
+                callback(result, changes)
+            return result
+
+        t = time.time()
+        _build()
+        self._log('watching {}, initial build in {:.3f}s', self.filename, time.time()-t)
+
+        rebuilds = 0
+        stamp = _fileStamp(self.filename)
+        try:
+            while count is None or rebuilds < count:
+                time.sleep(interval)
+                current = _fileStamp(self.filename)
+                if current is None or current == stamp:
+                    continue
+                # wait for the saving to settle
+                while True:
+                    time.sleep(debounce)
+                    settled = _fileStamp(self.filename)
+                    if settled == current:
+                        break
+                    current = settled
+                if current is None:
+                    continue
+                stamp = current
+                t = time.time()
+                changes = self.update()
+                _build(changes)
+                rebuilds += 1
+                now = time.time()
+                self._log('rebuilt in {:.3f}s, {:.3f}s after saving', now-t, now-stamp[0])
+        except KeyboardInterrupt:
+            self._log('stop watching')
+        return rebuilds
+
     def make(self,copper_thickness=0.05,fit_arcs=True,load_parts=False,
             board_thickness=None, combo=True, fuseCoppers=False):
 
@@ -2470,6 +5740,13 @@ class KicadFcad:
         if combo > 1:
             fuseCoppers = True
 
+        if load_parts and self.model_workers:
+            # import the models while making the board and coppers
+            try:
+                self.prefetchModels(self.model_workers)
+            except Exception as e:
+                self._log('failed to prefetch models: {}', e, level='warning')
+
         objs = []
         board = self.makeBoard(prefix=None,thickness=board_thickness)
         if board:
@@ -2489,9 +5766,7 @@ class KicadFcad:
             objs += self.loadAllParts(combo=True)
 
         if combo:
-            layer = self.layer
-            try:
-                self.layer = None
+            with self.useContext(self.context()._replace(layer=None)):
                 if combo > 1:
                     objs = self._makeFuse(objs,'pcb')
                 else:
@@ -2501,13 +5776,47 @@ class KicadFcad:
                         objs.ViewObject.SelectionStyle = 1
                     except Exception:
                         pass
-            finally:
-                self.setLayer(layer)
 
+        if self.graph.stats:
+            self.buildReport()
         self._popLog('all done')
         fitView();
         return objs
 
+def exportShape(obj, path):
+    '''Export the result of a make call to a file
+
+    Shapes (or lists of shapes) are written as BREP (.brep, .brp) or STEP
+    (.step, .stp). Document objects are exported by their document, which
+    is saved to path for .FCStd, or exported with Import otherwise.
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if isinstance(obj, (list, tuple)):
+        objs = [o for o in obj if o is not None]
+    else:
+        objs = [obj]
+    if all([isinstance(o, Part.Shape) for o in objs]):
+        shape = objs[0] if len(objs) == 1 else Part.makeCompound(objs)
+        if ext in ('.brep', '.brp'):
+            shape.exportBrep(path)
+        elif ext in ('.step', '.stp'):
+            shape.exportStep(path)
+        else:
+            raise ValueError('unsupported shape output: {}'.format(path))
+        return
+    if ext == '.fcstd':
+        objs[0].Document.saveAs(path)
+    else:
+        import Import
+        Import.export(objs, path)
+
+def _fileStamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
 def getTestFile(name):
     import glob
     if not os.path.exists(name):
@@ -2526,6 +5835,488 @@ def getTestFile(name):
         return [path]
     raise RuntimeError('Cannot find {}'.format(name))
 
+def benchmarkImport(repeat=5, python=None):
+    '''Measure the time of importing this module in a fresh process, in both
+    normal and headless mode
+
+    Args:
+        repeat: number of runs of each mode
+        python: interpreter to use, default to sys.executable. Must be able
+                to import FreeCAD.
+
+    Returns a dictionary of mode -> list of seconds.
+    '''
+    import subprocess
+    python = python or sys.executable
+    path = os.path.dirname(os.path.abspath(__file__))
+    code = 'import sys,time;sys.path.insert(0,{!r});import FreeCAD;'\
+           't=time.time();from {} import kicad;print(time.time()-t)'.format(
+                   os.path.dirname(path), os.path.basename(path))
+    results = {}
+    for mode,env in (('normal','0'), ('headless','1')):
+        environ = dict(os.environ)
+        environ['FCAD_PCB_HEADLESS'] = env
+        results[mode] = []
+        for _ in range(repeat):
+            out = subprocess.check_output([python, '-c', code], env=environ)
+            results[mode].append(float(out.split()[-1]))
+        logger.info('import time ({}): min {:.3f}s, mean {:.3f}s'.format(mode,
+            min(results[mode]), sum(results[mode])/len(results[mode])))
+    return results
+
+def benchmarkFuse(count=400, size=2.0, leaf_size=16, workers=1):
+    '''Time fusing `count` overlapping pads and barrels with a flat
+    multiFuse versus treeFuse()
+
+    Returns (flat seconds, tree seconds)
+    '''
+    import random
+    random.seed(0)
+    n = int(sqrt(count)) + 1
+    shapes = []
+    for i in range(count):
+        x = (i % n)*size*0.8 + random.uniform(0, size*0.2)
+        y = (i // n)*size*0.8 + random.uniform(0, size*0.2)
+        if i % 2:
+            shapes.append(Part.makeBox(size, size, 0.035, Vector(x, y, 0)))
+        else:
+            shapes.append(Part.makeCylinder(size*0.3, 1.6, Vector(x, y, -0.8)))
+    t = time.time()
+    flat = shapes[0].multiFuse(shapes[1:])
+    flat_time = time.time() - t
+    pool = processPool(workers) if workers != 1 else None
+    try:
+        t = time.time()
+        tree = treeFuse(shapes, leaf_size=leaf_size, pool=pool)
+        tree_time = time.time() - t
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    logger.info('fused {} shapes, flat: {:.3f}s, tree: {:.3f}s, '
+                'volume {:.4f}/{:.4f}'.format(count, flat_time, tree_time,
+                    flat.Volume, tree.Volume))
+    return flat_time, tree_time
+
+def benchmarkUpdate(names='kickbadge', **kwds):
+    '''Time an incremental rebuild after widening one track, and how much of
+    it is spent redoing the fuse of all copper layers
+
+    The board is copied to a temporary directory and built with
+    make(fuseCoppers=True, **kwds). The width of the first track is then
+    changed, and the board updated and built again.
+
+    Returns {board name: (initial seconds, rebuild seconds, fuse seconds)}
+    '''
+    import shutil
+    import tempfile
+    kwds.setdefault('fuseCoppers', True)
+    results = {}
+    path = tempfile.mkdtemp()
+    try:
+        for f in getTestFile(names):
+            board = os.path.join(path, os.path.basename(f))
+            with open(f, 'r') as src:
+                text = src.read()
+            with open(board, 'w') as dst:
+                dst.write(text)
+            pcb = KicadFcad(board, add_feature=False, incremental=True)
+            t = time.time()
+            pcb.make(**kwds)
+            initial = time.time() - t
+            edited = re.sub(r'(\(segment .*?\(width )([0-9.]+)',
+                    lambda m: m.group(1) + str(float(m.group(2))*1.2), text, 1)
+            if edited == text:
+                continue
+            with open(board, 'w') as dst:
+                dst.write(edited)
+            t = time.time()
+            pcb.update()
+            pcb.make(**kwds)
+            rebuild = time.time() - t
+            name = os.path.basename(f)
+            results[name] = (initial, rebuild, pcb._fuse_time)
+            logger.info('{}: initial {:.3f}s, rebuild {:.3f}s, of which {:.3f}s '
+                        'fusing all layers'.format(name, *results[name]))
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+    return results
+
+def main(argv=None):
+    '''Command line interface, run with FreeCADCmd or a Python with FreeCAD
+    in its path, e.g. `python -m fcad_pcb board.kicad_pcb -o board.step --watch`
+    '''
+    import argparse
+    import ast
+    parser = argparse.ArgumentParser(prog='fcad_pcb',
+            description='Generate FreeCAD geometry from a KiCad board')
+    parser.add_argument('board', help='kicad_pcb or kicad_mod file')
+    parser.add_argument('-o', '--output',
+            help='output file (.step, .stp, .brep, .brp, or .FCStd)')
+    parser.add_argument('-w', '--watch', action='store_true',
+            help='rebuild whenever the board file changes')
+    parser.add_argument('--interval', type=float, default=0.5,
+            help='polling interval of watch mode in seconds')
+    parser.add_argument('--debounce', type=float, default=1.0,
+            help='seconds the file must stay unchanged before rebuilding')
+    parser.add_argument('--copper-thickness', type=float, default=0.05)
+    parser.add_argument('--board-thickness', type=float)
+    parser.add_argument('--fuse', action='store_true', help='fuse coppers')
+    parser.add_argument('--no-combo', action='store_true',
+            help='do not combine the result into one compound')
+    parser.add_argument('--load-parts', action='store_true',
+            help='load the 3D models of the footprints')
+    parser.add_argument('-O', '--option', action='append', default=[],
+            metavar='NAME=VALUE', help='KicadFcad option, e.g. tile_size=20')
+    args = parser.parse_args(argv)
+
+    options = {}
+    for opt in args.option:
+        name, _, value = opt.partition('=')
+        try:
+            options[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            options[name] = value
+    if not args.output or not args.output.lower().endswith('.fcstd'):
+        options.setdefault('add_feature', False)
+    if args.watch:
+        options.setdefault('incremental', True)
+    if not FreeCAD.GuiUp:
+        setHeadless(True)
+
+    pcb = KicadFcad(args.board, **options)
+    kwds = dict(copper_thickness=args.copper_thickness,
+                board_thickness=args.board_thickness,
+                fuseCoppers=args.fuse, combo=not args.no_combo,
+                load_parts=args.load_parts)
+    if args.watch:
+        pcb.watch(args.output, interval=args.interval,
+                  debounce=args.debounce, **kwds)
+    else:
+        result = pcb.make(**kwds)
+        if args.output:
+            exportShape(result, args.output)
+    pcb.shutdownPool()
+
+def benchmarkEdgeChain(count=50000, width=0.01, radius=100.0):
+    '''Time chaining a generated outline of `count` shuffled line segments
+
+    Returns (seconds spent in chainEdges(), number of wires found)
+    '''
+    import random
+    points = [Vector(radius*cos(2*pi*i/count), radius*sin(2*pi*i/count))
+                for i in range(count)]
+    edges = []
+    for i in range(count):
+        e = Part.makeLine(points[i], points[(i+1)%count])
+        edges.append([width, e, e.firstVertex().Point, e.lastVertex().Point])
+    random.shuffle(edges)
+    t = time.time()
+    wires = list(chainEdges(edges))
+    elapsed = time.time() - t
+    logger.info('chained {} edges into {} wire(s) in {:.3f}s'.format(
+        count, len(wires), elapsed))
+    return elapsed, len(wires)
+
+def benchmarkHolePlacement(count=20000, drill=0.3):
+    '''Time making `count` via holes one by one versus bulk placement
+
+    Returns (seconds per wire, seconds with placeShapes())
+    '''
+    import random
+    placements = [(0, 0, 0, random.uniform(0,100), random.uniform(0,100), 0, 0)
+                    for _ in range(count)]
+    t = time.time()
+    for _,_,_,x,y,_,z in placements:
+        w = make_circle(Vector(drill,drill))
+        w.translate(Vector(x,y,z))
+    single = time.time() - t
+    t = time.time()
+    placeShapes(make_circle(Vector(drill,drill)), placements)
+    bulk = time.time() - t
+    logger.info('{} holes, one by one: {:.3f}s, bulk: {:.3f}s'.format(
+        count, single, bulk))
+    return single, bulk
+
+def _benchmarkModelMode(files, mode, part_path=None):
+    # Load the parts of the given boards with model_instances set to mode,
+    # and return (seconds, MB) of the placement. Meant to run in a fresh
+    # process, see benchmarkModelInstances().
+    import gc
+    pcbs = [KicadFcad(f, add_feature=False, model_instances=mode,
+                      part_path=part_path) for f in files]
+    # import the models beforehand, so that only placement is measured
+    count = 0
+    for pcb in pcbs:
+        for filename in pcb.modelFiles():
+            if loadModel(filename):
+                count += 1
+    if not count:
+        raise RuntimeError('no footprint model found')
+    gc.collect()
+    memory = residentMemory() or 0
+    t = time.time()
+    parts = [pcb.loadAllParts() for pcb in pcbs]
+    elapsed = time.time() - t
+    gc.collect()
+    return elapsed, ((residentMemory() or 0) - memory)/(1024.0*1024.0)
+
+def benchmarkModelInstances(names='', repeat=3, python=None, part_path=None):
+    '''Compare the time and memory of placing footprint models by copy and
+    by shared instances
+
+    The parts of the test boards are loaded with `model_instances` off and
+    on, each run in a fresh process (because resident memory does not shrink
+    back), and in alternating order.
+
+    Args:
+        names: test board names, see getTestFile(). The boards must use
+               footprint models found in the KiCad model library.
+        repeat: number of runs of each mode
+        python: interpreter to use, default to sys.executable. Must be able
+                to import FreeCAD.
+        part_path: KiCad 3D model library path, default to the one found in
+                   the KiCad configuration
+
+    Returns {mode: [(seconds, MB)]}
+    '''
+    import subprocess
+    if not isinstance(names,(tuple,list)):
+        names = [names]
+    files = set()
+    for name in names:
+        files.update(getTestFile(name))
+    python = python or sys.executable
+    path = os.path.dirname(os.path.abspath(__file__))
+    results = {'instance':[], 'copy':[]}
+    for i in range(repeat):
+        modes = (True, False) if i%2 == 0 else (False, True)
+        for mode in modes:
+            code = 'import sys;sys.path.insert(0,{!r});import FreeCAD;'\
+                   'from {} import kicad;'\
+                   'print(kicad._benchmarkModelMode({!r},{!r},{!r}))'.format(
+                        os.path.dirname(path), os.path.basename(path),
+                        sorted(files), mode, part_path)
+            out = subprocess.check_output([python, '-c', code])
+            elapsed,memory = out.decode().strip().splitlines()[-1].strip('()').split(',')
+            results['instance' if mode else 'copy'].append(
+                    (float(elapsed), float(memory)))
+    for name,runs in results.items():
+        logger.info('{}: min {:.3f}s, mean {:.3f}s, mean {:.1f}MB'.format(name,
+            min(t for t,_ in runs), sum(t for t,_ in runs)/len(runs),
+            sum(m for _,m in runs)/len(runs)))
+    return results
+
+def testGeometryBackend(names='kickbadge', backend='numpy', tolerance=1e-3):
+    '''Compare the copper face area of each layer made by a 2D geometry
+    backend against the default OCC backend'''
+    if not isinstance(names,(tuple,list)):
+        names = [names]
+    files = set()
+    for name in names:
+        files.update(getTestFile(name))
+    for f in files:
+        results = []
+        for name in ('occ', backend):
+            pcb = KicadFcad(f, add_feature=False, geometry_backend=name)
+            areas = {}
+            for layer,_ in pcb._copperLayers():
+                t = time.time()
+                copper = pcb.makeCopper(context=pcb.layerContext(layer))
+                areas[layer] = (copper.Area if copper else 0.0, time.time()-t)
+            results.append(areas)
+        for layer,(expected,t0) in results[0].items():
+            area,t1 = results[1][layer]
+            logger.info('{} layer {}: area {:.4f}/{:.4f}, time {:.3f}s/{:.3f}s'.format(
+                os.path.basename(f), layer, expected, area, t0, t1))
+            if abs(area - expected) > tolerance*max(1.0, expected):
+                raise AssertionError('{} layer {} area mismatch: {} vs {}'.format(
+                    f, layer, expected, area))
+
+def testConnectivity(names='kickbadge'):
+    '''Check that pads connected to a zone, e.g. by thermal relief spokes,
+    are in the same island as the zone
+
+    Each pad of a zone's net whose center lies inside the zone outline, on a
+    layer of the zone, must share an island with a filled polygon of the
+    zone on that layer.
+    '''
+    if not isinstance(names,(tuple,list)):
+        names = [names]
+    files = set()
+    for name in names:
+        files.update(getTestFile(name))
+    count = 0
+    for f in files:
+        pcb = KicadFcad(f, add_feature=False)
+        conn = pcb.connectivity()
+        islands = {}
+        for net,net_islands in conn.islands.items():
+            for i,island in enumerate(net_islands):
+                for _,item in island:
+                    islands[id(item)] = (net, i)
+        for z in pcb.pcb.zone:
+            try:
+                if z.connect_pads[0] == 'no':
+                    continue
+            except Exception:
+                pass
+            outline = [makeVect(xy) for xy in SexpList(z.polygon.pts.xy)]
+            outline = [(v.x, v.y) for v in outline]
+            targets = defaultdict(set)
+            for p in SexpList(getattr(z, 'filled_polygon', [])):
+                layer_of = p if hasattr(p, 'layer') else z
+                for layer in pcb._layerTypes(getLayers(layer_of)):
+                    targets[layer].add(islands[id(p)])
+            for island in conn.islands.get(pcb.getNet(z), []):
+                for kind,p in island:
+                    if kind != 'pad':
+                        continue
+                    x,y = conn.anchors[id(p)][0]
+                    if not _pointInPolygon(outline, x, y):
+                        continue
+                    for layer in pcb._layerTypes(getLayers(p)):
+                        if layer not in targets:
+                            continue
+                        if islands[id(p)] not in targets[layer]:
+                            raise AssertionError('{}: pad at {} not connected to '
+                                'zone {}'.format(os.path.basename(f), (x,-y),
+                                unquote(z.net_name)))
+                        count += 1
+    if not count:
+        raise AssertionError('no pad inside a zone found')
+    logger.info('checked {} zone pads'.format(count))
+
+def testThreads(names='kickbadge', threads=4, tolerance=1e-7):
+    '''Make the copper layers of a board from several threads sharing one
+    KicadFcad object, and compare with making them in one thread
+
+    The areas must match, and so must the number of memoised nodes. Every
+    node must be counted as a miss at least once, which a racy build graph
+    may fail to do.
+    '''
+    if not isinstance(names,(tuple,list)):
+        names = [names]
+    files = set()
+    for name in names:
+        files.update(getTestFile(name))
+
+    def work(pcb, errors, areas=None):
+        try:
+            for layer,_ in pcb._copperLayers():
+                ctx = pcb.layerContext(layer)
+                copper = pcb.makeCopper(holes=True, context=ctx)
+                area = copper.Area if copper else 0.0
+                if areas is not None:
+                    areas[layer] = area
+                else:
+                    errors.append((layer, area))
+        except Exception as e:
+            errors.append(e)
+
+    for f in files:
+        pcb = KicadFcad(f, add_feature=False)
+        areas = {}
+        errors = []
+        for i in range(threads):
+            work(pcb, errors, areas)
+        expected = len(pcb.graph)
+
+        pcb = KicadFcad(f, add_feature=False)
+        results = []
+        workers = [threading.Thread(target=work, args=(pcb, results))
+                    for _ in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        for r in results:
+            if isinstance(r, Exception):
+                raise r
+            layer,area = r
+            if abs(area - areas[layer]) > tolerance*max(1.0, areas[layer]):
+                raise AssertionError('{} layer {}: area {} != {}'.format(
+                    os.path.basename(f), layer, area, areas[layer]))
+        count = len(pcb.graph)
+        misses = sum([s[1] for s in pcb.graph.stats.values()])
+        if count != expected or misses < count:
+            raise AssertionError('{}: {} nodes, {} misses, expects {} nodes'.format(
+                os.path.basename(f), count, misses, expected))
+        logger.info('{}: {} threads, {} nodes, {} misses'.format(
+            os.path.basename(f), threads, count, misses))
+
+def testZoneAreas(names='kickbadge', tolerance=1e-7):
+    '''Regression test of zone hole extraction
+
+    Checks that the area enclosed by the outline and holes extracted from
+    each zone filled polygon is identical to the area of the raw polygon,
+    where the hole digging double edges cancel out in the shoelace formula.
+    '''
+    if not isinstance(names,(tuple,list)):
+        names = [names]
+    files = set()
+    for name in names:
+        files.update(getTestFile(name))
+    count = 0
+    for f in files:
+        pcb = KicadFcad(f, add_feature=False)
+        for z in pcb.pcb.zone:
+            for p in SexpList(getattr(z, 'filled_polygon', [])):
+                pts = [(xy[0], xy[1]) for xy in SexpList(p.pts.xy)]
+                expected = 0.0
+                for i,(x,y) in enumerate(pts):
+                    x2,y2 = pts[(i+1)%len(pts)]
+                    expected += x*y2 - x2*y
+                expected = abs(expected)*0.5
+
+                outline, holes = extractPolygonHoles(pts)
+                area = Part.Face(makePolygon(outline)).Area
+                for h in holes:
+                    area -= Part.Face(makePolygon(h)).Area
+                if abs(area - expected) > tolerance*max(1.0, expected):
+                    raise AssertionError('{}: zone area {} != {}'.format(
+                        os.path.basename(f), area, expected))
+                count += 1
+    logger.info('checked {} zone polygons'.format(count))
+
+def testWatch(names='pads', output='board.FCStd', count=2):
+    '''Check that each rebuild of watch() replaces the objects of the previous
+    build in the document, instead of adding to them
+
+    The board is copied to a temporary directory, and touched after each
+    build to trigger the next one.
+
+    Args:
+        output: optional output file name, default 'board.FCStd', written into
+        the temporary directory
+    '''
+    import shutil
+    import tempfile
+    path = tempfile.mkdtemp()
+    try:
+        for f in getTestFile(names):
+            board = os.path.join(path, os.path.basename(f))
+            shutil.copy(f, board)
+            doc = FreeCAD.newDocument('kicad_fcad_watch')
+            try:
+                counts = []
+                def touch(_result, _changes):
+                    counts.append(len(doc.Objects))
+                    t = time.time() + len(counts)
+                    os.utime(board, (t, t))
+                pcb = KicadFcad(board)
+                pcb.watch(os.path.join(path, output) if output else None,
+                          interval=0.01, debounce=0.05, count=count,
+                          callback=touch)
+                if len(counts) != count+1 or len(set(counts)) != 1:
+                    raise AssertionError('{}: object count changed by '
+                        'rebuild, {}'.format(os.path.basename(f), counts))
+                logger.info('{}: {} objects after each of {} builds'.format(
+                    os.path.basename(f), counts[0], len(counts)))
+            finally:
+                FreeCAD.closeDocument(doc.Name)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
 def test(names=''):
     if not isinstance(names,(tuple,list)):
         names = [names]
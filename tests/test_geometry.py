@@ -0,0 +1,125 @@
+'''Tests of the NumPy geometry backend, which run in plain CPython
+
+Only geometry.py is imported, so FreeCAD is not needed. Run with
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+import random
+from math import pi
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import geometry
+
+ACCURACY = 0.001
+
+@pytest.fixture
+def backend():
+    return geometry.getBackend('numpy', accuracy=ACCURACY)
+
+def _close(value, expected, tol=1e-6):
+    return abs(value - expected) <= tol*max(1.0, abs(expected))
+
+def test_backend_names():
+    assert 'numpy' in geometry.backendNames()
+    assert 'occ' in geometry.backendNames()
+    with pytest.raises(ValueError):
+        geometry.getBackend('nonexistent')
+
+def test_primitives(backend):
+    assert _close(backend.rect(2, 3).area, 6)
+    # inscribed polygon within accuracy of the circle
+    assert _close(backend.circle(2).area, pi, 2*ACCURACY)
+    assert _close(backend.oval(3, 1).area, 2 + pi*0.25, 2*ACCURACY)
+    assert _close(backend.oval(1, 3).area, 2 + pi*0.25, 2*ACCURACY)
+    # clockwise input is normalized
+    square = backend.polygon([(0,0), (0,1), (1,1), (1,0)])
+    assert _close(square.area, 1)
+
+def test_booleans(backend):
+    a = backend.rect(2, 2)
+    b = backend.rect(2, 2, (1, 1))
+    assert _close(backend.union([a, b]).area, 7)
+    assert _close(backend.difference(a, [b]).area, 3)
+    assert _close(backend.intersection(a, [b]).area, 1)
+    assert not backend.intersection(a, [backend.rect(1, 1, (5, 5))])
+
+def test_degenerate_booleans(backend):
+    # shared edge
+    touch = backend.union([backend.rect(1, 1), backend.rect(1, 1, (1, 0))])
+    assert _close(touch.area, 2)
+    assert len(touch) == 1
+    # shared corner
+    pinch = backend.union([backend.rect(1, 1), backend.rect(1, 1, (1, 1))])
+    assert _close(pinch.area, 2)
+    # identical
+    dup = backend.union([backend.rect(1, 1), backend.rect(1, 1)])
+    assert _close(dup.area, 1)
+    assert len(dup) == 1
+
+def test_holes(backend):
+    region = backend.difference(backend.rect(10, 10),
+                                [backend.circle(2, (-2, 0)), backend.rect(2, 2, (2, 0))])
+    outlines = region.outlines()
+    assert len(outlines) == 1
+    assert len(outlines[0][1]) == 2
+    assert _close(region.area, 100 - 4 - pi, 2*ACCURACY)
+
+def test_offset(backend):
+    square = backend.rect(2, 2)
+    assert _close(backend.offset(square, 0.5).area, 4 + 4 + pi*0.25, 2*ACCURACY)
+    assert _close(backend.offset(square, -0.5).area, 1)
+
+def test_stroke(backend):
+    # two perpendicular segments with round ends and joint
+    track = backend.stroke([(0,0), (10,0), (10,10)], 1)
+    expected = 20 - 0.25 + pi*0.25 + pi*0.0625
+    assert _close(track.area, expected, 2*ACCURACY)
+    assert len(track) == 1
+    dot = backend.stroke([(1, 1)], 1)
+    assert _close(dot.area, pi*0.25, 5*ACCURACY)
+
+def test_transform(backend):
+    rect = backend.transform(backend.rect(4, 2), dx=10, dy=5, angle=90)
+    x0, y0, x1, y1 = rect.bounds()
+    assert _close(x0, 9) and _close(x1, 11)
+    assert _close(y0, 3) and _close(y1, 7)
+
+def test_pad_with_drill(backend):
+    # a plated pad with its drill, as in makePads(holes=True)
+    pad = backend.difference(backend.oval(3, 1.5), [backend.circle(0.8)])
+    assert _close(pad.area, 1.5*1.5 + pi*0.75**2 - pi*0.16, 5*ACCURACY)
+
+def test_many_circles(backend):
+    random.seed(1)
+    circles = [backend.circle(0.5, (random.uniform(0, 10), random.uniform(0, 10)))
+               for _ in range(300)]
+    union = backend.union(circles)
+    # the union is bounded by the sum and the largest single area
+    assert circles[0].area < union.area < sum([c.area for c in circles])
+    # fusing in two halves gives the same area
+    halves = backend.union([backend.union(circles[:150]),
+                            backend.union(circles[150:])])
+    assert _close(halves.area, union.area, 1e-6)
+
+def test_winding_numbers():
+    random.seed(2)
+    rings = []
+    for _ in range(50):
+        x, y = random.uniform(0, 10), random.uniform(0, 10)
+        n = random.randint(3, 12)
+        rings.append(numpy.array([(x + random.uniform(-1, 1), y + random.uniform(-1, 1))
+                                  for _ in range(n)]))
+    edges = geometry._ringEdges(rings)
+    points = numpy.array([(random.uniform(-1, 11), random.uniform(-1, 11))
+                          for _ in range(500)])
+    # include points at vertex heights, the edge case of the band split
+    points = numpy.vstack((points, edges[:50,:2] + (0.01, 0)))
+    expected = geometry._windingNumbers(edges, points, 4000000)
+    assert (geometry.windingNumbers(edges, points) == expected).all()